@@ -0,0 +1,58 @@
+"""
+Related notes index benchmark: recall@10 and query time of the IVF index against the exact search.
+
+    python benchmarks/ann.py [--notes 200000] [--dim 384] [--noise 1.5] [--queries 200]
+"""
+import argparse
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from hackernotes.core.ann import ANN_DEFAULTS, IVFIndex
+from hackernotes.core.embeddings import normalize
+
+def clustered_vectors(n: int, dim: int, clusters: int, noise: float, seed: int = 0) -> np.ndarray:
+    """Synthetic note vectors: noisy points around random topics."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return normalize(centers[rng.integers(clusters, size=n)] + noise * rng.normal(size=(n, dim))).astype(np.float32)
+
+def timed_search(index: IVFIndex, queries: np.ndarray, k: int, **kwargs):
+    started = time.perf_counter()
+    results = [{note_id for note_id, _ in index.search(q, k, **kwargs)} for q in queries]
+    return results, (time.perf_counter() - started) / len(queries) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=1.5, help="Spread of the notes around their topic.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    vectors = clustered_vectors(args.notes, args.dim, args.clusters, args.noise)
+    note_ids = [f"n{i}" for i in range(args.notes)]
+    queries = vectors[np.random.default_rng(1).choice(args.notes, size=args.queries, replace=False)]
+
+    with tempfile.TemporaryDirectory() as base_dir:
+        index = IVFIndex(ws=SimpleNamespace(base_dir=base_dir), settings=ANN_DEFAULTS)
+        started = time.perf_counter()
+        index.build(note_ids, vectors)
+        nlist = index.centroids.shape[0]
+        print(f"Built {nlist} lists over {args.notes} notes ({args.dim} dims) in {time.perf_counter() - started:.1f}s")
+
+        exact, exact_ms = timed_search(index, queries, args.k, exact=True)
+        print(f"{'exact':>8}  recall@{args.k} 1.000  {exact_ms:8.2f} ms/query")
+        for nprobe in (1, 2, 4, 8, 16, 32, 64):
+            if nprobe > nlist:
+                break
+            approx, approx_ms = timed_search(index, queries, args.k, nprobe=nprobe)
+            recall = np.mean([len(a & e) / args.k for a, e in zip(approx, exact)])
+            print(f"nprobe {nprobe:>2}  recall@{args.k} {recall:.3f}  {approx_ms:8.2f} ms/query  ({exact_ms / approx_ms:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Engine profile benchmark: bulk ingest (`NoteCRUD.bulk_create`, one transaction per batch) and concurrent
+read threads (snippet counts per tag) on a default SQLite engine (rollback journal, full sync,
+default cache) against the tuned profiles of `hackernotes.db.ENGINE_PROFILES` ("bulk" and "analytics").
+
+    python benchmarks/engine.py [--notes 2000] [--snippets 20] [--batch 50] [--threads 8] [--queries 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.dirname(__file__))
+from ingest import count_rows, make_notes # noqa: E402
+
+from hackernotes.db import get_engine
+from hackernotes.db.migrations import migrate
+from hackernotes.db.models import Workspace
+from hackernotes.db.query import NoteCRUD
+
+READ_QUERY = text("SELECT count(*) FROM snippet_tag WHERE tag_name = :tag")
+
+def default_engine(path: str):
+    return create_engine(f"sqlite:///{path}", future=True)
+
+def ingest(engine, notes, batch: int) -> float:
+    migrate(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Workspace(id="ws", name="bench", model_backend="stub"))
+    session.commit()
+    started = time.perf_counter()
+    for i in range(0, len(notes), batch):
+        NoteCRUD.bulk_create(session, "ws", notes[i:i + batch])
+    elapsed = time.perf_counter() - started
+    session.close()
+    return elapsed
+
+def read(engine, threads: int, queries: int) -> float:
+    def worker(seed: int):
+        with engine.connect() as conn:
+            for i in range(queries):
+                conn.execute(READ_QUERY, {"tag": f"tag{(seed * 31 + i) % 200}"}).all()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(worker, range(threads)))
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=2000)
+    parser.add_argument("--snippets", type=int, default=20, help="Snippets per note.")
+    parser.add_argument("--batch", type=int, default=50, help="Notes per bulk transaction.")
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent readers.")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per reader.")
+    args = parser.parse_args()
+
+    notes = make_notes(args.notes, args.snippets)
+    rows = count_rows(notes)
+    reads = args.threads * args.queries
+    print(f"{args.notes} notes x {args.snippets} snippets: {rows} rows, {args.threads} readers x {args.queries} queries")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, writer, reader in (
+            ("default", default_engine, default_engine),
+            ("profiles", lambda path: get_engine(path, profile="bulk"), lambda path: get_engine(path, profile="analytics")),
+        ):
+            path = os.path.join(directory, f"{name}.db")
+            elapsed = ingest(writer(path), notes, args.batch)
+            print(f"{name:>9} ingest  {elapsed:8.3f}s  {rows / elapsed:10.0f} rows/s")
+            elapsed = read(reader(path), args.threads, args.queries)
+            print(f"{name:>9} reads   {elapsed:8.3f}s  {reads / elapsed:10.0f} queries/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Note store ingest benchmark: notes with annotated snippets inserted one snippet at a time (`SnippetCRUD.create`,
+a transaction and point lookups per snippet) against the bulk path (`NoteCRUD.bulk_create`, one transaction),
+in rows per second (notes, snippets, new tags and entities, association rows).
+
+    python benchmarks/ingest.py [--notes 200] [--snippets 50] [--batch 100]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import List
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from hackernotes.db.migrations import migrate
+from hackernotes.db.models import Note, Workspace
+from hackernotes.db.query import NoteCRUD, SnippetCRUD
+
+WORDS = "deploy cluster budget review release search vector meeting travel invoice design refactor".split()
+
+def make_notes(count: int, snippets: int, seed: int = 0) -> List[dict]:
+    rng = random.Random(seed)
+    tags = [f"tag{i}" for i in range(200)]
+    entities = [f"Entity{i}" for i in range(500)]
+    return [
+        dict(title=f"Note {i}", snippets=[
+            dict(
+                content=" ".join(rng.choices(WORDS, k=12)),
+                tags=set(rng.sample(tags, rng.randint(0, 3))),
+                entities=set(rng.sample(entities, rng.randint(0, 2))),
+            )
+            for _ in range(snippets)
+        ])
+        for i in range(count)
+    ]
+
+def count_rows(notes: List[dict]) -> int:
+    """Rows written for the notes: notes, snippets, association rows and distinct tags and entities."""
+    snippets = [snippet for note in notes for snippet in note["snippets"]]
+    tags = {tag for snippet in snippets for tag in snippet["tags"]}
+    entities = {entity for snippet in snippets for entity in snippet["entities"]}
+    links = sum(len(snippet["tags"]) + len(snippet["entities"]) for snippet in snippets)
+    return len(notes) + len(snippets) + links + len(tags) + len(entities)
+
+def new_session(directory: str, name: str):
+    engine = create_engine(f"sqlite:///{os.path.join(directory, name)}.db", future=True)
+    migrate(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Workspace(id="ws", name="bench", model_backend="stub"))
+    session.commit()
+    return session
+
+def per_snippet(session, notes: List[dict]):
+    for i, note in enumerate(notes):
+        session.add(Note(id=f"note-{i}", workspace_id="ws", title=note["title"]))
+        session.flush()
+        for position, snippet in enumerate(note["snippets"]):
+            SnippetCRUD.create(session, note_id=f"note-{i}", position=position, **snippet)
+    session.commit()
+
+def bulk(session, notes: List[dict], batch: int):
+    for i in range(0, len(notes), batch):
+        NoteCRUD.bulk_create(session, "ws", notes[i:i + batch])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=200)
+    parser.add_argument("--snippets", type=int, default=50, help="Snippets per note.")
+    parser.add_argument("--batch", type=int, default=100, help="Notes per bulk transaction.")
+    args = parser.parse_args()
+
+    notes = make_notes(args.notes, args.snippets)
+    rows = count_rows(notes)
+    print(f"{args.notes} notes x {args.snippets} snippets: {rows} rows")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, ingest in (("per snippet", per_snippet), ("bulk", lambda session, notes: bulk(session, notes, args.batch))):
+            session = new_session(directory, name.replace(" ", "_"))
+            started = time.perf_counter()
+            ingest(session, notes)
+            elapsed = time.perf_counter() - started
+            session.close()
+            print(f"{name:>12}  {elapsed:8.3f}s  {rows / elapsed:10.0f} rows/s")
+
+if __name__ == "__main__":
+    main()
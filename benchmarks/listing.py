@@ -0,0 +1,72 @@
+"""
+Note listing benchmark: peak Python memory and time to go through every note of a workspace loaded at once
+(`NoteCRUD.list_by_workspace`, ORM objects with their snippets and annotations) against streamed listing rows
+(`NoteCRUD.iter_by_workspace`, `yield_per`), and the time of a keyset page (`NoteCRUD.page`) near the start
+and near the end of the listing against the same page read with OFFSET.
+
+    python benchmarks/listing.py [--notes 200000] [--batch 10000] [--page-size 50]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from hackernotes.db import get_engine
+from hackernotes.db.migrations import migrate
+from hackernotes.db.models import Note, Workspace
+from hackernotes.db.query import LISTING_COLUMNS, LISTING_ORDER, NoteCRUD, encode_cursor
+
+WORKSPACE = "bench"
+
+def measure(fn):
+    """Runs the function, returns its result, time and peak traced memory (MB)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024**2
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=10_000, help="Notes per bulk transaction when loading.")
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = get_engine(os.path.join(directory, "listing.db"), profile="bulk")
+        migrate(engine)
+        session = sessionmaker(bind=engine)()
+        session.add(Workspace(id="ws", name=WORKSPACE, model_backend="stub"))
+        session.commit()
+        for i in range(0, args.notes, args.batch):
+            NoteCRUD.bulk_create(session, "ws", [dict(title=f"Note {j}", snippets=[]) for j in range(i, min(i + args.batch, args.notes))])
+        print(f"{args.notes} notes")
+
+        count, elapsed, peak = measure(lambda: sum(1 for _ in NoteCRUD.iter_by_workspace(session, WORKSPACE)))
+        print(f"{'streamed':>10}  {elapsed:8.3f}s  {peak:8.1f} MB peak  ({count} notes)")
+        session.expunge_all()
+        notes, elapsed, peak = measure(lambda: NoteCRUD.list_by_workspace(session, WORKSPACE))
+        print(f"{'all at once':>10}  {elapsed:8.3f}s  {peak:8.1f} MB peak  ({len(notes)} notes)")
+        del notes
+        session.expunge_all()
+
+        # Page near the end: after the row at this offset
+        offset = max(args.notes - 2 * args.page_size, 0)
+        listing = select(*LISTING_COLUMNS).where(Note.workspace_id == "ws", Note.archived == False).order_by(*LISTING_ORDER)
+        last = session.execute(listing.offset(offset - 1).limit(1)).one() if offset else None
+        for name, cursor, skip in (("first page", None, 0), ("deep page", last and encode_cursor(last.updated_at, last.id), offset)):
+            (rows, _), keyset, _ = measure(lambda: NoteCRUD.page(session, WORKSPACE, cursor=cursor, page_size=args.page_size))
+            offset_rows, offset_time, _ = measure(lambda: session.execute(listing.offset(skip).limit(args.page_size)).all())
+            assert [row.id for row in rows] == [row.id for row in offset_rows]
+            print(f"{name:>10}  keyset {keyset * 1000:8.2f} ms  offset {offset_time * 1000:8.2f} ms")
+        session.close()
+
+if __name__ == "__main__":
+    main()
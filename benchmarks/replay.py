@@ -0,0 +1,64 @@
+"""
+AI pipeline benchmark on a cassette (see `CassetteBackend`): the model calls of the pipeline (annotation of a
+few notes, then a streamed rewrite) are recorded once against a live server, then replayed offline and
+deterministically, with the recorded latencies or scaled ones.
+
+    python benchmarks/replay.py record --cassette pipeline.jsonl [--backend ollama]
+    python benchmarks/replay.py replay --cassette pipeline.jsonl [--latency-scale 1] [--rounds 3]
+"""
+import argparse
+import os
+import statistics
+import time
+from typing import Dict
+
+import hackernotes.utils.llm as llm
+from hackernotes.core.ai import extract_annotations, generate_stream
+
+NOTES = [
+    "Deploying the kubernetes cluster with Alice before the release on Friday.",
+    "Reading about vector databases and approximate nearest neighbour search.",
+    "Call Bob about the quarterly budget review, the numbers look off.",
+    "Trip to Lisbon in June: book the flights, ask Carol for the conference tickets.",
+]
+
+def run_pipeline() -> Dict[str, float]:
+    """Runs the pipeline with the response cache and the local annotators off, so every step calls the model."""
+    timings = {}
+    started = time.perf_counter()
+    for note in NOTES:
+        extract_annotations(note, use_cache=False, verbose=False, local_tagger=False, local_times=False)
+    timings["annotate"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    "".join(generate_stream("rewrite", "\n\n".join(NOTES), use_cache=False))
+    timings["rewrite (stream)"] = time.perf_counter() - started
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--cassette", default="pipeline.jsonl", help="Cassette file.")
+    parser.add_argument("--backend", default="ollama", help="Record mode: the backend to record.")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Replay mode: multiplier of the recorded latencies (0 for instant).")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    settings = {"mode": args.mode, "path": os.path.abspath(args.cassette), "latency_scale": args.latency_scale, "backend": args.backend}
+    if args.mode == "record" and os.path.exists(settings["path"]):
+        os.remove(settings["path"])
+    # Every call of the pipeline goes to the cassette, whatever the workspace backend
+    llm.model_settings = lambda backend=None: ("cassette", settings)
+
+    rounds = 1 if args.mode == "record" else args.rounds
+    timings: Dict[str, list] = {}
+    for _ in range(rounds):
+        for step, elapsed in run_pipeline().items():
+            timings.setdefault(step, []).append(elapsed)
+
+    print(f"{args.mode} {settings['path']}" + (f", latency scale {args.latency_scale}" if args.mode == "replay" else ""))
+    for step, values in timings.items():
+        print(f"{step:>20}  median {statistics.median(values):7.3f}s  min {min(values):7.3f}s  max {max(values):7.3f}s")
+
+if __name__ == "__main__":
+    main()
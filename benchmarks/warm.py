@@ -0,0 +1,57 @@
+"""
+Model residency benchmark: latency of an extraction call on a cold model (just unloaded) against a warm one,
+with the same system prompt as the previous call (prompt cache prefix) or a different one.
+
+    python benchmarks/warm.py [--backend ollama] [--rounds 3]
+    python benchmarks/warm.py --backend stub --cold-start-ms 2000
+"""
+import argparse
+import statistics
+import time
+
+from hackernotes.core.ai import ExtractedAnnotations, ExtractedTags, _annotations_sys_prompt
+from hackernotes.utils.llm import _messages, get_backend
+from hackernotes.utils.llm.backends import BACKENDS
+
+NOTES = [
+    "Deploying the kubernetes cluster with Alice before the release on Friday.",
+    "Reading about vector databases and approximate nearest neighbour search.",
+    "Call Bob about the quarterly budget review, the numbers look off.",
+]
+
+def timed_call(backend, sys_prompt: str, note: str, format: dict) -> float:
+    started = time.perf_counter()
+    backend.chat(_messages(sys_prompt, note), format=format)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=None, help="Model backend, the workspace one by default.")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--cold-start-ms", type=int, default=2000, help="Stub backend: simulated model load time.")
+    args = parser.parse_args()
+
+    if args.backend == "stub":
+        backend = BACKENDS["stub"]({"cold_start_ms": args.cold_start_ms, "latency_ms": 50})
+    else:
+        backend = get_backend(args.backend)
+    print(f"Backend {backend.name}, model {backend.model}, keep_alive {getattr(backend, 'keep_alive', None)}")
+
+    combined = (_annotations_sys_prompt(True, True, False), ExtractedAnnotations.model_json_schema())
+    tags_only = (_annotations_sys_prompt(True, False, False), ExtractedTags.model_json_schema())
+
+    timings = {"cold": [], "warm, same prefix": [], "warm, other prefix": []}
+    for i in range(args.rounds):
+        backend.unload()
+        timings["cold"].append(timed_call(backend, combined[0], NOTES[0], combined[1]))
+        timings["warm, same prefix"].append(timed_call(backend, combined[0], NOTES[1 + i % 2], combined[1]))
+        timings["warm, other prefix"].append(timed_call(backend, tags_only[0], NOTES[1 + i % 2], tags_only[1]))
+
+    for name, values in timings.items():
+        print(f"{name:>20}  median {statistics.median(values):7.3f}s  min {min(values):7.3f}s  max {max(values):7.3f}s")
+
+    backend.unload()
+    print(f"{'warm-up':>20}  {backend.warm_up():7.3f}s")
+
+if __name__ == "__main__":
+    main()
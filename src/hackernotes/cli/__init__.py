@@ -6,7 +6,7 @@ import click
 
 from ..utils.config import config, CONFIG_DIR, CONFIG_PATH
 from ..utils.term import print_err, input_sys, print_sys
-from ..db import delete_db
+from ..db import ENGINE_PROFILES, delete_db, use_profile
 
 DB_PATH = config["db_path"]
 
@@ -21,11 +21,13 @@ def preflight():
     # click.echo("Preflight checks passed.")
 
 @click.group()
-def hn():
+@click.option('--db-profile', type=click.Choice(list(ENGINE_PROFILES)), help="Database engine profile of the command (default from config).")
+def hn(db_profile):
     """HackerNotes CLI (alias: hn)"""
     # click.echo("Welcome to HackerNotes CLI!")
     # preflight()
-    pass
+    if db_profile:
+        use_profile(db_profile)
 
 @hn.command()
 def erase():
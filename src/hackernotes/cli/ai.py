@@ -1,17 +1,37 @@
+import os
+import time
+
 import click
 from prompt_toolkit import PromptSession
 from prompt_toolkit.history import InMemoryHistory
 from prompt_toolkit.formatted_text import HTML
+from tabulate import tabulate
 
-from ..core.ai import extract_annotations
-from ..core.ai import generate as ai_generate
+from ..core.ai import extract_annotations, get_predefined_prompt, log_annotated, pending_annotation
+from ..core.automation import automation_config, ensure_schema, run_workers
+from ..core.batch import annotate_notes
+from ..core.chat import ChatSession, ask
+from ..core.context import ContextReport, pack_context
+from ..core.embeddings import EmbeddingIndex
+from ..core.fanout import FanOutReport, PromptResult, prompt_notes
+from ..core.gazetteer import Gazetteer, evaluate as evaluate_gazetteer, get_gazetteer
+from ..core.mapreduce import MapReduceReport, map_reduce_stream
+from ..core.search import keyword_search, semantic_search
+from ..core.tagger import evaluate, get_tagger, tagger_config
 from hackernotes.core.annotations import Annotations
 from hackernotes.core.note import Note
-from hackernotes.core.types import EntityType
+from hackernotes.core.types import EntityType, TaskStatus
+from hackernotes.core.workspace import Workspace
 from hackernotes.db import SessionLocal
-from hackernotes.utils.datetime import INPUT_DATE_FORMATS
+from hackernotes.db.query import TaskCRUD
+from hackernotes.utils.config import config
+from hackernotes.utils.datetime import INPUT_DATE_FORMATS, dt_dumps
+from hackernotes.utils.cache import get_cache
+from hackernotes.utils.llm import GenerationStats, get_backend, get_scheduler
+from hackernotes.utils.llm.scheduler import PRIORITIES
+from hackernotes.utils.llm.metrics import get_metrics
 from hackernotes.utils.parsers import line2tags, tags2line
-from hackernotes.utils.term import fsys, ftag, print_sys, print_warn
+from hackernotes.utils.term import clear_previous_line, clear_terminal, fentity, fstatus, fsys, ftag, print_sys, print_warn
 
 from . import hn
 
@@ -22,44 +42,308 @@ def ai():
     pass
 
 @ai.command()
-def queue():
+@click.option('--status', '-s', type=click.Choice(TaskStatus.to_list(), case_sensitive=False), help="Only tasks with this status.")
+@click.option('--limit', '-l', type=int, default=20, help="Limit the number of tasks displayed.")
+@click.option('--watch', '-w', is_flag=True, help="Refresh the queue state every few seconds.")
+def queue(status, limit, watch):
     """List all queued tasks."""
-    pass
+    if not ensure_schema():
+        return
+    workspace = config.get("active_workspace")
+    while True:
+        with SessionLocal() as session:
+            counts = TaskCRUD.counts(session, workspace=workspace)
+            tasks = TaskCRUD.list(session, workspace=workspace, status=status and status.upper(), limit=limit)
+            table = [
+                [
+                    fsys(str(task.id)),
+                    task.task_type,
+                    task.note_id or "",
+                    fstatus(task.status),
+                    str(task.attempts),
+                    dt_dumps(task.scheduled_at) if task.scheduled_at else "",
+                    dt_dumps(task.executed_at) if task.executed_at else "",
+                    task.status_detail or task.result or "",
+                ]
+                for task in tasks
+            ]
+        if watch:
+            clear_terminal()
+        print(fsys("Tasks:"), ", ".join(f"{fstatus(s)} {counts.get(s, 0)}" for s in TaskStatus.to_list()))
+        click.echo(
+            tabulate(
+                table,
+                headers=[fsys(h) for h in ["ID", "Type", "Note", "Status", "Attempts", "Scheduled At", "Executed At", "Detail"]],
+                tablefmt="grid",
+                maxcolwidths=40,
+                disable_numparse=True,
+            )
+        )
+        if not watch:
+            return
+        time.sleep(2)
 
 @ai.command()
-def dequeue():
+@click.argument('task_id', type=int, required=False)
+def dequeue(task_id):
     """Dequeue a task. Or all tasks if no task is specified."""
-    pass
+    if not ensure_schema():
+        return
+    with SessionLocal() as session:
+        deleted = TaskCRUD.delete(session, task_id=task_id, workspace=config.get("active_workspace"))
+    if task_id is not None and not deleted:
+        print_warn(f"No task found with ID: {task_id}")
+        return
+    print_sys(f"Dequeued {deleted} tasks.")
 
 @ai.command()
 @click.argument('note_id')
+def enqueue(note_id):
+    """Queue a note for background AI annotation."""
+    note = Note.read(note_id)
+    if note and note.to_queue():
+        print_sys(f"Note {note_id} added to the queue.")
+
+@ai.command()
+@click.option('--workers', '-w', type=int, default=None, help="Number of concurrent workers (default from config).")
+@click.option('--once', is_flag=True, help="Exit when there are no due tasks left instead of polling.")
+def worker(workers, once):
+    """Run the background workers executing the queued tasks."""
+    settings = automation_config()
+    print_sys(f"Running {workers or settings['workers']} workers on workspace '{config.get('active_workspace')}'...")
+    run_workers(workers=workers, once=once, settings=settings)
+
+@ai.command()
+@click.option('--clear', is_flag=True, help="Remove all cached responses.")
+def cache(clear):
+    """Show the LLM response cache statistics."""
+    llm_cache = get_cache()
+    if llm_cache is None:
+        print_warn("LLM response cache is disabled.")
+        return
+    if clear:
+        llm_cache.clear()
+        print_sys("LLM response cache cleared.")
+        return
+    stats = llm_cache.stats()
+    print(fsys("Path:"), llm_cache.path)
+    print(fsys("Entries:"), stats["entries"])
+    print(fsys("Size:"), f"{stats['size_bytes'] / 1024:.1f} KiB / {stats['max_bytes'] / 1024 / 1024:.0f} MiB")
+    print(fsys("Hits / misses:"), f"{stats['hits']} / {stats['misses']} ({stats['hit_rate']:.0%} hit rate)")
+    print(fsys("Evicted / expired:"), f"{stats['evictions']} / {stats['expired']}")
+
+@ai.command()
+def warmup():
+    """Load the model now, so that the next AI commands do not wait for it."""
+    backend = get_backend()
+    print_sys(f"Loading {backend.model}...")
+    loaded_in = backend.warm_up()
+    clear_previous_line()
+    keep_alive = getattr(backend, "keep_alive", None)
+    print_sys(f"{backend.model} ready in {loaded_in:.2f}s" + (f", kept loaded for {keep_alive}." if keep_alive is not None else "."))
+
+@ai.command()
+@click.option('--since', '-s', type=click.DateTime(formats=INPUT_DATE_FORMATS), help="Only the calls made after this date.")
+@click.option('--clear', is_flag=True, help="Remove all recorded calls.")
+def stats(since, clear):
+    """Show the model call latencies and token usage, per prompt and model."""
+    metrics = get_metrics()
+    if metrics is None:
+        print_warn("LLM call metrics are disabled.")
+        return
+    if clear:
+        metrics.clear()
+        print_sys("LLM call metrics cleared.")
+        return
+    aggregated = metrics.aggregate(since=since.timestamp() if since else None)
+    if not aggregated:
+        print_sys("No model calls recorded yet.")
+        return
+    seconds = lambda value: f"{value:.2f}s" if value is not None else ""
+    table = [
+        [
+            fsys(row["prompt"]),
+            row["model"],
+            str(row["calls"]),
+            str(row["cached"]),
+            str(row["errors"]),
+            seconds(row["queue_wait"]),
+            seconds(row["ttft"]),
+            seconds(row["p50"]),
+            seconds(row["p95"]),
+            str(row["prompt_tokens"]),
+            str(row["completion_tokens"]),
+            f"{row['tokens_per_s']:.1f}",
+        ]
+        for row in aggregated
+    ]
+    click.echo(
+        tabulate(
+            table,
+            headers=[fsys(h) for h in ["Prompt", "Model", "Calls", "Cached", "Errors", "Queue", "TTFT", "p50", "p95", "Prompt Tok", "Compl. Tok", "Tok/s"]],
+            tablefmt="grid",
+            disable_numparse=True,
+        )
+    )
+    if metrics.trace_path:
+        print(fsys("Trace:"), metrics.trace_path)
+
+@ai.command()
+@click.option('--cancel', 'cancel_class', type=click.Choice(PRIORITIES + ["all"]), help="Cancel the waiting model requests of a priority class.")
+def scheduler(cancel_class):
+    """Show the model requests waiting and running per priority class, of all the hn processes."""
+    llm_scheduler = get_scheduler()
+    if llm_scheduler is None:
+        print_warn("LLM request scheduler is disabled.")
+        return
+    if cancel_class:
+        cancelled = llm_scheduler.cancel(None if cancel_class == "all" else cancel_class)
+        print_sys(f"Cancelled {cancelled} waiting model requests.")
+        return
+    status = llm_scheduler.status()
+    settings = llm_scheduler.settings
+    table = [
+        [
+            fsys(name),
+            str(status[name]["running"]),
+            str(settings["limits"][name]),
+            str(status[name]["waiting"]),
+            str(settings["max_queue"][name]),
+        ]
+        for name in PRIORITIES
+    ]
+    click.echo(
+        tabulate(
+            table,
+            headers=[fsys(h) for h in ["Priority", "Running", "Limit", "Waiting", "Max Queue"]],
+            tablefmt="grid",
+            disable_numparse=True,
+        )
+    )
+    print(fsys("Slots:"), f"{settings['max_concurrency']} ({settings['reserved_interactive']} reserved to interactive requests)")
+
+@ai.command()
+@click.option('--rebuild', is_flag=True, help="Re-learn the tagger from the notes.")
+@click.option('--folds', type=int, default=5, help="Number of cross-validation folds of the evaluation.")
+@click.option('--threshold', type=float, help="Confidence threshold to evaluate (defaults to the configured one).")
+def tagger(rebuild, folds, threshold):
+    """Evaluate the local tagger on the workspace: model calls avoided and quality of its tags."""
+    settings = tagger_config()
+    if threshold is not None:
+        settings["threshold"] = threshold
+    try:
+        local_tagger = get_tagger(rebuild=rebuild)
+        notes = [Note.read(note_id) for note_id in Workspace.get().get_index().index]
+    except FileNotFoundError:
+        print_warn("Index file not found. Run `hn ws index` first.")
+        return
+    notes = [(note.snippets.dumps(), {t.content for t in note.annotations.tags}) for note in notes if note]
+    words, tags = local_tagger.vocabulary
+    print(fsys("Vocabulary:"), f"{words} words, {tags} tags learnt from {local_tagger.notes} notes")
+
+    report = evaluate(notes, folds=max(2, folds), settings=settings)
+    if not report.notes:
+        print_warn("No tagged notes to evaluate the tagger on.")
+        return
+    print(fsys("Threshold:"), settings["threshold"])
+    print(fsys("Tagged locally:"), f"{report.local} / {report.notes} notes ({report.call_reduction:.0%} fewer tag extraction calls)")
+    print(fsys("Precision / recall:"), f"{report.precision:.0%} / {report.recall:.0%} (on the locally tagged notes)")
+    print(fsys("Proposal time:"), f"{report.propose_us:.0f} µs/note")
+
+@ai.command()
+@click.option('--rebuild', is_flag=True, help="Re-learn the gazetteer from the notes.")
+@click.option('--set', 'set_entry', nargs=2, metavar="ENTITY TYPE", help="Type an entity (UNKNOWN to always leave it to the model).")
+@click.option('--unset', 'unset_entity', metavar="ENTITY", help="Remove an entity from the user entries.")
+@click.option('--folds', type=int, default=5, help="Number of cross-validation folds of the evaluation.")
+def gazetteer(rebuild, set_entry, unset_entity, folds):
+    """Show the entity gazetteer of the workspace and evaluate it (model calls avoided), or edit its user entries."""
+    try:
+        local_gazetteer = get_gazetteer(rebuild=rebuild)
+    except FileNotFoundError:
+        print_warn("Index file not found. Run `hn ws index` first.")
+        return
+    if set_entry:
+        entity, entity_type = set_entry
+        if entity_type.upper() not in EntityType.to_list():
+            print_warn(f"Unknown entity type: {entity_type} (available: {EntityType.to_str()})")
+            return
+        local_gazetteer.set_user(entity, EntityType(entity_type.upper()))
+        print_sys(f"{fentity(entity.lstrip('@'))} typed {entity_type.upper()}.")
+        return
+    if unset_entity:
+        local_gazetteer.set_user(unset_entity, None)
+        print_sys(f"{fentity(unset_entity.lstrip('@'))} removed from the user entries.")
+        return
+    counts = {entity_type: 0 for entity_type in EntityType.to_list()}
+    for entity in {**local_gazetteer.learnt, **local_gazetteer.user}:
+        counts[local_gazetteer.type_of(entity).value] += 1
+    print(fsys("Entities:"), f"{len(local_gazetteer.learnt)} learnt, {len(local_gazetteer.user)} user entries")
+    print(fsys("Types:"), ", ".join(f"{entity_type} {n}" for entity_type, n in counts.items() if n))
+    print(fsys("User entries:"), os.path.join(Workspace.get().base_dir, Gazetteer.USER_FN))
+
+    notes = [Note.read(note_id) for note_id in Workspace.get().get_index().index]
+    notes = [(note.snippets.dumps(), note.annotations.entities) for note in notes if note]
+    if not notes:
+        return
+    report = evaluate_gazetteer(notes, folds=max(2, folds), settings=local_gazetteer.settings, user=local_gazetteer.user)
+    print(fsys("Typed locally:"), f"{report.local} / {report.notes} notes ({report.call_reduction:.0%} fewer entity extraction calls)")
+    print(fsys("Precision / recall:"), f"{report.precision:.0%} / {report.recall:.0%} (of the typed entities of the notes)")
+    print(fsys("Lookup time:"), f"{report.find_us:.0f} µs/note")
+
+@ai.command()
+@click.argument('note_id', required=False)
+@click.option('--all', 'all_notes', is_flag=True, help="Run on all the notes of the workspace (matching the filters) concurrently.")
+@click.option('--tag', multiple=True, help="Batch mode: only notes with this tag.")
+@click.option('--created_after', '-ca', type=click.DateTime(formats=INPUT_DATE_FORMATS), help="Batch mode: only notes created after this date.")
+@click.option('--updated_after', '-ua', type=click.DateTime(formats=INPUT_DATE_FORMATS), help="Batch mode: only notes updated after this date.")
+@click.option('--concurrency', '-j', type=int, default=4, help="Batch mode: maximum number of in-flight model requests.")
 @click.option('--interactive', '-i', is_flag=True, help="Run in interactive mode. Agree to LLM intelligence.")
 @click.option('--tags', '-t', is_flag=True, help="Highlight or add tags to the note.")
 @click.option('--entities', '-e', is_flag=True, help="Highlight or add entities to the note.")
 @click.option('--times', '-ti', is_flag=True, help="Highlight or add time intelligence to the note.")
-def run(note_id, interactive, tags, entities, times):
-    """Run an AI-magick task on a note."""
-    if not note_id:
-        print_warn("Note ID is required.")
+@click.option('--no-cache', is_flag=True, help="Bypass the LLM response cache.")
+@click.option('--no-local', is_flag=True, help="Always ask the model, even for the tags the local tagger is confident about, the entities the gazetteer knows and the times the local parser resolves.")
+@click.option('--full', is_flag=True, help="Send all the snippets to the model, not only the ones new or changed since the last run.")
+def run(note_id, all_notes, tag, created_after, updated_after, concurrency, interactive, tags, entities, times, no_cache, no_local, full):
+    """Run an AI-magick task on a note (or on many notes with --all)."""
+    if not note_id and not all_notes:
+        print_warn("Note ID (or --all) is required.")
         return
     
     if not any([tags, entities, times]):
-        print_warn("At least one of --tags or --entities must be specified.")
+        print_warn("At least one of --tags, --entities or --times must be specified.")
+        return
+
+    if all_notes:
+        if interactive:
+            print_warn("Interactive mode is not available with --all.")
+            return
+        run_batch(tag, created_after, updated_after, concurrency, tags, entities, times, not no_cache, not no_local, not full)
         return
     
     note = Note.read(note_id)
     if not note:
         return
     
-    note_body = note.snippets.dumps() # TODO other way?
+    # Only the snippets new or changed since the last run are sent
+    pending = pending_annotation(note, tags, entities, times, incremental=not full)
+    if not pending.ords:
+        print_sys("All the snippets are already annotated (use --full to annotate them again).")
+        return
+    note_body = note.snippets.dumps(pending.ords)
 
     # Use AI to extract annotations
     new_annotations = extract_annotations(
         note_body,
-        extract_tags=tags,
-        extract_entitites=entities,
+        extract_tags=pending.extract_tags,
+        extract_entitites=pending.extract_entities,
+        extract_times=pending.extract_times,
         ignore_tags=note.annotations.tags,
-        ignore_entities={e for e in note.annotations.entities if e.type != EntityType.UNKNOWN}
+        ignore_entities={e for e in note.annotations.entities if e.type != EntityType.UNKNOWN},
+        use_cache=not no_cache,
+        local_tagger=not no_local,
+        local_times=not no_local,
+        local_entities=not no_local,
     )
         
     if interactive:
@@ -79,84 +363,214 @@ def run(note_id, interactive, tags, entities, times):
                     HTML(f"<ansicyan>Entities (edit):</ansicyan> "),
                     default=new_annotations.entities_serialized,
             )
-            entity_set = Annotations.entities_deserialize(entities_interactive)
+            new_annotations.entities = Annotations.entities_deserialize(entities_interactive)
         
         # Time intelligence
-        # TODO 
+        if new_annotations.times:
+            times_interactive = prompt_session.prompt(
+                    HTML(f"<ansicyan>Times (edit):</ansicyan> "),
+                    default=new_annotations.times_serialized,
+            )
+            new_annotations.times = Annotations.times_deserialize(times_interactive)
 
     else:
         # Tags
         if new_annotations.tags:
-            print(fsys("Tags:"), ftag(tags2line(new_annotations.tags), decorator=""))
+            print(fsys("Tags:"), ftag(tags2line(new_annotations.tags)))
         # Entities
-        if entity_set:
-            print(fsys("Entities:"), ftag(Annotations(entities=entity_set).entities_serialized, decorator=""))
+        if new_annotations.entities:
+            print(fsys("Entities:"), fentity(new_annotations.entities_serialized))
         # Time intelligence
-        # TODO 
-
-    # Create new snippet with the remaining annotations
-    ai_snippet_content = ""
-    # Add the tags to the note, wherever they fit. 
-    used_tags = set()
-    if tags:
-        for tag in new_annotations.tags:
-            for snippet in note.snippets:
-                if tag.content in snippet.content and not snippet.annotations.has_tag(tag):
-                    snippet.add_tag(tag)
-                    used_tags.add(tag)
-                    break
-        remaining_tags = new_annotations.tags - used_tags
-        if remaining_tags:
-            ai_snippet_content += tags2line(remaining_tags)
-            # TODO add entities and time intelligence to the snippet content
-    if entities:
-        pass
-
-    if ai_snippet_content:
-        # Add the remaining (or selected) annotations to the note
-        note.add(content=ai_snippet_content)
+        if new_annotations.times:
+            print(fsys("Times:"), new_annotations.times_serialized)
+
+    # Add the annotations to the snippets wherever they fit, the remaining ones to a new snippet
+    remaining = note.apply_annotations(new_annotations)
 
     # Display the updated note to the user
     print(note.dumps())
 
-    if tags:
-        # Inform about the changes
-        print_sys("New tags to add to existing snippet: "+tags2line(used_tags))
-        print_sys("New tags to add to new snippet: "+tags2line(remaining_tags))
+    # Inform about the changes
+    if remaining.tags or remaining.entities or remaining.times:
+        print_sys("New annotations added to a new snippet: "+" ".join(
+            filter(None, [remaining.tags_serialized, remaining.entities_serialized, remaining.times_serialized])
+        ))
     
     # Save to disk
     confirm = input(fsys("Do you want to save the changes? (y/n) "))
     if confirm.lower() != "y":
         print_warn("Changes not saved.")
         return
+    log_annotated(note, pending)
     note.persist()
     print_sys("Note has been updated.")
 
     return
 
+def run_batch(tag, created_after, updated_after, concurrency, tags, entities, times, use_cache, local, incremental):
+    """Annotate all the notes matching the filters concurrently and report the outcome."""
+    try:
+        index_df = Workspace.get().list_notes(
+            created_after=created_after,
+            updated_after=updated_after,
+            tags=tag,
+        )
+    except FileNotFoundError:
+        print_warn("Index file not found. Run `hn ws index` first.")
+        return
+    note_ids = index_df.index.tolist()
+    if not note_ids:
+        print_warn("No notes match the filters.")
+        return
+
+    print_sys(f"Annotating {len(note_ids)} notes ({concurrency} concurrent requests)...")
+    report = annotate_notes(
+        note_ids,
+        concurrency=concurrency,
+        extract_tags=tags,
+        extract_entities=entities,
+        extract_times=times,
+        use_cache=use_cache,
+        local_tagger=local,
+        local_times=local,
+        local_entities=local,
+        incremental=incremental,
+    )
+
+    print_sys(f"Done: {report.done} notes in {report.elapsed:.1f}s ({report.throughput:.2f} notes/s), "
+              f"{report.changed} updated, {report.up_to_date} up to date, {len(report.failed)} failed.")
+    for failed_id, error in report.failed.items():
+        print_warn(f" - {failed_id}: {error}")
+
 @ai.command()
 @click.argument('prompt_val')
-# @click.argument('note_id')
-def prompt(prompt_val):
-    """Query the LLM with a given prompt on a list of notes"""
-    raise NotImplementedError("Prompting is not implemented yet.")
+@click.option('--tag', multiple=True, help="Only notes with this tag.")
+@click.option('--created_after', '-ca', type=click.DateTime(formats=INPUT_DATE_FORMATS), help="Only notes created after this date.")
+@click.option('--updated_after', '-ua', type=click.DateTime(formats=INPUT_DATE_FORMATS), help="Only notes updated after this date.")
+@click.option('--search', '-s', 'query', help="Only the notes matching this search (semantic if the workspace has embeddings).")
+@click.option('--limit', '-l', type=int, help="At most this many notes.")
+@click.option('--concurrency', '-j', type=int, help="Maximum number of in-flight model requests (default from config).")
+@click.option('--ordered', is_flag=True, help="Output the results in the order of the notes instead of as they complete.")
+@click.option('--output', '-o', type=click.File("w"), default="-", help="JSONL output file (stdout by default).")
+@click.option('--no-cache', is_flag=True, help="Bypass the LLM response cache.")
+def prompt(prompt_val, tag, created_after, updated_after, query, limit, concurrency, ordered, output, no_cache):
+    """Apply a prompt to each note of a filtered set, one JSON line per note."""
+    try:
+        note_ids = Workspace.get().list_notes(
+            created_after=created_after,
+            updated_after=updated_after,
+            tags=tag,
+        ).index.tolist()
+    except FileNotFoundError:
+        print_warn("Index file not found. Run `hn ws index` first.")
+        return
+    if query:
+        matching = set(note_ids)
+        search = semantic_search if EmbeddingIndex().exists() else keyword_search
+        hits = search(query, limit=len(matching) * 10 or 10)
+        note_ids = list(dict.fromkeys(hit.note_id for hit in hits if hit.note_id in matching))
+    note_ids = note_ids[:limit] if limit else note_ids
+    if not note_ids:
+        print_warn("No notes match the filters.")
+        return
+
+    def on_result(result: PromptResult):
+        click.echo(result.model_dump_json(), file=output)
+        # Progress on stderr, to keep stdout valid JSONL
+        click.echo("\r\033[K" + fsys(report.progress()), nl=False, err=True)
+
+    report = FanOutReport(total=len(note_ids))
+    report = prompt_notes(prompt_val, note_ids, on_result, concurrency=concurrency, use_cache=not no_cache, ordered=ordered, report=report)
+    click.echo(err=True)
+    click.echo(fsys(f"Done: {report.done} notes in {report.elapsed:.1f}s ({report.throughput:.2f} notes/s), {report.failed} failed."), err=True)
 
 @ai.command()
-def chat():
-    raise NotImplementedError("Chat is not implemented yet.")
+@click.option('--session', '-s', 'session_id', help="Resume a chat session.")
+@click.option('--list', '-l', 'list_sessions', is_flag=True, help="List the chat sessions of the workspace.")
+@click.option('--top-k', '-k', type=int, help="Snippets retrieved per question (default from config).")
+def chat(session_id, list_sessions, top_k):
+    """Chat about the notes of the workspace: each question is answered from the most relevant snippets."""
+    if list_sessions:
+        sessions = ChatSession.list_sessions()
+        if not sessions:
+            print_warn("No chat sessions yet.")
+            return
+        rows = [[s.id, s.title, str(len(s.turns)), dt_dumps(s.updated_at)] for s in sessions]
+        print(tabulate(rows, headers=["ID", "Title", "Turns", "Updated At"], tablefmt="grid", disable_numparse=True))
+        return
+
+    if session_id:
+        session = ChatSession.load(session_id)
+        if not session:
+            print_warn(f"Chat session {session_id} not found.")
+            return
+        for turn in session.turns:
+            print(fsys(">>> ") + turn.question)
+            print(turn.answer)
+    else:
+        session = ChatSession.new()
+    print_sys(f"Chat session {session.id} (/exit to quit)")
+
+    prompt_session = PromptSession(history=InMemoryHistory())
+    while True:
+        try:
+            question = prompt_session.prompt(HTML("<ansicyan>>>> </ansicyan>")).strip()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if not question:
+            continue
+        if question in ["/exit", "/quit", "/q"]:
+            break
+        stats = GenerationStats()
+        for chunk in ask(session, question, k=top_k, stats=stats):
+            click.echo(chunk, nl=False)
+        click.echo()
+        turn = session.turns[-1]
+        if turn.sources:
+            print(fsys("Sources:"), " ".join(turn.sources))
+        print_sys(f"{stats.summary()}, {turn.prompt_tokens} prompt tokens")
+    print_sys(f"Resume with `hn ai chat -s {session.id}`.")
 
 @ai.command()
 @click.argument('prompt_name')
 @click.option('--created_after', '-ca', type=click.DateTime(formats=INPUT_DATE_FORMATS), help="Filter notes created after this date.")
-def generate(prompt_name, created_after):
+@click.option('--query', '-q', help="Focus of the context: the snippets most relevant to it are kept (the prompt itself by default).")
+@click.option('--budget', type=int, help="Token budget of the packed context (default from config), 0 to send every matching note (map-reduced).")
+@click.option('--scoring', type=click.Choice(["auto", "keyword", "semantic"]), help="Relevance scoring of the snippets (default from config).")
+@click.option('--no-cache', is_flag=True, help="Bypass the LLM response cache.")
+@click.option('--no-stream', is_flag=True, help="Wait for the full response instead of streaming it.")
+@click.option('--chunk-tokens', type=int, help="Token budget of a map-reduce chunk (default from config).")
+@click.option('--concurrency', '-j', type=int, help="Maximum concurrent map-reduce requests (default from config).")
+def generate(prompt_name, created_after, query, budget, scoring, no_cache, no_stream, chunk_tokens, concurrency):
     """Generate some text on a list of notes using predefined prompt."""
 
-    notes_text = Note.concat_notes(
-        created_after=created_after,
-    )
-
-    # print(notes_text)
+    if budget == 0:
+        notes_texts = Note.notes_texts(
+            created_after=created_after,
+        )
+    else:
+        note_ids = Workspace.get().list_notes(created_after=created_after).index.tolist()
+        notes = [note for note in (Note.read(note_id) for note_id in note_ids) if note]
+        context = ContextReport()
+        notes_texts = pack_context(notes, query or get_predefined_prompt(prompt_name), budget=budget, scoring=scoring, report=context)
+        print_sys(f"Context: {context.summary()}")
 
-    output = ai_generate(prompt_name, notes_text)
+    stats = GenerationStats()
+    report = MapReduceReport()
+    chunks = map_reduce_stream(
+        prompt_name,
+        notes_texts,
+        chunk_tokens=chunk_tokens,
+        concurrency=concurrency,
+        use_cache=not no_cache,
+        stats=stats,
+        report=report,
+        stream=not no_stream,
+    )
+    for chunk in chunks:
+        click.echo(fsys(chunk), nl=False)
+    click.echo()
 
-    print_sys(output)
\ No newline at end of file
+    if report.chunks > 1:
+        print_sys(f"Map-reduce: {report.summary()}")
+    print_sys(stats.summary())
@@ -2,12 +2,14 @@ import os
 
 import click
 import readline
+from colorama import Fore, Style
+from tabulate import tabulate
 
 from . import hn
 from ..db import SessionLocal
-from ..db.query import execute_query
+from ..db.query import NoteCRUD, SnippetCRUD, WorkspaceCRUD, execute_query
 from ..utils.config import config
-from ..utils.term import print_err, print_sys, input_sys, print_warn
+from ..utils.term import fsys, print_err, print_sys, input_sys, print_warn
 
 DB_PATH = config["db_path"]
 
@@ -24,6 +26,83 @@ def init(db_path: str):
     from ..db import init_db
     init_db(db_path=db_path)
 
+@db.command()
+def migrate():
+    """Upgrade the database schema to the latest version."""
+    from ..db import get_engine
+    from ..db.migrations import migrate as migrate_db, schema_version
+    engine = get_engine()
+    applied = migrate_db(engine, verbose=True)
+    print_sys(f"Database schema is up to date (version {schema_version(engine)}, {applied} migrations applied).")
+
+@db.command()
+@click.argument('query', type=str)
+@click.option('--limit', '-l', type=int, default=10, help="Limit the number of snippets displayed.")
+@click.option('--all-workspaces', is_flag=True, help="Search the snippets of every workspace.")
+def search(query: str, limit: int, all_workspaces: bool):
+    """Full-text search of the snippets in the database, best matches first."""
+    with SessionLocal() as session:
+        workspace_id = None
+        if not all_workspaces:
+            ws = WorkspaceCRUD.get(session, workspace_name=config["active_workspace"])
+            workspace_id = ws.id if ws else None
+        rows = SnippetCRUD.search(session, query, workspace_id=workspace_id, limit=limit, highlight=(Fore.YELLOW, Style.RESET_ALL))
+    if not rows:
+        print_warn("No matching snippets.")
+        return
+    click.echo(
+        tabulate(
+            [[fsys(row.note_id), row.title, f"{-row.rank:.3f}", row.passage] for row in rows],
+            headers=[fsys("Note ID"), fsys("Title"), fsys("Score"), fsys("Snippet")],
+            tablefmt="grid",
+            maxcolwidths=[None, 20, None, 60],
+            disable_numparse=True,
+        )
+    )
+
+@db.command()
+@click.option('--tag', '-t', multiple=True, help="Only notes with this tag (all of them when repeated).")
+@click.option('--entity', '-e', multiple=True, help="Only notes with this entity (all of them when repeated).")
+@click.option('--content', '-c', multiple=True, help="Only notes containing this text (all of them when repeated).")
+@click.option('--limit', '-l', type=int, default=20, help="Notes per page.")
+@click.option('--cursor', type=str, help="Cursor of the page to display, as printed after the previous one.")
+@click.option('--all', 'all_', is_flag=True, help="List all notes including archived.")
+@click.option('--archived', is_flag=True, help="List archived notes.")
+def notes(tag, entity, content, limit, cursor, all_, archived):
+    """List the notes of the workspace in the database, most recently updated first, a page at a time."""
+    with SessionLocal() as session:
+        try:
+            rows, next_cursor = NoteCRUD.page(
+                session, config["active_workspace"], cursor=cursor, page_size=limit,
+                tag=tag, entity=entity, content=content, all=all_, archived=archived,
+            )
+        except ValueError as e:
+            print_err(str(e))
+            return
+    if not rows:
+        print_warn("No notes found.")
+        return
+    click.echo(
+        tabulate(
+            [[fsys(row.id), row.title, f"{row.updated_at:%Y-%m-%d %H:%M}", "yes" if row.archived else ""] for row in rows],
+            headers=[fsys("ID"), fsys("Title"), fsys("Updated At"), fsys("Archived")],
+            tablefmt="grid",
+            maxcolwidths=[None, 40, None, None],
+            disable_numparse=True,
+        )
+    )
+    if next_cursor:
+        print_sys(f"Next page: --cursor {next_cursor}")
+
+@db.command()
+def reindex():
+    """Rebuild the full-text index of the snippets from their content."""
+    from ..db.migrations import rebuild_fts
+    with SessionLocal() as session:
+        rebuild_fts(session.connection())
+        session.commit()
+    print_sys("[+] Full-text index rebuilt.")
+
 @db.command()
 def remove():
     """Remove the database file."""
@@ -39,8 +118,12 @@ def remove():
 @db.command()
 @click.argument('query', type=str, required=False)
 @click.option('--interactive', '-i', is_flag=True, help='Run in interactive mode.')
-def exec(query: str, interactive: bool):
+@click.option('--read-only', is_flag=True, help='Use the read-only analytics engine profile (writes are refused).')
+def exec(query: str, interactive: bool, read_only: bool):
     """Execute a raw SQL query. Optionally run in interactive mode."""
+    if read_only:
+        from ..db import use_profile
+        use_profile("analytics")
     if query:
         with SessionLocal() as session:
             execute_query(session, query)
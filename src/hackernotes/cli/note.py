@@ -1,7 +1,9 @@
 import click
 from tabulate import tabulate
 
+from hackernotes.core.ann import IVFIndex
 from hackernotes.core.note import Note
+from hackernotes.core.search import build_related_index, related_notes
 from hackernotes.core.workspace import Workspace
 from hackernotes.utils import wrap
 from hackernotes.utils.display import display_note
@@ -11,7 +13,7 @@ from ..core.interactive import handle_create_note, handle_edit_note
 # from ..core.note import NoteService
 from ..db import SessionLocal
 from ..utils.datetime import now
-from ..utils.term import clear_terminal, fentity, fsys, ftag, print_warn
+from ..utils.term import clear_terminal, fentity, fsys, ftag, print_sys, print_warn
 
 # === Note Commands ===
 @hn.group()
@@ -81,6 +83,46 @@ def export(note_id):
     """Export note via LLM generate.""" # TODO makes sense?
     print(Note.read(note_id).dumps())
 
+@note.command()
+@click.argument('note_id')
+@click.option('--limit', '-l', type=int, default=10, help="Limit the number of notes displayed.")
+@click.option('--nprobe', '-p', type=int, help="Number of index lists scanned: higher is more accurate but slower.")
+@click.option('--exact', is_flag=True, help="Compare against every note instead of using the index.")
+@click.option('--rebuild', is_flag=True, help="Rebuild the related notes index.")
+def related(note_id, limit, nprobe, exact, rebuild):
+    """List the notes most similar to a note by content."""
+    ann = IVFIndex()
+    if rebuild or not ann.exists():
+        print_sys("Building the related notes index...")
+        print_sys(f"[+] Indexed {build_related_index()} notes.")
+    elif ann.size > 2 * ann.trained_on:
+        print_warn("The related notes index has doubled since it was built, consider running with --rebuild.")
+
+    hits = related_notes(note_id, limit=limit, nprobe=nprobe, exact=exact)
+    if not hits:
+        print_warn(f"No related notes found for {note_id}.")
+        return
+
+    index_df = Workspace.get().get_index()
+    table = [
+        [
+            fsys(hit_id),
+            index_df.at[hit_id, "Title"] if hit_id in index_df.index else "",
+            f"{score:.3f}",
+            ftag(index_df.at[hit_id, "Tags"]) if hit_id in index_df.index else "",
+        ]
+        for hit_id, score in hits
+    ]
+    click.echo(
+        tabulate(
+            table,
+            headers=[fsys("ID"), fsys("Title"), fsys("Similarity"), fsys("Tags")],
+            tablefmt="grid",
+            maxcolwidths=[None, 30, None, 30],
+            disable_numparse=True,
+        )
+    )
+
 @note.command()
 # @click.option('--tag', '-t', multiple=True, help="Filter by tags")
 # @click.option('--entity', '-e', multiple=True, help="Filter by entities")
@@ -0,0 +1,52 @@
+import click
+from tabulate import tabulate
+
+from hackernotes.core.embeddings import EmbeddingIndex
+from hackernotes.core.note import Note
+from hackernotes.core.search import build_semantic_index, keyword_search, semantic_search
+from hackernotes.utils.term import fsys, print_sys, print_warn
+
+from . import hn
+
+# === Search Commands ===
+@hn.command()
+@click.argument('query', required=False)
+@click.option('--semantic', '-s', is_flag=True, help="Search by meaning, using the snippet embeddings.")
+@click.option('--limit', '-l', type=int, default=10, help="Limit the number of snippets displayed.")
+@click.option('--reindex', is_flag=True, help="(Re)build the embeddings of the whole workspace.")
+def search(query, semantic, limit, reindex):
+    """Search note snippets by keywords (or by meaning with --semantic)."""
+    if reindex or (semantic and not EmbeddingIndex().exists()):
+        print_sys("Embedding the workspace snippets...")
+        embedded = build_semantic_index()
+        print_sys(f"[+] Embedded {embedded} snippets.")
+    if not query:
+        if not reindex:
+            print_warn("Nothing to search for.")
+        return
+
+    hits = semantic_search(query, limit) if semantic else keyword_search(query, limit)
+    if not hits:
+        print_warn("No matching snippets.")
+        return
+
+    notes = {note_id: Note.read(note_id) for note_id in {hit.note_id for hit in hits}}
+    table = [
+        [
+            fsys(hit.note_id),
+            notes[hit.note_id].meta.title,
+            f"{hit.score:.3f}" if semantic else str(int(hit.score)),
+            notes[hit.note_id].snippets[hit.ord].content,
+        ]
+        for hit in hits
+        if notes[hit.note_id] and hit.ord < len(notes[hit.note_id].snippets)
+    ]
+    click.echo(
+        tabulate(
+            table,
+            headers=[fsys("ID"), fsys("Title"), fsys("Score"), fsys("Snippet")],
+            tablefmt="grid",
+            maxcolwidths=[None, 20, None, 60],
+            disable_numparse=True,
+        )
+    )
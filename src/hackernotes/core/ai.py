@@ -1,171 +1,435 @@
+import hashlib
+import re
 import sys
-from typing import List, Set
+from datetime import datetime
+from typing import ClassVar, Iterator, List, Optional, Set, Tuple, Type
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 from hackernotes.core.annotations import Annotations
 from hackernotes.core.annotations.entity import Entity
+from hackernotes.core.annotations.time import Time
 from hackernotes.utils.parsers import tags2line
-from hackernotes.utils.term import clear_previous_line, print_err, print_sys
+from hackernotes.utils.term import clear_previous_line, print_err, print_sys, print_warn
 
 from ..core.annotations.tag import Tag
-from ..utils.datetime import now
-from ..utils.llm import ollama_generate
-
-from ..core.types import EntityType
-
-def extract_tags_from_text(text: str, existing_tags: Set[Tag] = None) -> Set[Tag]:
-    """Extracts tags from text."""
-
-    if existing_tags:
-        existing_tags_warning = "You must ignore the tags that are already in the text:\n"
-        existing_tags_warning += tags2line(existing_tags)
-    else:
-        existing_tags_warning = ""
-    
-    sys_prompt = """
-    You will be given a piece of text that is a note written by the user.
-    Your task is to figure out which tags might be a good fit for the note.
-    Warning: if the note contains any word preceded by either '#', '@', or '^', you MUST ignore it.
-    {existing_tags_warning}
-
-    Form your response as a JSON array of strings.
-    For example, if the note contains the text "I love Python coding", your response should be:
-    {{
-        "tags": ["Python", "coding", #programming"]
-    }}
-
-    Note: if something already IS an entity (preceded by @) or a tag (preceded by #), DO NOT include it in the response.
-    Note: persons, organizations, and locations are NOT tags but entities, do not include them in the response.
-    """.format(existing_tags_warning=existing_tags_warning)
-
-    response = ollama_generate(
-        sys_prompt=sys_prompt,
-        user_prompt=text,
+from ..core.annotations.timeparse import find_times
+from ..core.gazetteer import local_entities as gazetteer_entities
+from ..core.note import Note
+from ..core.tagger import local_tags
+from ..utils.config import config
+from ..utils.llm import GenerationStats, get_backend, llm_agenerate, llm_generate, prompt_context
+from ..utils.llm import generate_stream as llm_generate_stream
+
+from ..core.types import EntityType, TimeIntelligence, TimeScope
+
+# Number of times a malformed structured response is sent back to the model to be fixed
+MAX_REPAIRS = 1
+
+# --- Structured Output ---
+
+class ExtractedTags(BaseModel):
+    """
+    Represents a collection of extracted tags.
+    """
+    prompt_name: ClassVar[str] = "annotate_tags"
+    tags: List[str] = []
+
+class ExtractedEntities(BaseModel):
+    """
+    Represents a collection of extracted entities.
+    """
+    prompt_name: ClassVar[str] = "annotate_entities"
+    entities: List[Entity] = []
+
+class ExtractedTimes(BaseModel):
+    """
+    Represents a collection of extracted time intelligence.
+    """
+    prompt_name: ClassVar[str] = "annotate_times"
+    times: List[TimeIntelligence] = []
+
+class ExtractedAnnotations(ExtractedTags, ExtractedEntities, ExtractedTimes):
+    """
+    Represents tags, entities and time intelligence extracted together in a single call.
+    """
+    prompt_name: ClassVar[str] = "annotate"
+
+def _to_annotations(extracted: BaseModel) -> Annotations:
+    """Converts any of the extraction outputs to annotations, dropping empty values."""
+    tags = {t.replace("#", "").strip() for t in getattr(extracted, "tags", [])}
+    entities = {(e.content.replace("@", "").strip(), e.type) for e in getattr(extracted, "entities", [])}
+    return Annotations(
+        tags={Tag(content=t) for t in tags if t},
+        entities={Entity(content=content, type=type) for content, type in entities if content},
+        times={
+            Time(content=t.literal.strip(), value=t.value or None, scope=t.scope)
+            for t in getattr(extracted, "times", []) if t.literal.strip()
+        },
     )
 
-    resp_eval = eval(response)
+REPAIR_SYS_PROMPT = """
+    You will be given a text that should be a JSON object following a given schema, but it is malformed.
+    Fix it and respond with the corrected JSON object only. Do not add any information.
+    """
+
+def _repair_json(response: str) -> str:
+    """Local repairs of the usual glitches: code fences, prose around the object, trailing commas."""
+    text = response.strip()
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        text = text[start:end + 1]
+    return re.sub(r",\s*([}\]])", r"\1", text)
+
+def parse_structured(response: str, schema: Type[BaseModel]) -> Optional[BaseModel]:
+    """Strictly parses a JSON response into the schema (as is, then locally repaired). Returns None if invalid."""
+    for candidate in (response, _repair_json(response)):
+        try:
+            return schema.model_validate_json(candidate)
+        except ValidationError:
+            continue
+    return None
+
+def _structured_calls(sys_prompt: str, text: str, schema: Type[BaseModel], use_cache: bool, max_repairs: int):
+    """
+    The model calls of a structured generation, shared by `generate_structured` and `agenerate_structured`: yields
+    the prompt label and the arguments of each call and is sent its response, parses it and asks for at most
+    `max_repairs` repairs. Returns the parsed response, raises ValueError once the repairs are exhausted.
+    """
+    format = schema.model_json_schema()
+    prompt_name = getattr(schema, "prompt_name", schema.__name__)
+    response = yield prompt_name, dict(sys_prompt=sys_prompt, user_prompt=text, format=format, use_cache=use_cache)
+    for attempt in range(max_repairs + 1):
+        parsed = parse_structured(response, schema)
+        if parsed is not None:
+            return parsed
+        if attempt < max_repairs:
+            response = yield f"{prompt_name}:repair", dict(sys_prompt=REPAIR_SYS_PROMPT, user_prompt=response, format=format, use_cache=use_cache)
+    raise ValueError("Invalid response format from the model: {}".format(response))
+
+def generate_structured(sys_prompt: str, text: str, schema: Type[BaseModel], use_cache: bool = True, max_repairs: int = MAX_REPAIRS) -> BaseModel:
+    """
+    Generates a JSON response constrained to the schema, with at most `max_repairs` repair round trips.
+    The calls are labelled with the `prompt_name` of the schema in the metrics.
+    """
+    calls = _structured_calls(sys_prompt, text, schema, use_cache, max_repairs)
+    label, kwargs = next(calls)
+    while True:
+        with prompt_context(label):
+            response = llm_generate(**kwargs)
+        try:
+            label, kwargs = calls.send(response)
+        except StopIteration as done:
+            return done.value
+
+async def agenerate_structured(sys_prompt: str, text: str, schema: Type[BaseModel], use_cache: bool = True, max_repairs: int = MAX_REPAIRS) -> BaseModel:
+    """Asynchronous counterpart of `generate_structured`."""
+    calls = _structured_calls(sys_prompt, text, schema, use_cache, max_repairs)
+    label, kwargs = next(calls)
+    while True:
+        with prompt_context(label):
+            response = await llm_agenerate(**kwargs)
+        try:
+            label, kwargs = calls.send(response)
+        except StopIteration as done:
+            return done.value
 
-    if isinstance(resp_eval, dict) and "tags" in resp_eval:
-        return set(Tag(content=tag.replace("#","")) for tag in resp_eval["tags"])
-    else:
-        raise ValueError("Invalid response format from Ollama API: {}".format(response))
-    
-def extract_entities_from_text(text: str, existing_entities: Set[Entity] = None) -> Set[Entity]:
-    """Extracts entities from text."""
+# --- Prompts ---
 
-    # if existing_entities:
-    #     existing_tags_warning = "You must ignore the tags that are already in the text:\n"
-    #     existing_tags_warning += tags2line(existing_tags)
-    # else:
-    #     existing_tags_warning = ""
-    
-    sys_prompt = """
+ANNOTATE_SYS_PROMPT = """
     You will be given a piece of text that is a note written by the user.
-    Your task is to figure out which entities might be a good fit for the note.
-    Warning: if the note contains any word preceded by either '#', or '^', you SHOULD IGNORE IT!
-
-    Your task is to extract entities from the text, if any. 
-    Each entity must be of the following types: {}
-
-    Structure your response as a JSON object.
-    Note: when using an entity already preceded by '@', do not use the '@' in the response.
-    """\
-    .format(EntityType.to_str)
-
-    class ExtractedEntities(BaseModel):
-        """
-        Represents a collection of extracted entities.
-        """
-        entities: List[Entity]
+    Your task is to annotate the note.
+    Warning: if the note contains any word preceded by either '#', '@', or '^', it is already annotated: you MUST ignore it.
+    Structure your response as a JSON object with the fields "tags", "entities" and "times".
+    Leave a field as an empty list if there is nothing to extract or if it is not requested below.
+    """
+
+TAGS_INSTRUCTIONS = """
+    - "tags": keywords that might be a good fit for the note, e.g. for "I love Python coding": ["Python", "coding", "programming"].
+      Persons, organizations, and locations are NOT tags but entities, do not include them as tags.
+    """
+
+ENTITIES_INSTRUCTIONS = """
+    - "entities": persons, organizations and locations mentioned in the note, each with:
+      "content": the entity as written in the note (without '@'), and "type": one of {}.
+    """
+
+TIMES_INSTRUCTIONS = """
+    - "times": time expressions in the note, each with:
+      "literal": as written in the note, e.g. "next week",
+      "value": the actual date and time, formatted as "YYYY-MM-DD HH:mm:SS",
+      "scope": one of {}.
+      When figuring out a datetime, you MUST take into consideration the current date.
+    """
+
+def _ignore_instructions(ignore_tags: Set[Tag] = None, ignore_entities: Set[Entity] = None) -> str:
+    """Lists the annotations already present in the note, which must not be extracted again."""
+    instructions = ""
+    if ignore_tags:
+        instructions += "You must ignore the tags that are already in the text:\n" + tags2line(ignore_tags) + "\n"
+    if ignore_entities:
+        instructions += "You must ignore the entities that are already in the text:\n" \
+            + ' '.join(e.dumps(content_only=True) for e in ignore_entities) + "\n"
+    return instructions
+
+def _today() -> str:
+    """Today's date for the prompts. Day precision keeps the prompts (and cache keys) stable within a day."""
+    return "\n    ATTENTION: Today is {}.\n".format(datetime.now().strftime("%A, %d %B %Y"))
+
+def _annotations_sys_prompt(extract_tags: bool = True, extract_entities: bool = True, extract_times: bool = False) -> str:
+    """
+    Builds the system prompt of an extraction. It only depends on the requested annotation types (and the day),
+    so that successive calls start with the same prefix and the server can reuse its prompt cache: everything
+    specific to a note goes in the user prompt (see `_annotations_user_prompt`).
+    """
+    sys_prompt = ANNOTATE_SYS_PROMPT + "    Extract the following:\n"
+    if extract_tags:
+        sys_prompt += TAGS_INSTRUCTIONS
+    if extract_entities:
+        sys_prompt += ENTITIES_INSTRUCTIONS.format(EntityType.to_str())
+    if extract_times:
+        sys_prompt += TIMES_INSTRUCTIONS.format(TimeScope.to_str())
+        sys_prompt += _today()
+    return sys_prompt
+
+def _annotations_user_prompt(text: str, ignore_tags: Set[Tag] = None, ignore_entities: Set[Entity] = None) -> str:
+    """Builds the user prompt of an extraction: the annotations to ignore, then the note."""
+    instructions = _ignore_instructions(ignore_tags, ignore_entities)
+    return f"{instructions}\n{text}" if instructions else text
+
+# --- Extraction ---
+
+ExtractionStep = Tuple[str, str, Type[BaseModel]]
+
+def _extraction_steps(mode: str, text: str, extract_tags: bool, extract_entities: bool, extract_times: bool,
+    ignore_tags: Set[Tag], ignore_entities: Set[Entity]) -> List[ExtractionStep]:
+    """
+    Returns the model calls (system prompt, user prompt, schema) of an extraction: a single combined call,
+    or one call per annotation type.
+    """
+    if mode == "combined":
+        return [(
+            _annotations_sys_prompt(extract_tags, extract_entities, extract_times),
+            _annotations_user_prompt(text, ignore_tags, ignore_entities),
+            ExtractedAnnotations,
+        )]
+    steps = []
+    if extract_tags:
+        steps.append((_annotations_sys_prompt(True, False, False), _annotations_user_prompt(text, ignore_tags=ignore_tags), ExtractedTags))
+    if extract_entities:
+        steps.append((_annotations_sys_prompt(False, True, False), _annotations_user_prompt(text, ignore_entities=ignore_entities), ExtractedEntities))
+    if extract_times:
+        steps.append((_annotations_sys_prompt(False, False, True), text, ExtractedTimes))
+    return steps
+
+def _merge_extracted(extracted: List[BaseModel], extract_tags: bool, extract_entities: bool, extract_times: bool,
+    ignore_tags: Set[Tag], ignore_entities: Set[Entity]) -> Annotations:
+    """Merges the extraction outputs, keeping only the requested and new annotations."""
+    new_annotations = Annotations()
+    for output in extracted:
+        annotations = _to_annotations(output)
+        new_annotations.tags |= annotations.tags
+        new_annotations.entities |= annotations.entities
+        new_annotations.times |= annotations.times
+    ignored_tags = {t.content for t in ignore_tags or ()}
+    ignored_entities = {e.content for e in ignore_entities or ()}
+    new_annotations.tags = {t for t in new_annotations.tags if extract_tags and t.content not in ignored_tags}
+    new_annotations.entities = {e for e in new_annotations.entities if extract_entities and e.content not in ignored_entities}
+    new_annotations.times = new_annotations.times if extract_times else set()
+    return new_annotations
 
-    response = ollama_generate(
-        sys_prompt=sys_prompt,
-        user_prompt=text,
-        format=ExtractedEntities.model_json_schema()
-    )
+def _local_times(text: str) -> Tuple[Set[Time], bool]:
+    """The times resolved by the local parser, and whether ambiguous ones are left for the model."""
+    times = find_times(text)
+    return {t for t in times if t.value}, any(not t.value for t in times)
+
+def _local_extraction(
+    text: str,
+    extract_tags: bool,
+    extract_entities: bool,
+    extract_times: bool,
+    ignore_tags: Set[Tag],
+    ignore_entities: Set[Entity],
+    local_tagger: bool,
+    local_times: bool,
+    local_entities: bool,
+) -> Tuple[Tuple[bool, bool, bool], Set[Entity], Tuple[Optional[Set[Tag]], Optional[Set[Time]], Optional[Set[Entity]]]]:
+    """
+    Runs the enabled local extractors. Returns the annotation kinds left for the model, the entities it should
+    ignore (with the ones typed locally), and the local tags, times and entities to merge into its annotations.
+    """
+    tags = local_tags(text, ignore_tags) if extract_tags and local_tagger else None
+    if tags is not None:
+        extract_tags = False
+    entities = None
+    if extract_entities and local_entities:
+        entities, extract_entities = gazetteer_entities(text, ignore_entities)
+        # The model is not asked again for the entities typed locally
+        ignore_entities = set(ignore_entities or ()) | entities
+    times = None
+    if extract_times and local_times:
+        times, extract_times = _local_times(text)
+    return (extract_tags, extract_entities, extract_times), ignore_entities, (tags, times, entities)
+
+def _merge_local(annotations: Annotations, tags: Optional[Set[Tag]], times: Optional[Set[Time]], entities: Optional[Set[Entity]] = None) -> Annotations:
+    """
+    Adds the local tags, entities and times to the model's annotations, the local entities and times replacing
+    the same contents.
+    """
+    annotations.tags |= tags or set()
+    if entities:
+        contents = {e.content for e in entities}
+        annotations.entities = {e for e in annotations.entities if e.content not in contents} | entities
+    if times:
+        literals = {t.content for t in times}
+        annotations.times = {t for t in annotations.times if t.content not in literals} | times
+    return annotations
+
+def extraction_mode() -> str:
+    """Returns the configured extraction mode: `combined` (default) or `split`."""
+    return config.get("ai", {}).get("extraction_mode", "combined")
+
+def extract_tags_from_text(text: str, existing_tags: Set[Tag] = None, use_cache: bool = True) -> Set[Tag]:
+    """Extracts tags from text."""
+    return extract_annotations(text, extract_entitites=False, ignore_tags=existing_tags, use_cache=use_cache,
+        verbose=False, mode="split").tags
 
-    resp_eval = ExtractedEntities.model_validate_json(response)
+def extract_entities_from_text(text: str, existing_entities: Set[Entity] = None, use_cache: bool = True) -> Set[Entity]:
+    """Extracts entities from text."""
+    return extract_annotations(text, extract_tags=False, ignore_entities=existing_entities, use_cache=use_cache,
+        verbose=False, mode="split").entities
 
-    if resp_eval:
-        try:
-            entities = resp_eval.entities
-            return set(entities)
-        except AttributeError:
-            raise ValueError("Invalid response format from Ollama API: {}".format(response))
-    else:
-        raise ValueError("Invalid response format from Ollama API: {}".format(response))
-
-# def extract_time_intelligence_from_text(text: str) -> List[TimeIntelligence]:
-#     """Extracts time intelligence from text."""
-    
-#     sys_prompt = """
-#     You will be given a piece of text that is a note written by the user.
-#     Your task is to figure out which time intelligence might be a good fit for the note.
-#     Warning: if the note contains any word preceded by either '#', '@', or '^', you should ignore it.
-
-#     Your task is to extract time intelligence from the text, if any. 
-#     Time intelligence tuple constists the following fields:
-#     - literal: The literal representation of the time intelligence in the note, e.g. "next week".
-#     - value: The actual value of the time intelligence, e.g. "2023-10-15". Provide it as a string with the format "YYYY-MM-DD HH:mm:SS".
-#     - scope: The time scope of the intelligence, e.g. "WEEK", "DAY", etc.
-#     Each time intelligence scope must be of the following types: {}
-
-#     Structure your response as a JSON object.
-
-#     Note: When figuring out the dattime that is in the future, you MUST take into consideration current date and time.
-#     ATTENTION: Today is {}.
-#     """\
-#     .format(
-#         TimeScope.to_str(), 
-#         now(descriptive=True)
-#     )
-
-#     response = ollama_generate(
-#         sys_prompt=sys_prompt,
-#         user_prompt=text,
-#         format=ExtractedTimeIntelligence.model_json_schema()
-#     )
-
-#     resp_eval = ExtractedTimeIntelligence.model_validate_json(response)
-
-#     if resp_eval:
-#         try:
-#             time_intelligence = resp_eval.time_intelligence
-#             return time_intelligence
-#         except AttributeError:
-#             raise ValueError("Invalid response format from Ollama API: {}".format(response))
-#     else:
-#         raise ValueError("Invalid response format from Ollama API: {}".format(response))
+def extract_times_from_text(text: str, use_cache: bool = True) -> Set[Time]:
+    """Extracts time intelligence from text."""
+    return extract_annotations(text, extract_tags=False, extract_entitites=False, extract_times=True,
+        use_cache=use_cache, verbose=False, mode="split").times
     
 def extract_annotations(text: str,
     extract_tags: bool = True,
     extract_entitites: bool = True,
+    extract_times: bool = False,
     ignore_tags: Set[Tag] = set(),
-    ignore_entities: Set[Entity] = set()) -> Annotations:
-
-    new_annotations = Annotations()
-
-    # TAGS
-    if extract_tags:
-        print_sys("Extracting tags...")
-        new_annotations.tags = extract_tags_from_text(text, existing_tags=ignore_tags)
-        clear_previous_line()
-        
-
-    # ENTITIES
-    if extract_entitites:
-        print_sys("Extracting entities...")
-        new_annotations.entities = extract_entities_from_text(text, existing_entities=ignore_entities)
-        clear_previous_line()
-
-    # TIMES
-    # if times:
-    #     time_intelligence = extract_time_intelligence_from_text(text)
-    # else:
-    #     time_intelligence = None
-
-    return new_annotations
+    ignore_entities: Set[Entity] = set(),
+    use_cache: bool = True,
+    verbose: bool = True,
+    mode: str = None,
+    local_tagger: bool = True,
+    local_times: bool = True,
+    local_entities: bool = True) -> Annotations:
+    """
+    Extracts tags, entities and times from text. In `combined` mode this is one structured model call,
+    falling back to one call per annotation type (`split` mode) if the combined response cannot be parsed.
+    With `local_tagger`, the tags come from the workspace tagger when it is confident enough (see `tagger`),
+    with `local_entities` the known entities are typed by the workspace gazetteer (see `gazetteer`) and the
+    model is only asked for entities when the text has new ones, and with `local_times` the times come from
+    the local parser (see `timeparse`) unless some are ambiguous: the model is only asked for the rest.
+    """
+    mode = mode or extraction_mode()
+    requested, ignore_entities, local = _local_extraction(text, extract_tags, extract_entitites, extract_times,
+        ignore_tags, ignore_entities, local_tagger, local_times, local_entities)
+    if not any(requested):
+        return _merge_local(Annotations(), *local)
+
+    if verbose:
+        print_sys("Extracting annotations...")
+    try:
+        steps = _extraction_steps(mode, text, *requested, ignore_tags, ignore_entities)
+        try:
+            extracted = [generate_structured(sys_prompt, user_prompt, schema, use_cache=use_cache) for sys_prompt, user_prompt, schema in steps]
+        except ValueError as e:
+            if mode != "combined":
+                raise
+            if verbose:
+                print_warn(f"Combined extraction failed ({e}), falling back to split mode.")
+            steps = _extraction_steps("split", text, *requested, ignore_tags, ignore_entities)
+            extracted = [generate_structured(sys_prompt, user_prompt, schema, use_cache=use_cache) for sys_prompt, user_prompt, schema in steps]
+    finally:
+        if verbose:
+            clear_previous_line()
+
+    return _merge_local(_merge_extracted(extracted, *requested, ignore_tags, ignore_entities), *local)
+
+async def aextract_annotations(text: str,
+    extract_tags: bool = True,
+    extract_entitites: bool = True,
+    extract_times: bool = False,
+    ignore_tags: Set[Tag] = set(),
+    ignore_entities: Set[Entity] = set(),
+    use_cache: bool = True,
+    mode: str = None,
+    local_tagger: bool = True,
+    local_times: bool = True,
+    local_entities: bool = True) -> Annotations:
+    """Asynchronous (and silent) counterpart of `extract_annotations`, used by the batch pipelines."""
+    mode = mode or extraction_mode()
+    requested, ignore_entities, local = _local_extraction(text, extract_tags, extract_entitites, extract_times,
+        ignore_tags, ignore_entities, local_tagger, local_times, local_entities)
+    if not any(requested):
+        return _merge_local(Annotations(), *local)
+
+    async def run(steps: List[ExtractionStep]) -> List[BaseModel]:
+        return [
+            await agenerate_structured(sys_prompt, user_prompt, schema, use_cache=use_cache)
+            for sys_prompt, user_prompt, schema in steps
+        ]
+
+    try:
+        extracted = await run(_extraction_steps(mode, text, *requested, ignore_tags, ignore_entities))
+    except ValueError:
+        if mode != "combined":
+            raise
+        extracted = await run(_extraction_steps("split", text, *requested, ignore_tags, ignore_entities))
+
+    return _merge_local(_merge_extracted(extracted, *requested, ignore_tags, ignore_entities), *local)
+
+# --- Incremental Annotation ---
+
+ANNOTATION_KINDS = ("tags", "entities", "times")
+
+def prompt_version(kind: str) -> str:
+    """Short hash of the extraction instructions of an annotation kind: editing them invalidates the annotation logs."""
+    instructions = {
+        "tags": TAGS_INSTRUCTIONS,
+        "entities": ENTITIES_INSTRUCTIONS.format(EntityType.to_str()),
+        "times": TIMES_INSTRUCTIONS.format(TimeScope.to_str()),
+    }[kind]
+    return hashlib.sha256((ANNOTATE_SYS_PROMPT + instructions).encode()).hexdigest()[:8]
+
+def _requested_kinds(extract_tags: bool, extract_entities: bool, extract_times: bool) -> List[str]:
+    return [kind for kind, requested in zip(ANNOTATION_KINDS, (extract_tags, extract_entities, extract_times)) if requested]
+
+class PendingAnnotation(BaseModel):
+    """The snippets of a note to send to the model, and the annotation kinds to extract from them."""
+    ords: Set[int] = set()
+    extract_tags: bool = False
+    extract_entities: bool = False
+    extract_times: bool = False
+
+def pending_annotation(note: Note, extract_tags: bool, extract_entities: bool, extract_times: bool, incremental: bool = True) -> PendingAnnotation:
+    """
+    The snippets of the note that are new or changed since they were annotated (for each requested kind, with the
+    current model and prompt version, see `AnnotationLog`), or all of them if not `incremental`.
+    """
+    model = get_backend().model
+    pending = PendingAnnotation()
+    for kind in _requested_kinds(extract_tags, extract_entities, extract_times):
+        if incremental:
+            ords = note.annotation_log.pending(note.snippets, kind, model, prompt_version(kind))
+        else:
+            ords = {ord for ord, snippet in enumerate(note.snippets) if snippet.content.strip()}
+        if ords:
+            pending.ords |= ords
+            setattr(pending, f"extract_{kind}", True)
+    return pending
+
+def log_annotated(note: Note, pending: PendingAnnotation) -> bool:
+    """
+    Logs the snippets of the note as annotated for the kinds extracted, once the new annotations are applied
+    (applying them changes the snippets and their hashes). Returns whether the log changed.
+    """
+    kinds = _requested_kinds(pending.extract_tags, pending.extract_entities, pending.extract_times)
+    return note.annotation_log.record(note.snippets, kinds, get_backend().model, {kind: prompt_version(kind) for kind in kinds})
 
 # ---
 
@@ -178,21 +442,40 @@ PREDEFINED_PROMPTS = {
     """,
 }
 
-def generate(prompt_name: str, text: str) -> str:
-    """Generates some output based on the text from note(s) using LLM."""
-
+def get_predefined_prompt(prompt_name: str) -> str:
+    """Returns the system prompt of a predefined prompt, exits if there is none with this name."""
     sys_prompt = PREDEFINED_PROMPTS.get(prompt_name.upper(), "")
     if not sys_prompt:
         print_err(f"❌ Invalid prompt name: {prompt_name}")
         sys.exit(1)
+    return sys_prompt
+
+def generate(prompt_name: str, text: str, use_cache: bool = True) -> str:
+    """Generates some output based on the text from note(s) using LLM."""
+
+    sys_prompt = get_predefined_prompt(prompt_name)
 
     print_sys(f"Generating {prompt_name.upper()}...")
 
-    response = ollama_generate(
-        sys_prompt=sys_prompt,
-        user_prompt=text,
-    )
+    with prompt_context(prompt_name.upper()):
+        response = llm_generate(
+            sys_prompt=sys_prompt,
+            user_prompt=text,
+            use_cache=use_cache,
+        )
 
     clear_previous_line()
 
-    return response
\ No newline at end of file
+    return response
+
+def generate_stream(prompt_name: str, text: str, use_cache: bool = True, stats: GenerationStats = None, stream: bool = True) -> Iterator[str]:
+    """Like `generate`, but yields the output chunks as the model produces them."""
+    sys_prompt = get_predefined_prompt(prompt_name)
+    yield from llm_generate_stream(
+        sys_prompt=sys_prompt,
+        user_prompt=text,
+        use_cache=use_cache,
+        stats=stats,
+        stream=stream,
+        prompt=prompt_name.upper(),
+    )
@@ -0,0 +1,182 @@
+import os
+import threading
+from typing import Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .embeddings import normalize, top_k
+from .workspace import Workspace
+from ..utils import write_atomic
+from ..utils.config import section_config
+
+ANN_DEFAULTS = {
+    "nlist": 0, # number of inverted lists, 0 for about sqrt(number of notes)
+    "nprobe": 8,
+    "iterations": 20,
+    "train_size": 50_000,
+}
+
+def ann_config() -> dict:
+    """Returns the `ann` config merged with the defaults."""
+    return section_config("ann", ANN_DEFAULTS)
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (cosine) over normalized vectors. Returns the normalized centroids."""
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, len(vectors)))
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = ~sums.any(axis=1)
+        # Empty lists are re-seeded with random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids.astype(np.float32)
+
+class IVFIndex:
+    """
+    Approximate nearest-neighbour index over note vectors (inverted file): k-means centroids split the notes
+    into `nlist` lists and a query only scans the notes of its `nprobe` closest lists, so `nprobe` trades
+    recall for latency. Vectors are kept as a memory-mapped float32 matrix with an ID map giving the note and
+    list of each row. Changed notes are re-assigned to the closest trained centroid; retrain with `build`.
+    """
+    VECTORS_FN = "__ann__.f32"
+    IDS_FN = "__ann__.tsv"
+    CENTROIDS_FN = "__ann__.npz"
+    _lock = threading.Lock()
+
+    def __init__(self, ws: Workspace = None, settings: dict = None):
+        ws = ws or Workspace.get()
+        self.settings = settings or ann_config()
+        self.vectors_path = os.path.join(ws.base_dir, self.VECTORS_FN)
+        self.ids_path = os.path.join(ws.base_dir, self.IDS_FN)
+        self.centroids_path = os.path.join(ws.base_dir, self.CENTROIDS_FN)
+        self.__reload__()
+
+    # --- Storage ---
+
+    def exists(self) -> bool:
+        """Whether the workspace has a related notes index."""
+        return os.path.exists(self.centroids_path)
+
+    def __reload__(self):
+        """Re-reads the index, as another instance may have changed it."""
+        self.centroids = np.empty((0, 0), dtype=np.float32)
+        self.trained_on = 0
+        if os.path.exists(self.centroids_path):
+            with np.load(self.centroids_path) as data:
+                self.centroids = data["centroids"]
+                self.trained_on = int(data["trained_on"])
+        if os.path.exists(self.ids_path):
+            self.ids = pd.read_csv(self.ids_path, sep="\t", dtype={"NOTE_ID": str, "LIST": int}, keep_default_na=False)
+        else:
+            self.ids = pd.DataFrame({"NOTE_ID": pd.Series(dtype=str), "LIST": pd.Series(dtype=int)})
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    @property
+    def size(self) -> int:
+        """Number of indexed notes."""
+        return int((self.ids["LIST"] >= 0).sum())
+
+    def vectors(self) -> np.ndarray:
+        """The note vectors, memory-mapped read-only."""
+        if not len(self.ids):
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.ids), self.dim))
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Closest list of each vector."""
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    # --- Building ---
+
+    def build(self, note_ids: List[str], vectors: np.ndarray):
+        """Trains the centroids on the note vectors and writes the index, rows grouped by list."""
+        with self._lock:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            nlist = self.settings["nlist"] or int(np.sqrt(len(vectors)))
+            rng = np.random.default_rng(0)
+            train = vectors[rng.choice(len(vectors), size=min(len(vectors), self.settings["train_size"]), replace=False)]
+            self.centroids = kmeans(train, nlist, iterations=self.settings["iterations"])
+            self.trained_on = len(vectors)
+
+            lists = self.assign(vectors)
+            order = np.argsort(lists, kind="stable")
+            with open(self.vectors_path, "wb") as f:
+                f.write(np.ascontiguousarray(vectors[order]).tobytes())
+            self.ids = pd.DataFrame({"NOTE_ID": np.asarray(note_ids, dtype=object)[order], "LIST": lists[order]})
+            self.__write__()
+
+    def __write__(self):
+        write_atomic(self.ids_path, lambda f: self.ids.to_csv(f, sep="\t", index=False))
+        with open(self.centroids_path + ".tmp", "wb") as f:
+            np.savez(f, centroids=self.centroids, trained_on=self.trained_on)
+        os.replace(self.centroids_path + ".tmp", self.centroids_path)
+
+    def update(self, note_ids: Iterable[str], vectors_ids: List[str], vectors: np.ndarray):
+        """
+        Updates the notes in place: the ones of `vectors_ids` get their new vector and list (appended if new),
+        the other `note_ids` (no snippet left) are removed.
+        """
+        with self._lock:
+            self.__reload__()
+            rows = {note_id: i for i, note_id in enumerate(self.ids["NOTE_ID"])}
+            vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+            lists = self.assign(vectors) if len(vectors) else np.empty(0, dtype=int)
+
+            new_ids, new_rows = [], []
+            with open(self.vectors_path, "r+b") as f:
+                for note_id, vector, list_ in zip(vectors_ids, vectors, lists):
+                    if note_id in rows:
+                        f.seek(rows[note_id] * self.dim * 4)
+                        f.write(vector.tobytes())
+                        self.ids.at[rows[note_id], "LIST"] = list_
+                    else:
+                        new_ids.append((note_id, list_))
+                        new_rows.append(vector)
+                if new_rows:
+                    f.seek(len(self.ids) * self.dim * 4)
+                    f.write(np.vstack(new_rows).tobytes())
+                    f.truncate()
+
+            removed = set(note_ids) - set(vectors_ids)
+            self.ids.loc[self.ids["NOTE_ID"].isin(removed), "LIST"] = -1
+            if new_ids:
+                self.ids = pd.concat([self.ids, pd.DataFrame(new_ids, columns=["NOTE_ID", "LIST"])], ignore_index=True)
+            self.__write__()
+
+    def remove(self, note_id: str):
+        """Removes a note from the lists."""
+        self.update([note_id], [], np.empty((0, self.dim), dtype=np.float32))
+
+    # --- Querying ---
+
+    def vector(self, note_id: str) -> np.ndarray:
+        """The vector of an indexed note, None if it is not indexed."""
+        rows = np.flatnonzero((self.ids["NOTE_ID"] == note_id).to_numpy() & (self.ids["LIST"] >= 0).to_numpy())
+        return np.array(self.vectors()[rows[0]]) if len(rows) else None
+
+    def search(self, query: np.ndarray, k: int = 10, nprobe: int = None, exact: bool = False) -> List[Tuple[str, float]]:
+        """The `k` notes closest to the query vector, scanning the `nprobe` closest lists (all of them if `exact`)."""
+        lists = self.ids["LIST"].to_numpy()
+        if exact:
+            candidates = np.flatnonzero(lists >= 0)
+        else:
+            probed = top_k(self.centroids @ query, nprobe or self.settings["nprobe"])
+            candidates = np.flatnonzero(np.isin(lists, probed))
+        scores = self.vectors()[candidates] @ query
+        top = top_k(scores, k)
+        return [(self.ids.at[candidates[i], "NOTE_ID"], float(scores[i])) for i in top]
+
+    def related(self, note_id: str, k: int = 10, nprobe: int = None, exact: bool = False) -> List[Tuple[str, float]]:
+        """The `k` notes most similar to an indexed note."""
+        query = self.vector(note_id)
+        if query is None:
+            return []
+        return [hit for hit in self.search(query, k + 1, nprobe=nprobe, exact=exact) if hit[0] != note_id][:k]
@@ -6,6 +6,8 @@ from pydantic import BaseModel
 
 from .tag import Tag
 from .entity import Entity
+from .time import Time
+from .timeparse import find_times
 
 # Regex for extracting tags (#tag) and entities (@entity)
 
@@ -35,18 +37,26 @@ class Annotations(BaseModel):
     """Note annotations model."""
     tags: Set[Tag] = set()
     entities: Set[Entity] = set()
-    # times: Set[Time] = set()
+    times: Set[Time] = set()
     # urls: Set[URL] = set()
 
     # --- Logical Methods ---
     @classmethod
-    def extract(cls, content: str) -> "Annotations":
-        """Extract tags and entities from the content."""
+    def extract(cls, content: str, now: datetime = None) -> "Annotations":
+        """
+        Extract tags, entities and times from the content. Entities are typed from the workspace gazetteer
+        when known (see `gazetteer`). Times are the `^` literals plus the time expressions found by the local
+        parser, resolved relative to `now` (ambiguous ones left unresolved).
+        """
+        from ..gazetteer import type_entities
+        times = Time.extract(content, now)
+        literals = {time.content for time in times}
+        times |= {time for time in find_times(content, now) if time.content not in literals}
         return cls(
             tags=Tag.extract(content),
-            entities=Entity.extract(content),
+            entities=type_entities(Entity.extract(content)),
+            times=times,
             # TODO etc.
-            # times=cls.extract_times(content),
             # urls=cls.extract_urls(content)
         )
 
@@ -98,13 +108,37 @@ class Annotations(BaseModel):
     def entities_deserialize(cls, content: str) -> Set[Entity]:
         return {Entity.loads(entity) for entity in content.split("@") if entity.strip()}
     
+    # --- Times Methods ---
+
+    def add_time(self, time: str|Time) -> None:
+        """Add a time to the annotations."""
+        if isinstance(time, str):
+            self.times.add(Time(content=time))
+        elif isinstance(time, Time):
+            self.times.add(time)
+
+    def has_time(self, time: str|Time) -> bool:
+        """Check if the annotations contain a time literal."""
+        content = time.content if isinstance(time, Time) else time
+        return any(t.content == content for t in self.times)
+
+    @property
+    def times_serialized(self) -> str:
+        if not self.times:
+            return ""
+        return ' '.join([time.dumps() for time in self.times]).strip()
+
+    @classmethod
+    def times_deserialize(cls, content: str) -> Set[Time]:
+        return {Time.loads(time) for time in content.split("^") if time.strip()}
+
     # --- Serialization Methods ---
     
     def dumps(self, prefix=False) -> str:
         """Serialize the annotations to a string."""
         data = f"[TAGS] {self.tags_serialized}\n"
         data += f"[ENTITIES] {self.entities_serialized}\n"
-        # etc. data += f"[TIMES]...
+        data += f"[TIMES] {self.times_serialized}\n"
         return data
     
     @classmethod
@@ -112,7 +146,7 @@ class Annotations(BaseModel):
         """Deserialize the annotations from a string."""
         tags = set()
         entities = set()
-        # times = set()
+        times = set()
         # urls = set()
         
         lines = content.split("\n")
@@ -125,5 +159,9 @@ class Annotations(BaseModel):
             elif line.startswith("[ENTITIES]"):
                 entities_data = line[len("[ENTITIES]"):].strip()
                 entities = cls.entities_deserialize(entities_data)
+            # Load times
+            elif line.startswith("[TIMES]"):
+                times_data = line[len("[TIMES]"):].strip()
+                times = cls.times_deserialize(times_data)
         
-        return cls(tags=tags, entities=entities)
\ No newline at end of file
+        return cls(tags=tags, entities=entities, times=times)
\ No newline at end of file
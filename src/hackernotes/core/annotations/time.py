@@ -0,0 +1,57 @@
+from datetime import datetime
+from typing import Optional, Set
+from .annotation import Annotation
+from ..types import TimeScope
+
+TIME_PATTERN: str = r"(?<!\w)\^\w+"
+
+class Time(Annotation):
+    """Time annotation model: the literal as written in the note, plus its resolved value and scope."""
+    content: str
+    value: Optional[str] = None
+    scope: Optional[TimeScope] = None
+
+    # --- Logical Methods ---
+
+    @classmethod
+    def extract(cls, content: str, now: datetime = None) -> Set["Time"]:
+        """Extract the `^` time literals from the content, resolved when the local parser understands them."""
+        import re
+        from .timeparse import parse_time
+        times = set()
+        for time in re.findall(TIME_PATTERN, content):
+            times.add(parse_time(time[1:], now) or Time(content=time[1:]))
+        return times
+
+    def occurs(self, content: str) -> bool:
+        """Check if the time literal occurs in the given content."""
+        return self.content in content
+
+    # --- Serializaton Methods ---
+    def __hash__(self):
+        return self.dumps(prefix=False).__hash__()
+
+    def dumps(self, prefix: bool = True, content_only: bool = False) -> str:
+        """Serialize the time to a string, e.g. `^tomorrow (2025-05-01 00:00:00, DAY)`."""
+        output = f'{"^" if prefix else ""}{self.content.strip()}'
+        if content_only or (self.value is None and self.scope is None):
+            return output
+        return f'{output} ({self.value or ""}, {self.scope.value if self.scope else ""})'
+
+    @classmethod
+    def loads(cls, content: str) -> "Time":
+        """Deserialize the time from a string."""
+        import re
+        if content.startswith('^'):
+            content = content[1:]
+        match = re.match(r"^(.*?)\s*\(([^,]*),\s*([A-Z]*)\)\s*$", content.strip())
+        if not match:
+            return Time(content=content.strip())
+        literal, value, scope = match.groups()
+        return Time(content=literal.strip(), value=value.strip() or None, scope=scope or None)
+
+    def __repr__(self):
+        return '<TIME> '+self.dumps(prefix=False)
+
+    def __str__(self):
+        return '<TIME> '+self.dumps(prefix=False)
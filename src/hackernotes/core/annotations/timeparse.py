@@ -0,0 +1,251 @@
+"""
+Rule-based parser of the common time expressions ("tomorrow at 3pm", "next Friday", "in 2 weeks", "May 1st",
+"2025-05-01"...), resolved to a (value, scope) relative to a reference date. The rules are compiled once at
+import. Expressions that cannot be resolved without context (a bare weekday, "on 03/04") are returned without
+a value, for the model to resolve; the matches that cannot be times (an impossible date or time of day, a
+fraction such as "3/4" with nothing around it saying it is a date) are dropped.
+"""
+import calendar
+import re
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from .time import Time
+from ..types import TimeScope
+
+VALUE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = {name: i for i, name in enumerate(calendar.month_name) if name} | {name: i for i, name in enumerate(calendar.month_abbr) if name}
+MONTHS = {name.lower(): i for name, i in MONTHS.items()} | {"sept": 9}
+NUMBERS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+
+_WEEKDAY = "|".join(WEEKDAYS)
+# "may" is a month only when capitalized
+_MONTH = "|".join("(?-i:May)" if name == "may" else name for name in sorted(MONTHS, key=len, reverse=True))
+_NUMBER = r"\d{1,3}|" + "|".join(NUMBERS)
+_UNIT = r"minute|hour|day|week|month|year"
+_ORDINAL = r"(?:st|nd|rd|th)?"
+
+Resolved = Tuple[Optional[datetime], Optional[TimeScope]]
+# Returned by the rules for a match that is not a time
+NOT_A_TIME = None
+
+# --- Date arithmetic ---
+
+def _day(dt: datetime) -> datetime:
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _add_months(dt: datetime, months: int) -> datetime:
+    month = dt.month - 1 + months
+    year, month = dt.year + month // 12, month % 12 + 1
+    return dt.replace(year=year, month=month, day=min(dt.day, calendar.monthrange(year, month)[1]))
+
+def _number(word: str) -> int:
+    return int(word) if word.isdigit() else NUMBERS[word]
+
+def _date(year: int, month: int, day: int) -> Optional[datetime]:
+    try:
+        return datetime(year, month, day)
+    except ValueError:
+        return None
+
+def _offset(now: datetime, amount: int, unit: str) -> Resolved:
+    if unit == "minute":
+        return (now + timedelta(minutes=amount)).replace(second=0, microsecond=0), TimeScope.MINUTE
+    if unit == "hour":
+        return (now + timedelta(hours=amount)).replace(minute=0, second=0, microsecond=0), TimeScope.HOUR
+    if unit == "day":
+        return _day(now) + timedelta(days=amount), TimeScope.DAY
+    if unit == "week":
+        return _day(now) + timedelta(weeks=amount), TimeScope.WEEK
+    if unit == "month":
+        return _add_months(_day(now), amount), TimeScope.MONTH
+    return _add_months(_day(now), 12 * amount), TimeScope.YEAR
+
+# --- Rules ---
+
+def _relative_day(m: re.Match, now: datetime) -> Resolved:
+    days = {"today": 0, "tonight": 0, "tomorrow": 1, "yesterday": -1,
+            "the day after tomorrow": 2, "the day before yesterday": -2}[" ".join(m.group(1).lower().split())]
+    return _day(now) + timedelta(days=days), TimeScope.DAY
+
+def _relative_period(m: re.Match, now: datetime) -> Resolved:
+    shift = {"next": 1, "coming": 1, "last": -1, "previous": -1, "this": 0}[m.group(1).lower()]
+    unit = m.group(2).lower()
+    if unit == "week":
+        monday = _day(now) - timedelta(days=now.weekday())
+        return monday + timedelta(weeks=shift), TimeScope.WEEK
+    if unit == "month":
+        return _add_months(_day(now).replace(day=1), shift), TimeScope.MONTH
+    return datetime(now.year + shift, 1, 1), TimeScope.YEAR
+
+def _relative_weekday(m: re.Match, now: datetime) -> Resolved:
+    """`this X` is the X of the current week, `next X` the first X after today, `last X` the last one before."""
+    which, weekday = m.group(1).lower(), WEEKDAYS.index(m.group(2).lower())
+    today = _day(now)
+    if which == "this":
+        return today + timedelta(days=weekday - now.weekday()), TimeScope.DAY
+    if which in ("next", "coming"):
+        return today + timedelta(days=(weekday - now.weekday() - 1) % 7 + 1), TimeScope.DAY
+    return today - timedelta(days=(now.weekday() - weekday - 1) % 7 + 1), TimeScope.DAY
+
+def _in_offset(m: re.Match, now: datetime) -> Resolved:
+    return _offset(now, _number(m.group(1).lower()), m.group(2).lower())
+
+def _ago_offset(m: re.Match, now: datetime) -> Resolved:
+    return _offset(now, -_number(m.group(1).lower()), m.group(2).lower())
+
+def _iso(m: re.Match, now: datetime) -> Optional[Resolved]:
+    date = _date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+    if date is None:
+        return NOT_A_TIME
+    if m.group(4) is None:
+        return date, TimeScope.DAY
+    hour, minute, second = int(m.group(4)), int(m.group(5)), int(m.group(6) or 0)
+    if hour > 23 or minute > 59 or second > 59:
+        return NOT_A_TIME
+    return date.replace(hour=hour, minute=minute, second=second), TimeScope.SECOND if m.group(6) else TimeScope.MINUTE
+
+def _month_day(m: re.Match, now: datetime) -> Optional[Resolved]:
+    year = int(m.group(3)) if m.group(3) else now.year
+    date = _date(year, MONTHS[m.group(1).lower()], int(m.group(2)))
+    return (date, TimeScope.DAY) if date else NOT_A_TIME
+
+def _day_month(m: re.Match, now: datetime) -> Optional[Resolved]:
+    year = int(m.group(3)) if m.group(3) else now.year
+    date = _date(year, MONTHS[m.group(2).lower()], int(m.group(1)))
+    return (date, TimeScope.DAY) if date else NOT_A_TIME
+
+def _month_year(m: re.Match, now: datetime) -> Resolved:
+    return datetime(int(m.group(2)), MONTHS[m.group(1).lower()], 1), TimeScope.MONTH
+
+def _in_year(m: re.Match, now: datetime) -> Resolved:
+    return datetime(int(m.group(1)), 1, 1), TimeScope.YEAR
+
+# Words before a numeric date without a year telling it is not a fraction ("due 3/4")
+_DATE_CUE = re.compile(r"\b(?:on|by|due|until|till|from|since|before|after|the|of)\s+$", re.IGNORECASE)
+
+def _numeric_date(m: re.Match, now: datetime) -> Optional[Resolved]:
+    """
+    Day-first or month-first: only resolved when one of the two numbers cannot be a month. Without a year,
+    an ambiguous one is a date only after a word such as "on" or "due" (otherwise it is likely a fraction).
+    """
+    first, second = int(m.group(1)), int(m.group(2))
+    year = int(m.group(3)) if m.group(3) else now.year
+    year = year + 2000 if year < 100 else year
+    if first > 12 >= second:
+        date = _date(year, second, first)
+    elif second > 12 >= first:
+        date = _date(year, first, second)
+    elif first and second and (m.group(3) or _DATE_CUE.search(m.string, 0, m.start())):
+        return None, None
+    else:
+        return NOT_A_TIME
+    return (date, TimeScope.DAY) if date else NOT_A_TIME
+
+def _time_of_day(m: re.Match, now: datetime) -> Optional[Resolved]:
+    if m.group("word"):
+        hour, minute = (12, 0) if m.group("word").lower() == "noon" else (0, 0)
+    elif m.group("hour24"):
+        hour, minute = int(m.group("hour24")), int(m.group("minute24"))
+    else:
+        hour, minute = int(m.group("hour")), int(m.group("minute") or 0)
+        ampm = m.group("ampm").lower()
+        if not 1 <= hour <= 12:
+            return NOT_A_TIME
+        if ampm == "pm" and hour != 12:
+            hour += 12
+        elif ampm == "am" and hour == 12:
+            hour = 0
+    if hour > 23 or minute > 59:
+        return NOT_A_TIME
+    return _day(now).replace(hour=hour, minute=minute), TimeScope.MINUTE if minute else TimeScope.HOUR
+
+def _ambiguous(m: re.Match, now: datetime) -> Resolved:
+    return None, None
+
+Rule = Tuple[re.Pattern, Callable[[re.Match, datetime], Optional[Resolved]]]
+
+def _rule(pattern: str, resolve: Callable[[re.Match, datetime], Optional[Resolved]]) -> Rule:
+    # Not part of a word, an annotation, a version number or a path
+    return re.compile(rf"(?<![\w^#@./:-])(?:{pattern})(?![\w/-]|\.\d)", re.IGNORECASE), resolve
+
+RULES: List[Rule] = [
+    _rule(r"(the\s+day\s+after\s+tomorrow|the\s+day\s+before\s+yesterday|today|tonight|tomorrow|yesterday)", _relative_day),
+    _rule(rf"(next|last|this|coming|previous)\s+(week|month|year)", _relative_period),
+    _rule(rf"(next|last|this|coming|previous)\s+({_WEEKDAY})", _relative_weekday),
+    _rule(rf"in\s+({_NUMBER})\s+({_UNIT})s?", _in_offset),
+    _rule(rf"({_NUMBER})\s+({_UNIT})s?\s+ago", _ago_offset),
+    _rule(r"(\d{4})-(\d{2})-(\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2}))?)?", _iso),
+    _rule(rf"({_MONTH})\.?\s+(\d{{1,2}}){_ORDINAL}(?:,?\s+(\d{{4}}))?", _month_day),
+    _rule(rf"(\d{{1,2}}){_ORDINAL}\s+(?:of\s+)?({_MONTH})\.?(?:,?\s+(\d{{4}}))?", _day_month),
+    _rule(rf"({_MONTH})\.?\s+(\d{{4}})", _month_year),
+    _rule(r"in\s+(\d{4})", _in_year),
+    _rule(r"(\d{1,2})/(\d{1,2})(?:/(\d{4}|\d{2}))?", _numeric_date),
+    _rule(r"(?:at\s+)?(?:(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))?\s*(?P<ampm>am|pm)|(?P<word>noon|midnight))"
+          r"|at\s+(?P<hour24>\d{1,2}):(?P<minute24>\d{2})", _time_of_day),
+    _rule(rf"(?:on\s+)?({_WEEKDAY})", _ambiguous),
+]
+
+# A day followed by a time of day ("tomorrow at 3pm") is a single expression
+_DAY_TIME_GAP = re.compile(r"\s*(?:,\s*)?")
+
+# --- Parsing ---
+
+Match = Tuple[int, int, Optional[Resolved], Callable]
+
+def _matches(text: str, now: datetime) -> List[Match]:
+    """
+    All the rule matches, overlapping ones resolved in favour of the earliest, then longest (the ones that
+    are not times included, so that no shorter expression is found inside them).
+    """
+    found = []
+    for pattern, resolve in RULES:
+        for m in pattern.finditer(text):
+            found.append((m.start(), m.end(), resolve(m, now), resolve))
+    found.sort(key=lambda match: (match[0], -match[1]))
+    matches, end = [], -1
+    for match in found:
+        if match[0] >= end:
+            matches.append(match)
+            end = match[1]
+    return matches
+
+def _merge_day_time(text: str, matches: List[Match]) -> List[Match]:
+    """Merges a day expression directly followed by a time of day."""
+    merged = []
+    for start, stop, (value, scope), resolve in matches:
+        if merged and resolve is _time_of_day and value is not None:
+            prev_start, prev_stop, (prev_value, prev_scope), prev_resolve = merged[-1]
+            if prev_scope == TimeScope.DAY and _DAY_TIME_GAP.fullmatch(text[prev_stop:start]):
+                merged[-1] = (prev_start, stop, (prev_value.replace(hour=value.hour, minute=value.minute), scope), prev_resolve)
+                continue
+        merged.append((start, stop, (value, scope), resolve))
+    return merged
+
+def find_times(text: str, now: datetime = None) -> List[Time]:
+    """
+    The time expressions of a free text, resolved relative to `now`. Ambiguous ones have no value nor scope.
+    """
+    now = now or datetime.now()
+    times = []
+    matches = [match for match in _matches(text, now) if match[2] is not NOT_A_TIME]
+    for start, stop, (value, scope), _ in _merge_day_time(text, matches):
+        times.append(Time(
+            content=text[start:stop].strip(),
+            value=value.strftime(VALUE_FORMAT) if value else None,
+            scope=scope if value else None,
+        ))
+    return times
+
+def parse_time(literal: str, now: datetime = None) -> Optional[Time]:
+    """Resolves a literal that is a single time expression as a whole (e.g. of a `^` marker), None otherwise."""
+    literal = literal.strip()
+    times = find_times(literal, now)
+    if len(times) == 1 and times[0].content == literal and times[0].value:
+        return times[0]
+    return None
@@ -0,0 +1,211 @@
+import hashlib
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from .ai import extract_annotations, log_annotated, pending_annotation
+from .note import Note
+from .types import EntityType, TaskType
+from ..db import SessionLocal, db_exists, get_engine
+from ..db.migrations import migrate
+from ..db.models import AutomationQueue
+from ..db.query import TaskCRUD
+from ..utils.config import config, section_config
+from ..utils.llm import priority, warm_up
+from ..utils.parsers import tags2line
+from ..utils.term import print_err, print_sys, print_warn
+
+AUTOMATION_DEFAULTS = {
+    "workers": 2,
+    "max_attempts": 5,
+    "backoff_base_s": 30,
+    "backoff_max_s": 3600,
+    "poll_interval_s": 2,
+    "stale_after_s": 900,
+}
+
+def automation_config() -> dict:
+    """Returns the `automation` config merged with the defaults."""
+    return section_config("automation", AUTOMATION_DEFAULTS)
+
+# --- Task Handlers ---
+
+class NoteChanged(Exception):
+    """The note was saved by someone else while a task was working on an older copy of it."""
+
+def _file_hash(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def annotate_task(task: AutomationQueue) -> str:
+    """
+    Extracts tags and entities of the new or changed snippets of the task's note, applies and persists them.
+    Raises `NoteChanged` instead of overwriting the note if it was saved during the extraction.
+    """
+    version = _file_hash(Note.__get_path__(task.note_id))
+    note = Note.read(task.note_id)
+    if not note:
+        raise ValueError(f"Note {task.note_id} not found.")
+    pending = pending_annotation(note, extract_tags=True, extract_entities=True, extract_times=False)
+    if not pending.ords:
+        return "Already annotated."
+    new_annotations = extract_annotations(
+        note.snippets.dumps(pending.ords),
+        extract_tags=pending.extract_tags,
+        extract_entitites=pending.extract_entities,
+        ignore_tags=note.annotations.tags,
+        ignore_entities={e for e in note.annotations.entities if e.type != EntityType.UNKNOWN},
+        verbose=False,
+    )
+    changed = bool(new_annotations.tags or new_annotations.entities)
+    if changed:
+        note.apply_annotations(new_annotations)
+    if log_annotated(note, pending) or changed:
+        if _file_hash(note.file_path) != version:
+            raise NoteChanged(f"Note {note.meta.id} was saved during the annotation.")
+        note.persist(embed=changed, queue=False)
+    if not changed:
+        return "No new annotations."
+    Note.index(note.meta.id)
+    return f"{tags2line(new_annotations.tags)} {new_annotations.entities_serialized}".strip()
+
+def embed_task(task: AutomationQueue) -> str:
+    """Re-embeds the new or changed snippets of the task's note (see `Note.persist`)."""
+    from .embeddings import update_embeddings
+    note = Note.read(task.note_id)
+    if not note:
+        raise ValueError(f"Note {task.note_id} not found.")
+    return f"{update_embeddings([note], strict=True)} snippets embedded."
+
+TASK_HANDLERS: Dict[str, Callable[[AutomationQueue], str]] = {
+    TaskType.ANNOTATE.value: annotate_task,
+    TaskType.EMBED.value: embed_task,
+}
+
+# --- Queue ---
+
+_schema_ready = False
+
+def ensure_schema() -> bool:
+    """
+    Makes sure the queue table is up to date (once per process). Returns False, without creating the
+    database, if it was never initialized.
+    """
+    global _schema_ready
+    if not db_exists():
+        print_warn("Database not initialized. Run `hn db init` first.")
+        return False
+    if not _schema_ready:
+        migrate(get_engine())
+        _schema_ready = True
+    return True
+
+def enqueue(task_type: TaskType, note_id: str = None, scheduled_at: datetime = None) -> bool:
+    """
+    Enqueues a task in the active workspace. This only inserts a row, so it never waits on the LLM.
+    """
+    if not db_exists():
+        print_warn("Database not initialized, task not queued. Run `hn db init` first.")
+        return False
+    ensure_schema()
+    with SessionLocal() as session:
+        TaskCRUD.enqueue(
+            session,
+            task_type=task_type.value,
+            workspace=config.get("active_workspace"),
+            note_id=note_id,
+            scheduled_at=scheduled_at,
+        )
+    return True
+
+def backoff_delay(attempts: int, base_s: float, max_s: float) -> float:
+    """Exponential backoff delay (in seconds) before the next attempt."""
+    return min(max_s, base_s * 2 ** max(0, attempts - 1))
+
+def execute_next(worker: str, settings: dict = None) -> bool:
+    """
+    Claims and executes the next due task of the active workspace. Returns False if there was none.
+    """
+    settings = settings or automation_config()
+    workspace = config.get("active_workspace")
+    with SessionLocal() as session:
+        task = TaskCRUD.claim(session, workspace=workspace, worker=worker)
+        if task is None:
+            return False
+        handler = TASK_HANDLERS.get(task.task_type)
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown task type: {task.task_type}")
+            result = handler(task)
+        except NoteChanged as e:
+            # Retried at once, on the saved note
+            TaskCRUD.fail(session, task.id, f"Requeued ({e})", retry_at=datetime.now())
+            print_warn(f"[{worker}] Task {task.id} ({task.task_type} {task.note_id}) requeued: {e}")
+            return True
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if handler is not None and task.attempts < settings["max_attempts"]:
+                delay = backoff_delay(task.attempts, settings["backoff_base_s"], settings["backoff_max_s"])
+                TaskCRUD.fail(session, task.id, error, retry_at=datetime.now() + timedelta(seconds=delay))
+            else:
+                TaskCRUD.fail(session, task.id, error)
+            print_err(f"[{worker}] Task {task.id} ({task.task_type} {task.note_id}) failed: {error}")
+            return True
+        TaskCRUD.complete(session, task.id, result=result)
+        print_sys(f"[{worker}] Task {task.id} ({task.task_type} {task.note_id}) done.")
+    return True
+
+def run_workers(workers: int = None, once: bool = False, settings: dict = None):
+    """
+    Runs a pool of workers over the queue of the active workspace.
+    With `once`, the workers stop when there is no due task left; otherwise they poll until interrupted.
+    """
+    settings = settings or automation_config()
+    workers = workers or settings["workers"]
+    stop = threading.Event()
+
+    if not ensure_schema():
+        return
+    with SessionLocal() as session:
+        stale = TaskCRUD.requeue_stale(
+            session,
+            running_before=datetime.now() - timedelta(seconds=settings["stale_after_s"]),
+            workspace=config.get("active_workspace"),
+        )
+        if stale:
+            print_warn(f"Requeued {stale} stale running tasks.")
+
+    # Load the model once up front, the workers' first tasks would otherwise all wait on the cold start
+    loaded_in = warm_up()
+    if loaded_in is not None:
+        print_sys(f"Model ready in {loaded_in:.2f}s.")
+
+    def work(worker: str):
+        # The tasks' model calls yield to the interactive commands (see `utils.llm.scheduler`)
+        with priority("background"):
+            while not stop.is_set():
+                try:
+                    executed = execute_next(worker, settings)
+                except Exception as e:
+                    print_err(f"[{worker}] {type(e).__name__}: {e}")
+                    executed = False
+                if not executed:
+                    if once:
+                        return
+                    stop.wait(settings["poll_interval_s"])
+
+    host = socket.gethostname()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(work, f"{host}-{i}") for i in range(workers)]
+        try:
+            while not all(f.done() for f in futures):
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            print_warn("Stopping the workers after their current tasks...")
+            stop.set()
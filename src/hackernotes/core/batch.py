@@ -0,0 +1,151 @@
+import asyncio
+import time
+from typing import Dict, List
+
+import click
+from pydantic import BaseModel
+
+from .ai import aextract_annotations, log_annotated, pending_annotation
+from .embeddings import update_embeddings
+from .gazetteer import gazetteer_config, get_gazetteer
+from .note import Note
+from .tagger import get_tagger, tagger_config
+from .types import EntityType
+from ..utils.llm import priority, warm_up
+from ..utils.term import clear_terminal_line, fsys
+
+class BatchReport(BaseModel):
+    """Summary of a batch run over many notes."""
+    total: int = 0
+    done: int = 0
+    changed: int = 0
+    up_to_date: int = 0 # notes with no new or changed snippet to annotate
+    failed: Dict[str, str] = {}
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Processed notes per second."""
+        return self.done / self.elapsed if self.elapsed else 0.0
+
+    def progress(self) -> str:
+        return f"[{self.done}/{self.total}] {self.throughput:.2f} notes/s, {self.up_to_date} up to date, {len(self.failed)} failed"
+
+async def _annotate_notes(
+    note_ids: List[str],
+    concurrency: int,
+    extract_tags: bool,
+    extract_entities: bool,
+    extract_times: bool,
+    use_cache: bool,
+    local_tagger: bool,
+    local_times: bool,
+    local_entities: bool,
+    incremental: bool,
+    report: BatchReport,
+) -> List[Note]:
+    """
+    Runs the extraction over the notes with `concurrency` workers, so at most `concurrency` in-flight model
+    requests. The note ids are fed to them through a bounded queue: a note is read when a worker takes it.
+    """
+    note_queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    started = time.perf_counter()
+    changed_notes = []
+
+    async def annotate_one(note_id: str):
+        note = Note.read(note_id)
+        if not note:
+            raise ValueError("note not found")
+        pending = pending_annotation(note, extract_tags, extract_entities, extract_times, incremental)
+        if not pending.ords:
+            report.up_to_date += 1
+            return None
+        new_annotations = await aextract_annotations(
+            note.snippets.dumps(pending.ords),
+            extract_tags=pending.extract_tags,
+            extract_entitites=pending.extract_entities,
+            extract_times=pending.extract_times,
+            ignore_tags=note.annotations.tags,
+            ignore_entities={e for e in note.annotations.entities if e.type != EntityType.UNKNOWN},
+            use_cache=use_cache,
+            local_tagger=local_tagger,
+            local_times=local_times,
+            local_entities=local_entities,
+        )
+        changed = bool(new_annotations.tags or new_annotations.entities or new_annotations.times)
+        if changed:
+            note.apply_annotations(new_annotations)
+        if log_annotated(note, pending) or changed:
+            note.persist(queue=False)
+        return note if changed else None
+
+    async def worker():
+        while (note_id := await note_queue.get()) is not None:
+            try:
+                note = await annotate_one(note_id)
+            except Exception as e:
+                report.failed[note_id] = str(e) or type(e).__name__
+            else:
+                if note is not None:
+                    report.changed += 1
+                    changed_notes.append(note)
+            report.done += 1
+            report.elapsed = time.perf_counter() - started
+            clear_terminal_line()
+            click.echo(fsys(report.progress()), nl=False)
+
+    async def feed():
+        for note_id in note_ids:
+            await note_queue.put(note_id)
+        for _ in range(concurrency):
+            await note_queue.put(None)
+
+    await asyncio.gather(feed(), *(worker() for _ in range(concurrency)))
+    click.echo()
+
+    return changed_notes
+
+def annotate_notes(
+    note_ids: List[str],
+    concurrency: int = 4,
+    extract_tags: bool = True,
+    extract_entities: bool = True,
+    extract_times: bool = False,
+    use_cache: bool = True,
+    local_tagger: bool = True,
+    local_times: bool = True,
+    local_entities: bool = True,
+    incremental: bool = True,
+) -> BatchReport:
+    """
+    Annotates many notes concurrently (no interaction): extracted annotations are applied and persisted
+    note by note, and the workspace index is rebuilt once at the end for all the changed notes.
+    With `incremental`, only the snippets new or changed since the last annotation are sent to the model.
+    The model calls run in the bulk priority class (see `utils.llm.scheduler`).
+    """
+    report = BatchReport(total=len(note_ids))
+    # Bulk priority: interactive commands and the automation workers go first on the model server
+    with priority("bulk"):
+        if note_ids:
+            warm_up()
+            if extract_tags and local_tagger and tagger_config()["enabled"]:
+                get_tagger() # learnt once, before the notes are processed concurrently
+            if extract_entities and local_entities and gazetteer_config()["enabled"]:
+                get_gazetteer()
+        changed_notes = asyncio.run(_annotate_notes(
+            note_ids,
+            concurrency=max(1, concurrency),
+            extract_tags=extract_tags,
+            extract_entities=extract_entities,
+            extract_times=extract_times,
+            use_cache=use_cache,
+            local_tagger=local_tagger,
+            local_times=local_times,
+            local_entities=local_entities,
+            incremental=incremental,
+            report=report,
+        ))
+        if changed_notes:
+            Note.index_many(changed_notes)
+            update_embeddings(changed_notes)
+    return report
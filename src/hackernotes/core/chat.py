@@ -0,0 +1,221 @@
+"""
+Retrieval-augmented chat over the notes of the workspace. Each turn sends only the snippets relevant to the
+question (semantic search when the workspace has embeddings, BM25 otherwise), and only the ones not sent yet:
+backends that keep the conversation context (see `LLMBackend.converse`) are not resent the previous turns,
+so the cost of a turn does not grow with the conversation. Retrievals are memoized per question until the
+notes change, and the sessions (context included) are persisted to be resumed.
+"""
+import json
+import os
+import time
+from datetime import datetime
+from typing import ClassVar, Dict, Iterator, List, Optional, Set
+
+import shortuuid
+from pydantic import BaseModel
+
+from .context import keyword_scores
+from .embeddings import EmbeddingIndex
+from .note import Note
+from .workspace import Workspace
+from ..utils import write_atomic
+from ..utils.config import section_config
+from ..utils.llm import GenerationStats, get_backend
+
+CHAT_DEFAULTS = {
+    "top_k": 5, # snippets retrieved per question
+    "max_context_tokens": 6000, # beyond, the backend context is dropped and the recent turns are resent
+    "history_turns": 4, # turns resent when the backend keeps no context
+}
+
+CHAT_SYS_PROMPT = """
+    You are an assistant answering the user's questions about their notes.
+    Each question comes with the note snippets relevant to it, one per line as `[<note id>:<ord>] <content>`.
+    Answer from these snippets (and the ones given earlier in the conversation), citing the ones you use as [<note id>:<ord>].
+    If the snippets do not contain the answer, say so. Be concise.
+    """
+
+def chat_config() -> dict:
+    """Returns the `chat` config merged with the defaults."""
+    return section_config("chat", CHAT_DEFAULTS)
+
+class RetrievedSnippet(BaseModel):
+    """A snippet retrieved for a question."""
+    note_id: str
+    ord: int
+    content: str
+    score: float
+
+    @property
+    def key(self) -> str:
+        return f"{self.note_id}:{self.ord}"
+
+class Retrieval(BaseModel):
+    """Memoized retrieval of a question, valid as long as the notes (and their embeddings) did not change."""
+    version: float
+    snippets: List[RetrievedSnippet] = []
+
+class ChatTurn(BaseModel):
+    """A question, its answer and the snippets it was given."""
+    question: str
+    answer: str = ""
+    sources: List[str] = []
+    prompt_tokens: int = 0
+    ttft: Optional[float] = None
+    elapsed: float = 0.0
+
+class ChatSession(BaseModel):
+    """A persisted chat: its turns, the backend context and the snippets it already holds, and the memoized retrievals."""
+    CHATS_DIR: ClassVar[str] = "__chats__"
+
+    id: str
+    title: str = "Untitled"
+    created_at: datetime
+    updated_at: datetime
+    backend: str = ""
+    model: str = ""
+    context: List[int] = []
+    sent: Set[str] = set()
+    turns: List[ChatTurn] = []
+    retrievals: Dict[str, Retrieval] = {}
+
+    @classmethod
+    def new(cls) -> "ChatSession":
+        now = datetime.now()
+        return cls(id=shortuuid.ShortUUID().random(length=8), created_at=now, updated_at=now)
+
+    # --- Storage ---
+
+    @classmethod
+    def __get_dir__(cls, ws: Workspace = None) -> str:
+        ws = ws or Workspace.get()
+        return os.path.join(ws.base_dir, cls.CHATS_DIR)
+
+    @property
+    def file_path(self) -> str:
+        return os.path.join(self.__get_dir__(), f"{self.id}.json")
+
+    def save(self):
+        self.updated_at = datetime.now()
+        os.makedirs(self.__get_dir__(), exist_ok=True)
+        write_atomic(self.file_path, lambda f: f.write(self.model_dump_json()))
+
+    @classmethod
+    def load(cls, session_id: str) -> "ChatSession":
+        """Loads a persisted session, None if there is none with this id."""
+        path = os.path.join(cls.__get_dir__(), f"{session_id}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls.model_validate(json.load(f))
+
+    @classmethod
+    def list_sessions(cls) -> List["ChatSession"]:
+        """The persisted sessions of the workspace, the most recent first."""
+        chats_dir = cls.__get_dir__()
+        if not os.path.isdir(chats_dir):
+            return []
+        sessions = [cls.load(fn[:-len(".json")]) for fn in os.listdir(chats_dir) if fn.endswith(".json")]
+        return sorted(sessions, key=lambda session: session.updated_at, reverse=True)
+
+# --- Retrieval ---
+
+def _notes_version() -> float:
+    """Changes whenever notes (the workspace index) or their embeddings change."""
+    ws = Workspace.get()
+    paths = [os.path.join(ws.base_dir, fn) for fn in ("__index__.tsv", EmbeddingIndex.IDS_FN)]
+    return max((os.path.getmtime(path) for path in paths if os.path.exists(path)), default=0.0)
+
+def search_snippets(query: str, k: int) -> List[RetrievedSnippet]:
+    """The `k` snippets of the workspace most relevant to the query."""
+    index = EmbeddingIndex()
+    notes: Dict[str, Note] = {}
+    def content(note_id: str, ord: int) -> str:
+        if note_id not in notes:
+            notes[note_id] = Note.read(note_id)
+        note = notes[note_id]
+        return note.snippets[ord].content.strip() if note and ord < len(note.snippets) else ""
+
+    if index.exists():
+        hits = [(hit.note_id, hit.ord, hit.score) for hit in index.search(query, k=k)]
+        return [RetrievedSnippet(note_id=note_id, ord=ord, content=content(note_id, ord), score=score) for note_id, ord, score in hits]
+
+    candidates = []
+    for note_id in Workspace.get().get_index().index:
+        note = Note.read(note_id)
+        if note:
+            candidates.extend((note_id, ord, snippet.content.strip()) for ord, snippet in enumerate(note.snippets) if snippet.content.strip())
+    scores = keyword_scores(query, candidates)
+    ranking = sorted((i for i in range(len(candidates)) if scores[i] > 0), key=lambda i: scores[i], reverse=True)[:k]
+    return [RetrievedSnippet(note_id=candidates[i][0], ord=candidates[i][1], content=candidates[i][2], score=scores[i]) for i in ranking]
+
+def retrieve(session: ChatSession, query: str, k: int) -> List[RetrievedSnippet]:
+    """The snippets relevant to the query, memoized in the session until the notes change."""
+    key = f"{k}:{' '.join(query.lower().split())}"
+    version = _notes_version()
+    memo = session.retrievals.get(key)
+    if memo is None or memo.version != version:
+        memo = session.retrievals[key] = Retrieval(version=version, snippets=search_snippets(query, k))
+    return memo.snippets
+
+# --- Turns ---
+
+def _turn_prompt(question: str, snippets: List[RetrievedSnippet], already_sent: List[str], history: List[ChatTurn]) -> str:
+    prompt = ""
+    if history:
+        prompt += "Previous conversation:\n" + "".join(f"Q: {turn.question}\nA: {turn.answer}\n" for turn in history) + "\n"
+    if snippets:
+        prompt += "Snippets:\n" + "".join(f"[{s.key}] {s.content}\n" for s in snippets)
+    if already_sent:
+        prompt += "Also relevant, given earlier: " + " ".join(f"[{key}]" for key in already_sent) + "\n"
+    if not snippets and not already_sent:
+        prompt += "No snippet of the notes is relevant to this question.\n"
+    return prompt + f"\nQuestion: {question}"
+
+def ask(session: ChatSession, question: str, k: int = None, stats: GenerationStats = None) -> Iterator[str]:
+    """
+    Streams the answer to a question of the session, then records the turn and saves the session.
+    Only the retrieved snippets not already in the backend context are sent; without a backend context
+    (or once it exceeds `max_context_tokens`), the recent turns are resent instead.
+    """
+    settings = chat_config()
+    stats = stats if stats is not None else GenerationStats()
+    backend = get_backend()
+    if (session.backend, session.model) != (backend.name, backend.model) or len(session.context) > settings["max_context_tokens"]:
+        session.backend, session.model = backend.name, backend.model
+        session.context, session.sent = [], set()
+
+    snippets = retrieve(session, question, k or settings["top_k"])
+    history = []
+    if not (backend.supports_context and session.context):
+        session.context, session.sent = [], set()
+        history = session.turns[-settings["history_turns"]:] if settings["history_turns"] else []
+    new = [s for s in snippets if s.key not in session.sent]
+    already_sent = [s.key for s in snippets if s.key in session.sent]
+
+    turn = ChatTurn(question=question, sources=[s.key for s in snippets])
+    started = time.perf_counter()
+    chunks = []
+    for chunk in backend.converse(CHAT_SYS_PROMPT, _turn_prompt(question, new, already_sent, history), session.context, label="chat"):
+        if chunk.content:
+            if stats.ttft is None:
+                stats.ttft = time.perf_counter() - started
+            chunks.append(chunk.content)
+            stats.tokens += 1
+            yield chunk.content
+        if chunk.done:
+            turn.prompt_tokens = chunk.prompt_tokens
+            if chunk.completion_tokens:
+                stats.tokens = chunk.completion_tokens
+            if backend.supports_context and chunk.context is not None:
+                session.context = chunk.context
+    stats.streamed = True
+    stats.elapsed = time.perf_counter() - started
+
+    turn.answer, turn.ttft, turn.elapsed = "".join(chunks), stats.ttft, stats.elapsed
+    if backend.supports_context:
+        session.sent |= {s.key for s in new}
+    if not session.turns:
+        session.title = question[:60]
+    session.turns.append(turn)
+    session.save()
@@ -0,0 +1,141 @@
+"""
+Context packing: instead of concatenating every matching note into the prompt, the snippets are ranked by
+relevance to the query, deduplicated, and greedily packed into a token budget. The prompt size (and so the
+prefill time) is bounded whatever the number of matching notes.
+"""
+import math
+from collections import Counter
+from typing import Dict, List, Set, Tuple
+
+from pydantic import BaseModel
+
+from .embeddings import EmbeddingIndex
+from .note import Note
+from .tagger import tokenize
+from ..utils.config import section_config
+from ..utils.llm import estimate_tokens
+from ..utils.term import print_warn
+
+CONTEXT_DEFAULTS = {
+    "budget_tokens": 2500, # below the map-reduce chunk size, so that the packed context goes in a single call
+    "scoring": "auto", # keyword (BM25), semantic (embeddings), or auto: semantic if the workspace has embeddings
+    "dedup_threshold": 0.8, # word overlap (Jaccard) above which a snippet is a near-duplicate of a selected one
+}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+def context_config() -> dict:
+    """Returns the `context` config merged with the defaults."""
+    return section_config("context", CONTEXT_DEFAULTS)
+
+class ContextReport(BaseModel):
+    """What the packer kept out of the candidate snippets."""
+    scoring: str = ""
+    candidates: int = 0
+    selected: int = 0
+    duplicates: int = 0
+    tokens: int = 0
+    budget: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"{self.selected}/{self.candidates} snippets ({self.scoring}), {self.duplicates} duplicates dropped, "
+            f"{self.tokens}/{self.budget} tokens"
+        )
+
+Candidate = Tuple[str, int, str] # note id, snippet ord, content
+
+# --- Scoring ---
+
+def keyword_scores(query: str, candidates: List[Candidate]) -> List[float]:
+    """BM25 scores of the candidates for the words of the query."""
+    words = set(tokenize(query))
+    docs = [Counter(tokenize(content)) for _, _, content in candidates]
+    if not words or not docs:
+        return [0.0] * len(candidates)
+    avg_length = sum(sum(doc.values()) for doc in docs) / len(docs) or 1.0
+    df = Counter(word for doc in docs for word in words if word in doc)
+    idf = {word: math.log(1 + (len(docs) - df[word] + 0.5) / (df[word] + 0.5)) for word in words}
+    scores = []
+    for doc in docs:
+        length = sum(doc.values())
+        scores.append(sum(
+            idf[word] * doc[word] * (K1 + 1) / (doc[word] + K1 * (1 - B + B * length / avg_length))
+            for word in words if word in doc
+        ))
+    return scores
+
+def semantic_scores(query: str, candidates: List[Candidate]) -> List[float]:
+    """Cosine similarities of the candidates to the query (-1 for the snippets not embedded yet)."""
+    scores = EmbeddingIndex().snippet_scores(query, {note_id for note_id, _, _ in candidates})
+    return [scores.get((note_id, ord), -1.0) for note_id, ord, _ in candidates]
+
+# --- Packing ---
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else float(a == b)
+
+def pack_context(notes: List[Note], query: str, budget: int = None, scoring: str = None, report: ContextReport = None) -> List[str]:
+    """
+    The most relevant snippets of the notes for the query that fit in the token budget: ranked (ties broken by
+    recency), exact and near-duplicates dropped, packed greedily (a snippet too long for the remaining budget
+    is skipped for the next ones). Returns the texts of the notes restricted to their selected snippets,
+    in the notes order.
+    """
+    settings = context_config()
+    budget = budget or settings["budget_tokens"]
+    scoring = scoring or settings["scoring"]
+    if scoring == "auto":
+        scoring = "semantic" if EmbeddingIndex().exists() else "keyword"
+    report = report if report is not None else ContextReport()
+    report.scoring, report.budget = scoring, budget
+
+    candidates: List[Candidate] = [
+        (note.meta.id, ord, snippet.content.strip())
+        for note in notes
+        for ord, snippet in enumerate(note.snippets)
+        if snippet.content.strip()
+    ]
+    report.candidates = len(candidates)
+    if not candidates:
+        return []
+
+    scores = None
+    if scoring == "semantic":
+        try:
+            scores = semantic_scores(query, candidates)
+        except Exception as e:
+            print_warn(f"Semantic scoring failed ({e}), falling back to keywords.")
+            report.scoring = "keyword"
+    if scores is None:
+        scores = keyword_scores(query, candidates)
+
+    # Rank, the most recent notes first on equal scores
+    recency = {note.meta.id: note.meta.created_at for note in notes}
+    ranking = sorted(range(len(candidates)), key=lambda i: (scores[i], recency[candidates[i][0]]), reverse=True)
+
+    threshold = settings["dedup_threshold"]
+    selected: Dict[str, Set[int]] = {}
+    kept_words: List[Set[str]] = []
+    seen: Set[str] = set()
+    remaining = budget
+    for i in ranking:
+        note_id, ord, content = candidates[i]
+        words = set(tokenize(content))
+        if content in seen or any(_jaccard(words, kept) >= threshold for kept in kept_words):
+            report.duplicates += 1
+            continue
+        # Each selected snippet costs its text and its "[ord] " prefix
+        tokens = estimate_tokens(f"[{ord}] {content}\n\n")
+        if tokens > remaining:
+            continue
+        seen.add(content)
+        kept_words.append(words)
+        selected.setdefault(note_id, set()).add(ord)
+        remaining -= tokens
+        report.selected += 1
+    report.tokens = budget - remaining
+
+    return [note.snippets.dumps(selected[note.meta.id]) for note in notes if note.meta.id in selected]
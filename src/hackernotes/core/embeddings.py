@@ -0,0 +1,281 @@
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+from .workspace import Workspace
+from ..utils import write_atomic
+from ..utils.config import section_config
+from ..utils.llm import get_backend, llm_embed
+from ..utils.term import print_warn
+
+EMBEDDINGS_DEFAULTS = {
+    "model": None, # the embedding model of the workspace backend by default
+    "batch_size": 32,
+    "compact_ratio": 0.25,
+}
+
+def embeddings_config() -> dict:
+    """Returns the `embeddings` config merged with the defaults."""
+    return section_config("embeddings", EMBEDDINGS_DEFAULTS)
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalizes the rows, so that dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` highest scores, best first (partial sort)."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+class SnippetHit(BaseModel):
+    """A snippet matching a semantic query."""
+    note_id: str
+    ord: int
+    score: float
+
+class EmbeddingIndex:
+    """
+    Snippet embeddings of a workspace: a contiguous float32 matrix (memory-mapped, L2-normalized rows) and
+    an ID map giving the note, snippet ord and content hash of each row.
+    Changed snippets are appended and their old rows tombstoned (empty note id); the matrix is compacted
+    once the dead rows exceed `compact_ratio`.
+    """
+    MATRIX_FN = "__embeddings__.f32"
+    IDS_FN = "__embeddings__.tsv"
+    META_FN = "__embeddings__.json"
+    _lock = threading.Lock()
+
+    def __init__(self, ws: Workspace = None, settings: dict = None):
+        ws = ws or Workspace.get()
+        self.settings = settings or embeddings_config()
+        self.matrix_path = os.path.join(ws.base_dir, self.MATRIX_FN)
+        self.ids_path = os.path.join(ws.base_dir, self.IDS_FN)
+        self.meta_path = os.path.join(ws.base_dir, self.META_FN)
+        self.__reload__()
+
+    # --- Storage ---
+
+    def exists(self) -> bool:
+        """Whether the workspace has an embedding index."""
+        return os.path.exists(self.meta_path)
+
+    @classmethod
+    def exists_in(cls, ws: Workspace = None) -> bool:
+        """Whether the workspace has an embedding index, checked without loading it (nor the model backend)."""
+        ws = ws or Workspace.get()
+        return os.path.exists(os.path.join(ws.base_dir, cls.META_FN))
+
+    def __read_meta__(self) -> dict:
+        if not os.path.exists(self.meta_path):
+            return {"model": self.settings["model"] or get_backend().embed_model, "dim": 0}
+        with open(self.meta_path, "r") as f:
+            return json.load(f)
+
+    def __read_ids__(self) -> pd.DataFrame:
+        if not os.path.exists(self.ids_path):
+            return pd.DataFrame({"NOTE_ID": pd.Series(dtype=str), "ORD": pd.Series(dtype=int), "HASH": pd.Series(dtype=str)})
+        return pd.read_csv(self.ids_path, sep="\t", dtype={"NOTE_ID": str, "ORD": int, "HASH": str}, keep_default_na=False)
+
+    def __reload__(self):
+        """Re-reads the index, as another instance may have changed it."""
+        self.meta = self.__read_meta__()
+        self.ids = self.__read_ids__()
+
+    def __write__(self):
+        write_atomic(self.ids_path, lambda f: self.ids.to_csv(f, sep="\t", index=False))
+        write_atomic(self.meta_path, lambda f: json.dump(self.meta, f))
+
+    @property
+    def dim(self) -> int:
+        return self.meta["dim"]
+
+    @property
+    def live(self) -> np.ndarray:
+        """Mask of the rows that are not tombstoned."""
+        return (self.ids["NOTE_ID"] != "").to_numpy()
+
+    def matrix(self) -> np.ndarray:
+        """The embeddings matrix, memory-mapped read-only."""
+        if not len(self.ids):
+            return np.empty((0, self.dim), dtype=np.float32)
+        return np.memmap(self.matrix_path, dtype=np.float32, mode="r", shape=(len(self.ids), self.dim))
+
+    def __append__(self, vectors: np.ndarray):
+        """Appends rows to the matrix file (past the rows of the ID map, in case of a previous partial write)."""
+        mode = "r+b" if os.path.exists(self.matrix_path) else "wb"
+        with open(self.matrix_path, mode) as f:
+            f.seek(len(self.ids) * self.dim * 4)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            f.truncate()
+
+    def compact(self):
+        """Rewrites the matrix and the ID map without the tombstoned rows."""
+        live = self.live
+        vectors = np.array(self.matrix()[live])
+        with open(self.matrix_path + ".tmp", "wb") as f:
+            f.write(vectors.tobytes())
+        os.replace(self.matrix_path + ".tmp", self.matrix_path)
+        self.ids = self.ids[live].reset_index(drop=True)
+        self.__write__()
+
+    # --- Embedding ---
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embeds the texts in batches of `batch_size`, returns the normalized vectors."""
+        batch_size = self.settings["batch_size"]
+        vectors = []
+        for i in range(0, len(texts), batch_size):
+            vectors.extend(llm_embed(texts[i:i + batch_size], model=self.meta["model"]))
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        if self.dim and vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"The embedding model returned {vectors.shape[1]} dimensions instead of {self.dim}, "
+                "rebuild the index with `hn search --reindex`."
+            )
+        return vectors
+
+    def update(self, notes: Iterable["Note"]) -> int:
+        """
+        Brings the embeddings of the notes up to date. Only snippets with a new content hash are embedded
+        (vectors of already known contents are reused). Returns the number of embedded snippets.
+        """
+        notes = list(notes)
+        with self._lock:
+            self.__reload__()
+            ids = self.ids
+            live = self.live
+            note_ids = {note.meta.id for note in notes}
+            current: Dict[Tuple[str, int], Tuple[int, str]] = {
+                (row.NOTE_ID, row.ORD): (i, row.HASH)
+                for i, row in ids[live & ids["NOTE_ID"].isin(note_ids).to_numpy()].iterrows()
+            }
+            wanted = {
+                (note.meta.id, ord): snippet
+                for note in notes
+                for ord, snippet in enumerate(note.snippets)
+                if snippet.content.strip()
+            }
+            changed = {key: snippet for key, snippet in wanted.items() if current.get(key, (None, None))[1] != snippet.content_hash}
+            stale = [i for key, (i, _) in current.items() if key not in wanted or key in changed]
+            if not changed and not stale:
+                return 0
+
+            # Vectors of known contents are reused, the others are embedded
+            hashes = {snippet.content_hash for snippet in changed.values()}
+            known = {ids.at[i, "HASH"]: i for i in ids.index[live & ids["HASH"].isin(hashes).to_numpy()]}
+            to_embed = {}
+            for snippet in changed.values():
+                if snippet.content_hash not in known:
+                    to_embed.setdefault(snippet.content_hash, snippet.content.strip())
+            embedded = dict(zip(to_embed, self.embed(list(to_embed.values())))) if to_embed else {}
+            if embedded and not self.dim:
+                self.meta["dim"] = len(next(iter(embedded.values())))
+
+            matrix = self.matrix()
+            rows = [
+                embedded[snippet.content_hash] if snippet.content_hash in embedded else matrix[known[snippet.content_hash]]
+                for snippet in changed.values()
+            ]
+            ids.loc[stale, "NOTE_ID"] = ""
+
+            if rows:
+                self.__append__(np.vstack(rows))
+                new_ids = pd.DataFrame(
+                    [(note_id, ord, snippet.content_hash) for (note_id, ord), snippet in changed.items()],
+                    columns=["NOTE_ID", "ORD", "HASH"],
+                )
+                self.ids = pd.concat([ids, new_ids], ignore_index=True)
+            self.__write__()
+
+            if len(self.ids) and (~self.live).mean() > self.settings["compact_ratio"]:
+                self.compact()
+            return len(to_embed)
+
+    def remove(self, note_id: str):
+        """Tombstones the snippets of a note."""
+        with self._lock:
+            self.__reload__()
+            self.ids.loc[self.ids["NOTE_ID"] == note_id, "NOTE_ID"] = ""
+            self.__write__()
+
+    def rebuild(self, notes: Iterable["Note"]) -> int:
+        """Drops the index and embeds every snippet of the notes again."""
+        for path in (self.matrix_path, self.ids_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return self.update(notes)
+
+    def note_vectors(self, note_ids: Iterable[str] = None) -> Tuple[List[str], np.ndarray]:
+        """Note vectors (normalized mean of their snippet vectors), of all notes or only of `note_ids`."""
+        rows = self.ids[self.live]
+        if note_ids is not None:
+            rows = rows[rows["NOTE_ID"].isin(set(note_ids))]
+        rows = rows.sort_values("NOTE_ID", kind="stable")
+        if not len(rows):
+            return [], np.empty((0, self.dim), dtype=np.float32)
+        notes, starts = np.unique(rows["NOTE_ID"].to_numpy(dtype=str), return_index=True)
+        sums = np.add.reduceat(self.matrix()[rows.index.to_numpy()], starts, axis=0)
+        return notes.tolist(), normalize(sums)
+
+    # --- Querying ---
+
+    def search(self, query: str, k: int = 10) -> List[SnippetHit]:
+        """Returns the `k` snippets closest to the query (cosine similarity)."""
+        if not len(self.ids):
+            return []
+        scores = self.matrix() @ self.embed([query])[0]
+        scores[~self.live] = -np.inf
+        top = top_k(scores, min(k, int(self.live.sum())))
+        return [
+            SnippetHit(note_id=self.ids.at[i, "NOTE_ID"], ord=int(self.ids.at[i, "ORD"]), score=float(scores[i]))
+            for i in top
+        ]
+
+    def snippet_scores(self, query: str, note_ids: Iterable[str]) -> Dict[Tuple[str, int], float]:
+        """Cosine similarity of the query to every embedded snippet of the notes, by (note id, ord)."""
+        rows = self.ids[self.live & self.ids["NOTE_ID"].isin(set(note_ids)).to_numpy()]
+        if not len(rows):
+            return {}
+        scores = self.matrix()[rows.index.to_numpy()] @ self.embed([query])[0]
+        return {(note_id, int(ord)): float(score) for note_id, ord, score in zip(rows["NOTE_ID"], rows["ORD"], scores)}
+
+def update_embeddings(notes: Iterable["Note"], strict: bool = False) -> int:
+    """
+    Updates the semantic index of the workspace for the notes, and the related notes index, if there are.
+    Failures only warn, unless `strict`.
+    """
+    from .ann import IVFIndex
+    if not EmbeddingIndex.exists_in():
+        return 0
+    notes = list(notes)
+    try:
+        index = EmbeddingIndex()
+        embedded = index.update(notes)
+        ann = IVFIndex()
+        if ann.exists():
+            note_ids = [note.meta.id for note in notes]
+            ann.update(note_ids, *index.note_vectors(note_ids))
+        return embedded
+    except Exception as e:
+        if strict:
+            raise
+        print_warn(f"Embeddings not updated: {e}")
+        return 0
+
+def remove_embeddings(note_id: str):
+    """Removes a note from the semantic and related notes indexes, if there are."""
+    from .ann import IVFIndex
+    if EmbeddingIndex.exists_in():
+        EmbeddingIndex().remove(note_id)
+    ann = IVFIndex()
+    if ann.exists():
+        ann.remove(note_id)
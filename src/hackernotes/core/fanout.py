@@ -0,0 +1,134 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+from .note import Note
+from ..utils.config import section_config
+from ..utils.llm import llm_agenerate, priority, prompt_context, queued, warm_up
+
+FANOUT_DEFAULTS = {
+    "concurrency": 4,
+}
+
+FANOUT_SYS_PROMPT = """
+    You will be given a note written by the user. Apply the following instruction to the note and
+    respond with the result only, without any introduction or comment.
+    Instruction: {prompt}
+    """
+
+def fanout_config() -> dict:
+    """Returns the `fanout` config merged with the defaults."""
+    return section_config("fanout", FANOUT_DEFAULTS)
+
+class PromptResult(BaseModel):
+    """The response of the model for one note (or the error that prevented it)."""
+    note_id: str
+    title: str = ""
+    response: Optional[str] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+class FanOutReport(BaseModel):
+    """Summary of a prompt applied to many notes."""
+    total: int = 0
+    done: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Processed notes per second."""
+        return self.done / self.elapsed if self.elapsed else 0.0
+
+    def progress(self) -> str:
+        return f"[{self.done}/{self.total}] {self.throughput:.2f} notes/s, {self.failed} failed"
+
+async def _fan_out(
+    prompt: str,
+    note_ids: List[str],
+    concurrency: int,
+    use_cache: bool,
+    ordered: bool,
+    on_result: Callable[[PromptResult], None],
+    report: FanOutReport,
+):
+    """
+    A pool of `concurrency` workers takes the notes from a queue (so the in-flight notes are bounded, whatever
+    their number); the results are emitted as they complete, or in the order of the notes with `ordered`.
+    """
+    sys_prompt = FANOUT_SYS_PROMPT.format(prompt=prompt.strip())
+    started = time.perf_counter()
+    todo: asyncio.Queue = asyncio.Queue()
+    for i, note_id in enumerate(note_ids):
+        todo.put_nowait((i, note_id))
+    pending: Dict[int, PromptResult] = {}
+    next_out = 0
+
+    def emit(i: int, result: PromptResult):
+        nonlocal next_out
+        report.done += 1
+        report.failed += result.error is not None
+        report.elapsed = time.perf_counter() - started
+        if not ordered:
+            on_result(result)
+            return
+        # Reorder buffer: held until all the previous notes are out
+        pending[i] = result
+        while next_out in pending:
+            on_result(pending.pop(next_out))
+            next_out += 1
+
+    async def worker():
+        while not todo.empty():
+            i, note_id = todo.get_nowait()
+            result = PromptResult(note_id=note_id)
+            note_started = time.perf_counter()
+            try:
+                note = Note.read(note_id)
+                if not note:
+                    raise ValueError("note not found")
+                result.title = note.meta.title
+                # The wait in the queue is charged to the note's call in the metrics
+                with queued(note_started - started):
+                    result.response = await llm_agenerate(sys_prompt, note.snippets.dumps(), use_cache=use_cache)
+            except Exception as e:
+                result.error = str(e) or type(e).__name__
+            result.elapsed = time.perf_counter() - note_started
+            emit(i, result)
+
+    with prompt_context("prompt"):
+        await asyncio.gather(*(worker() for _ in range(min(concurrency, len(note_ids)))))
+
+def prompt_notes(
+    prompt: str,
+    note_ids: List[str],
+    on_result: Callable[[PromptResult], None],
+    concurrency: int = None,
+    use_cache: bool = True,
+    ordered: bool = False,
+    report: FanOutReport = None,
+) -> FanOutReport:
+    """
+    Applies the prompt to each note as an independent model call, at most `concurrency` in flight. Responses are
+    cached by the note content, so a re-run only calls the model for the notes that changed. The calls run in
+    the bulk priority class (see `utils.llm.scheduler`).
+    `on_result` is called with each result as soon as it is available (see `ordered`).
+    """
+    report = report if report is not None else FanOutReport()
+    report.total = len(note_ids)
+    if not note_ids:
+        return report
+    warm_up()
+    with priority("bulk"):
+        asyncio.run(_fan_out(
+            prompt,
+            note_ids,
+            concurrency=max(1, concurrency or fanout_config()["concurrency"]),
+            use_cache=use_cache,
+            ordered=ordered,
+            on_result=on_result,
+            report=report,
+        ))
+    return report
@@ -0,0 +1,266 @@
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from .annotations.entity import ENTITY_PATTERN, Entity
+from .incremental import IncrementalModel
+from .note import Note
+from .types import EntityType
+from .workspace import Workspace
+from ..utils import write_atomic
+from ..utils.config import config, section_config
+
+GAZETTEER_DEFAULTS = {
+    "enabled": True,
+    "min_agreement": 0.75, # share of its typed occurrences the majority type of an entity must have to be learnt
+}
+
+def gazetteer_config() -> dict:
+    """Returns the `gazetteer` config merged with the defaults."""
+    return section_config("gazetteer", GAZETTEER_DEFAULTS)
+
+# Runs of capitalized words, candidate entities when not written as @mentions (or tags)
+NAME_PATTERN = r"(?<![@#\w])[A-Z]\w*(?:[ \t]+[A-Z]\w*)*"
+# Characters after which a capitalized word starts a sentence (or a snippet, see `Snippets.dumps`)
+SENTENCE_END = ".!?:;]\n"
+
+class Gazetteer(IncrementalModel):
+    """
+    Map of the known entities of the workspace to their type, learnt from the entities already typed in the
+    notes (their majority type, when enough of the occurrences agree), under the user entries of the
+    `__gazetteer__.tsv` file: `<entity>\t<TYPE>` lines, UNKNOWN to leave an entity to the model.
+    Typing is a dictionary lookup, so known entities are typed as they are written and only the new ones
+    are sent to the model. It is learnt incrementally (see `IncrementalModel`).
+    """
+    MODEL_FN = "__gazetteer__.json"
+    USER_FN = "__gazetteer__.tsv"
+    SIGNATURE_COLUMN = "Entities"
+
+    def __init__(self, settings: dict = None):
+        super().__init__(settings or gazetteer_config())
+        self.learnt: Dict[str, str] = {}
+        self.counts: Dict[str, Dict[str, int]] = {} # entity -> type -> typed occurrences
+        self.user: Dict[str, str] = {}
+        self.user_mtime = 0.0
+
+    # --- Learning ---
+
+    def features(self, note: Note) -> dict:
+        return {"entities": sorted([entity.content, entity.type.value] for entity in note.annotations.entities if entity.type != EntityType.UNKNOWN)}
+
+    def _count(self, features: dict, n: int):
+        """Adds or removes typed occurrences, and updates the learnt types of their entities."""
+        changed = set()
+        for content, type_ in features["entities"]:
+            if type_ == EntityType.UNKNOWN.value:
+                continue
+            types = self.counts.setdefault(content, {})
+            types[type_] = types.get(type_, 0) + n
+            if types[type_] <= 0:
+                del types[type_]
+            changed.add(content)
+        for content in changed:
+            types = self.counts.get(content)
+            self.learnt.pop(content, None)
+            if not types:
+                self.counts.pop(content, None)
+                continue
+            type_, n = Counter(types).most_common(1)[0]
+            if n / sum(types.values()) >= self.settings["min_agreement"]:
+                self.learnt[content] = type_
+
+    def fit(self, entities: Iterable[Entity]) -> "Gazetteer":
+        """Learns the types of the typed entities (one per occurrence in a note)."""
+        self.learnt, self.counts, self.learnt_notes = {}, {}, {}
+        self._count({"entities": [(entity.content, entity.type.value) for entity in entities]}, 1)
+        return self
+
+    # --- Typing ---
+
+    def type_of(self, content: str) -> EntityType:
+        """The known type of an entity, UNKNOWN if there is none."""
+        return EntityType(self.user.get(content) or self.learnt.get(content) or EntityType.UNKNOWN.value)
+
+    def type_entities(self, entities: Set[Entity]) -> Set[Entity]:
+        """The entities, the untyped ones typed when known."""
+        return {
+            Entity(content=e.content, type=self.type_of(e.content)) if e.type == EntityType.UNKNOWN else e
+            for e in entities
+        }
+
+    def find(self, text: str, ignore: Set[str] = None) -> Tuple[Set[Entity], Set[str]]:
+        """
+        The known entities of the text, written as @mentions or not, and the candidates left for the model: the
+        unknown @mentions and user UNKNOWN entries, and the unknown names (runs of capitalized words, without the
+        one starting a sentence) of several words or written more than once. A capitalized word written once is
+        most often not an entity (a product, an acronym, a word after a colon), it is not worth a model call.
+        """
+        ignore = ignore or set()
+        known, unknown = set(), set()
+        mentions = {mention[1:] for mention in re.findall(ENTITY_PATTERN, text)}
+        names = Counter()
+        for match in re.finditer(NAME_PATTERN, text):
+            words = match.group().split()
+            before = text[:match.start()].rstrip(" \t")
+            if not before or before[-1] in SENTENCE_END:
+                words = words[1:]
+            if words:
+                names[" ".join(words)] += 1
+
+        def lookup(content: str) -> bool:
+            """Sorts out a content, returns whether it is known (or left to the model by the user)."""
+            type_ = self.type_of(content)
+            if type_ != EntityType.UNKNOWN:
+                known.add(Entity(content=content, type=type_))
+            elif content in self.user:
+                unknown.add(content)
+            else:
+                return False
+            return True
+
+        for content in mentions - ignore:
+            if not lookup(content):
+                unknown.add(content)
+        for name, n in names.items():
+            if name in ignore or name in mentions:
+                continue
+            words = name.split()
+            # Every word of a name is looked up too, e.g. a known first name
+            contents = [name] + (words if len(words) > 1 else [])
+            if any([lookup(content) for content in contents if content not in ignore and content not in mentions]):
+                continue
+            if (len(words) > 1 or n > 1) and not name.isupper():
+                unknown.add(name)
+        return known, unknown
+
+    # --- User Entries ---
+
+    def load_user(self, ws: Workspace = None):
+        """(Re)loads the user entries if their file changed."""
+        ws = ws or Workspace.get()
+        path = os.path.join(ws.base_dir, self.USER_FN)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else 0.0
+        if mtime == self.user_mtime:
+            return
+        self.user, self.user_mtime = {}, mtime
+        if not mtime:
+            return
+        with open(path) as f:
+            for line in f:
+                content, _, type_ = line.strip().partition("\t")
+                type_ = type_.strip().upper()
+                if content and not content.startswith("#") and type_ in EntityType.to_list():
+                    self.user[content.lstrip("@")] = type_
+
+    def set_user(self, content: str, type_: Optional[EntityType], ws: Workspace = None):
+        """Sets the type of an entity in the user entries (removes it with None)."""
+        ws = ws or Workspace.get()
+        self.load_user(ws)
+        content = content.lstrip("@")
+        if type_ is None:
+            self.user.pop(content, None)
+        else:
+            self.user[content] = type_.value
+        path = os.path.join(ws.base_dir, self.USER_FN)
+        write_atomic(path, lambda f: f.write("".join(f"{content}\t{type_}\n" for content, type_ in sorted(self.user.items()))))
+        self.user_mtime = os.path.getmtime(path)
+
+    # --- Storage ---
+
+    def dump(self) -> dict:
+        return {"learnt": self.learnt, "counts": self.counts}
+
+_gazetteers: Dict[str, Gazetteer] = {}
+
+def get_gazetteer(rebuild: bool = False, refresh: bool = True) -> Gazetteer:
+    """
+    The gazetteer of the active workspace. When the workspace index changed since it was saved, it learns the
+    changed notes only (see `Gazetteer.update`), unless not `refresh`: then the last learnt one is used as is,
+    and if there is none, an empty one (only the user entries) that learns nothing.
+    """
+    ws = Workspace.get()
+    gazetteer = None if rebuild else _gazetteers.get(ws.name) or Gazetteer.load(ws)
+    if gazetteer is None and not refresh:
+        gazetteer = Gazetteer()
+        gazetteer.load_user(ws)
+        return gazetteer
+    gazetteer = gazetteer or Gazetteer()
+    if refresh:
+        gazetteer.refresh(ws)
+    gazetteer.load_user(ws)
+    _gazetteers[ws.name] = gazetteer
+    return gazetteer
+
+def type_entities(entities: Set[Entity]) -> Set[Entity]:
+    """
+    The entities typed by the gazetteer of the active workspace when known (as learnt so far: this is called
+    on every snippet written, it never learns, and leaves them untyped if nothing was learnt yet), or as they
+    are if it is disabled or there is no workspace.
+    """
+    workspace = config.get("active_workspace")
+    if not entities or not workspace or not Workspace.exists(workspace) or not gazetteer_config()["enabled"]:
+        return entities
+    return get_gazetteer(refresh=False).type_entities(entities)
+
+def local_entities(text: str, ignore_entities: Set[Entity] = None) -> Tuple[Set[Entity], bool]:
+    """
+    The entities of the text known to the gazetteer, and whether the model still has to be asked: only when
+    there are unknown candidates (see `Gazetteer.find`).
+    """
+    if not gazetteer_config()["enabled"]:
+        return set(), True
+    known, unknown = get_gazetteer().find(text, {e.content for e in ignore_entities or ()})
+    return known, bool(unknown)
+
+# --- Evaluation ---
+
+class GazetteerReport(BaseModel):
+    """Cross-validated evaluation of the gazetteer against the typed entities of the workspace."""
+    notes: int = 0
+    local: int = 0 # notes with no entity candidate left for the model
+    correct: int = 0 # entities typed locally with the type the note has
+    typed: int = 0
+    expected: int = 0 # typed entities of the notes
+    find_us: float = 0.0
+
+    @property
+    def call_reduction(self) -> float:
+        """Share of the entity extraction model calls avoided."""
+        return self.local / self.notes if self.notes else 0.0
+
+    @property
+    def precision(self) -> float:
+        return self.correct / self.typed if self.typed else 0.0
+
+    @property
+    def recall(self) -> float:
+        return self.correct / self.expected if self.expected else 0.0
+
+def evaluate(notes: List[Tuple[str, Set[Entity]]], folds: int = 5, settings: dict = None, user: Dict[str, str] = None) -> GazetteerReport:
+    """
+    K-fold evaluation: the entities of every note are found by a gazetteer learnt on the other folds (and the
+    `user` entries), and compared to its typed entities. The @ markers are stripped from the text of a note,
+    they may have been added by the model: the call reduction is the one on notes as written before annotation.
+    """
+    settings = settings or gazetteer_config()
+    report = GazetteerReport()
+    elapsed = 0.0
+    for fold in range(folds):
+        gazetteer = Gazetteer(settings).fit(entity for i, (_, entities) in enumerate(notes) if i % folds != fold for entity in entities)
+        gazetteer.user = user or {}
+        for text, entities in notes[fold::folds]:
+            report.notes += 1
+            started = time.perf_counter()
+            known, unknown = gazetteer.find(text.replace("@", ""))
+            elapsed += time.perf_counter() - started
+            report.local += not unknown
+            typed = {(e.content, e.type) for e in entities if e.type != EntityType.UNKNOWN}
+            report.typed += len(known)
+            report.correct += len({(e.content, e.type) for e in known} & typed)
+            report.expected += len(typed)
+    report.find_us = elapsed / report.notes * 1e6 if report.notes else 0.0
+    return report
@@ -0,0 +1,123 @@
+import json
+import os
+from typing import Dict, Iterable, Optional
+
+from .note import Note
+from .workspace import Workspace
+from ..utils import write_atomic
+
+def index_mtime(ws: Workspace) -> float:
+    """Modification time of the workspace index (rewritten whenever notes or their annotations change), 0 if none."""
+    path = os.path.join(ws.base_dir, "__index__.tsv")
+    return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+class IncrementalModel:
+    """
+    Base of the local models learnt from the notes of a workspace (see `tagger` and `gazetteer`). The features
+    learnt from every note are kept with the model's counts, under the note's index signature (its update date
+    and the `SIGNATURE_COLUMN` of the index), so a changed note is unlearnt and learnt again without going
+    through the others. Subclasses extract the features of a note and add or remove their counts.
+    """
+    MODEL_FN: str
+    SIGNATURE_COLUMN: str
+
+    def __init__(self, settings: dict = None):
+        self.settings = settings
+        self.learnt_notes: Dict[str, dict] = {} # note id -> its features and index signature
+        self.index_mtime = 0.0
+
+    # --- Model specific ---
+
+    def features(self, note: Note) -> dict:
+        """The features the model learns from a note (JSON-serializable)."""
+        raise NotImplementedError
+
+    def _count(self, features: dict, n: int):
+        """Adds (n = 1) or removes (n = -1) the counts of a note's features."""
+        raise NotImplementedError
+
+    def fit(self, samples: Iterable) -> "IncrementalModel":
+        """Learns the model from scratch (and forgets the learnt notes)."""
+        raise NotImplementedError
+
+    def dump(self) -> dict:
+        """The learnt statistics, saved with the learnt notes."""
+        raise NotImplementedError
+
+    # --- Learning ---
+
+    def learn(self, note: Note, signature: str = None):
+        """Learns a note, in place of its previous version if it was learnt already."""
+        self.forget(note.meta.id)
+        features = self.features(note)
+        self._count(features, 1)
+        self.learnt_notes[note.meta.id] = {**features, "signature": signature}
+
+    def forget(self, note_id: str):
+        """Unlearns a note (e.g. deleted)."""
+        learnt = self.learnt_notes.pop(note_id, None)
+        if learnt:
+            self._count(learnt, -1)
+
+    def fit_notes(self, notes: Iterable[Note]) -> "IncrementalModel":
+        self.fit(())
+        for note in notes:
+            self.learn(note)
+        return self
+
+    def update(self, ws: Workspace) -> int:
+        """
+        Learns the notes of the workspace whose index entry changed since they were learnt, and unlearns the ones
+        removed from the index. Returns the number of changed notes.
+        """
+        index = ws.get_index()
+        signatures = {
+            note_id: f"{updated_at}|{value}"
+            for note_id, updated_at, value in zip(index.index, index["Updated At"].astype(str), index[self.SIGNATURE_COLUMN])
+        }
+        changed = [note_id for note_id in self.learnt_notes if note_id not in signatures]
+        for note_id in changed:
+            self.forget(note_id)
+        for note_id, signature in signatures.items():
+            if self.learnt_notes.get(note_id, {}).get("signature") == signature:
+                continue
+            changed.append(note_id)
+            note = Note.read(note_id)
+            if note:
+                self.learn(note, signature)
+            else:
+                self.forget(note_id)
+        return len(changed)
+
+    def refresh(self, ws: Workspace):
+        """Updates the model if the workspace index changed since the last update, and saves it if a note changed."""
+        mtime = index_mtime(ws)
+        if self.index_mtime == mtime:
+            return
+        changed = self.update(ws) if mtime else 0
+        self.index_mtime = mtime
+        if changed:
+            self.save(ws)
+
+    # --- Storage ---
+
+    def save(self, ws: Workspace = None):
+        ws = ws or Workspace.get()
+        data = {**self.dump(), "index_mtime": self.index_mtime, "learnt_notes": self.learnt_notes}
+        write_atomic(os.path.join(ws.base_dir, self.MODEL_FN), lambda f: json.dump(data, f, separators=(",", ":")))
+
+    @classmethod
+    def load(cls, ws: Workspace = None, settings: dict = None) -> Optional["IncrementalModel"]:
+        """The saved model of the workspace, None if there is none or it was saved without its learnt notes."""
+        ws = ws or Workspace.get()
+        path = os.path.join(ws.base_dir, cls.MODEL_FN)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        if "learnt_notes" not in data:
+            return None
+        model = cls(settings)
+        for key, value in data.items():
+            setattr(model, key, value)
+        return model
@@ -17,9 +17,11 @@ def interactive_create(note: Note):
     def handle_exit(sig, frame):
         clear_terminal_line()
         note.persist()
-        # note.to_queue() # TODO
-        print_sys(fsys("[+] Note ")+note.meta.title+fsys(" saved and added to the queue."))
         note.index(note.meta.id)
+        if note.to_queue():
+            print_sys(fsys("[+] Note ")+note.meta.title+fsys(" saved and added to the queue."))
+        else:
+            print_sys(fsys("[+] Note ")+note.meta.title+fsys(" saved."))
         sys.exit(0)
 
     signal.signal(signal.SIGQUIT, handle_exit)
@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import time
+from typing import Iterator, List
+
+import click
+from pydantic import BaseModel
+
+from .ai import get_predefined_prompt
+from ..utils.config import section_config
+from ..utils.llm import CHARS_PER_TOKEN, GenerationStats, estimate_tokens, generate_stream, llm_agenerate, prompt_context, queued, warm_up
+from ..utils.term import clear_terminal_line, fsys
+
+MAPREDUCE_DEFAULTS = {
+    "chunk_tokens": 3000,
+    "concurrency": 4,
+}
+
+CHUNK_SEPARATOR = "\n\n---\n\n"
+
+REDUCE_SYS_PROMPT = """
+You will be given several partial results of the same task, separated by `---`.
+Each one was produced from a different part of the user's notes. The task was:
+{task}
+Combine the partial results into a single result of the task, as if it was produced from all the notes at once.
+Do not mention the partial results nor the separators.
+"""
+
+def mapreduce_config() -> dict:
+    """Returns the `mapreduce` config merged with the defaults."""
+    return section_config("mapreduce", MAPREDUCE_DEFAULTS)
+
+# --- Chunking ---
+
+def _split_text(text: str, budget: int) -> List[str]:
+    """Splits a text exceeding the token budget at line boundaries (anywhere if a single line is too long)."""
+    pieces, current = [], ""
+    for line in text.splitlines(keepends=True):
+        while estimate_tokens(line) > budget:
+            if current:
+                pieces.append(current)
+                current = ""
+            cut = budget * CHARS_PER_TOKEN
+            pieces.append(line[:cut])
+            line = line[cut:]
+        if current and estimate_tokens(current + line) > budget:
+            pieces.append(current)
+            current = ""
+        current += line
+    if current:
+        pieces.append(current)
+    return pieces
+
+def _is_boundary(text: str, tokens: int, budget: int) -> bool:
+    """
+    Content-defined chunk boundary: a chunk ends after a text depending only on the text itself (about every
+    half budget), so adding or editing a note only changes its own chunk and the cached map results of the
+    others stay valid.
+    """
+    digest = int(hashlib.sha256(text.encode()).hexdigest()[:8], 16)
+    return digest / 0xFFFFFFFF < tokens / (budget / 2)
+
+def chunk_texts(texts: List[str], budget: int, stable: bool = True) -> List[str]:
+    """
+    Packs the texts (in order) into chunks of at most `budget` tokens; longer texts are split.
+    With `stable`, chunks also end at content-defined boundaries, otherwise they are packed as full as possible.
+    """
+    separator_tokens = estimate_tokens(CHUNK_SEPARATOR)
+    chunks, current, current_tokens = [], [], 0
+    for text in texts:
+        pieces = _split_text(text, budget) if estimate_tokens(text) > budget else [text]
+        for piece in pieces:
+            tokens = estimate_tokens(piece)
+            if current and current_tokens + separator_tokens + tokens > budget:
+                chunks.append(CHUNK_SEPARATOR.join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens + (separator_tokens if len(current) > 1 else 0)
+            if stable and _is_boundary(piece, tokens, budget):
+                chunks.append(CHUNK_SEPARATOR.join(current))
+                current, current_tokens = [], 0
+    if current:
+        chunks.append(CHUNK_SEPARATOR.join(current))
+    return chunks
+
+# --- Map-Reduce ---
+
+class MapReduceReport(BaseModel):
+    """Summary of a map-reduce run."""
+    chunks: int = 0
+    levels: int = 0
+    calls: int = 0
+    done: int = 0
+    elapsed: float = 0.0
+
+    def progress(self) -> str:
+        return f"[{self.done}/{self.calls}] map-reduce level {self.levels}, {self.elapsed:.1f}s"
+
+    def summary(self) -> str:
+        return f"{self.chunks} chunks, {self.calls} calls over {self.levels} levels in {self.elapsed:.2f}s"
+
+async def _map_reduce(prompt_name: str, sys_prompt: str, chunks: List[str], budget: int, concurrency: int, use_cache: bool, report: MapReduceReport) -> str:
+    """
+    Maps the prompt over the chunks, then reduces the partial results level by level until they fit in
+    a single chunk, which is returned for the final (streamed) reduce step.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+    reduce_prompt = REDUCE_SYS_PROMPT.format(task=sys_prompt.strip())
+
+    async def call(system: str, text: str) -> str:
+        waiting = time.perf_counter()
+        async with semaphore:
+            with queued(time.perf_counter() - waiting):
+                response = await llm_agenerate(sys_prompt=system, user_prompt=text, use_cache=use_cache)
+        report.done += 1
+        report.elapsed = time.perf_counter() - started
+        clear_terminal_line()
+        click.echo(fsys(report.progress()), nl=False)
+        return response
+
+    async def level(system: str, texts: List[str]) -> List[str]:
+        report.levels += 1
+        report.calls += len(texts)
+        with prompt_context(f"{prompt_name}:{'map' if system is sys_prompt else 'reduce'}"):
+            return await asyncio.gather(*(call(system, text) for text in texts))
+
+    partials = await level(sys_prompt, chunks)
+    groups = chunk_texts(partials, budget, stable=False)
+    while len(groups) > 1:
+        if len(groups) >= len(partials):
+            # Partial results too long to be packed together, reduce them pairwise anyway
+            groups = [CHUNK_SEPARATOR.join(partials[i:i + 2]) for i in range(0, len(partials), 2)]
+            if len(groups) == 1:
+                break
+        partials = await level(reduce_prompt, groups)
+        groups = chunk_texts(partials, budget, stable=False)
+
+    clear_terminal_line()
+    return groups[0]
+
+def map_reduce_stream(
+    prompt_name: str,
+    texts: List[str],
+    chunk_tokens: int = None,
+    concurrency: int = None,
+    use_cache: bool = True,
+    stats: GenerationStats = None,
+    report: MapReduceReport = None,
+    stream: bool = True,
+) -> Iterator[str]:
+    """
+    Generates the predefined prompt over many notes: texts fitting in one chunk go in a single call, otherwise
+    the prompt is mapped concurrently over the chunks and the partial results are reduced hierarchically.
+    Map and reduce results are cached by their input, so unchanged chunks are not sent again.
+    The final step is streamed.
+    """
+    settings = mapreduce_config()
+    budget = chunk_tokens or settings["chunk_tokens"]
+    report = report if report is not None else MapReduceReport()
+    sys_prompt = get_predefined_prompt(prompt_name)
+
+    joined = CHUNK_SEPARATOR.join(texts)
+    chunks = [joined] if estimate_tokens(joined) <= budget else chunk_texts(texts, budget)
+    report.chunks = len(chunks)
+    if len(chunks) <= 1:
+        final_prompt, final_text = sys_prompt, "".join(chunks)
+    else:
+        final_prompt = REDUCE_SYS_PROMPT.format(task=sys_prompt.strip())
+        warm_up()
+        final_text = asyncio.run(_map_reduce(
+            prompt_name.upper(),
+            sys_prompt,
+            chunks,
+            budget=budget,
+            concurrency=max(1, concurrency or settings["concurrency"]),
+            use_cache=use_cache,
+            report=report,
+        ))
+        report.levels += 1
+        report.calls += 1
+
+    yield from generate_stream(
+        final_prompt,
+        final_text,
+        use_cache=use_cache,
+        stats=stats,
+        stream=stream,
+        prompt=prompt_name.upper() if len(chunks) <= 1 else f"{prompt_name.upper()}:reduce",
+    )
@@ -1,22 +1,31 @@
 from datetime import datetime
+from typing import List
 import pandas as pd
 from pydantic import BaseModel
 import os
+import threading
 
+from hackernotes.utils import write_atomic
 from hackernotes.utils.datetime import dt_dumps
 from hackernotes.utils.parsers import tags2line
 from hackernotes.utils.term import fsys, print_err, print_sys, print_warn
 
+from .annotation_log import AnnotationLog
 from .meta import NoteMeta
 from ..workspace import Workspace
 from ..snippets import Snippets
 from ..annotations import Annotations
+from ..types import TaskType
+
+# Serializes the read-modify-write of the index file (the automation workers index notes concurrently)
+_index_lock = threading.Lock()
 
 class Note(BaseModel):
     """Note model."""
     meta: NoteMeta = NoteMeta()
     snippets: Snippets = Snippets()
     annotations: Annotations = Annotations()
+    annotation_log: AnnotationLog = AnnotationLog()
 
     @staticmethod
     def __get_path__(id: str) -> str:
@@ -43,9 +52,57 @@ class Note(BaseModel):
         self.annotations = Annotations(
             tags=self.snippets.tags,
             entities=self.snippets.entities,
-            # TODO entities=self.snippets.entities, etc
+            times=self.snippets.times,
         )
 
+    def apply_annotations(self, annotations: Annotations) -> Annotations:
+        """
+        Applies new (e.g. AI-extracted) annotations to the snippets they occur in.
+        The ones that fit nowhere are added as a new snippet. Returns those remaining annotations.
+        """
+        remaining = Annotations()
+        for tag in annotations.tags:
+            for snippet in self.snippets:
+                if tag.content in snippet.content and not snippet.annotations.has_tag(tag):
+                    snippet.add_tag(tag)
+                    break
+            else:
+                remaining.tags.add(tag)
+        for entity in annotations.entities:
+            for snippet in self.snippets:
+                if entity.content in snippet.content:
+                    snippet.add_entity(entity)
+                    break
+            else:
+                remaining.entities.add(entity)
+        for time in annotations.times:
+            for snippet in self.snippets:
+                if time.occurs(snippet.content):
+                    snippet.add_time(time)
+                    break
+            else:
+                remaining.times.add(time)
+
+        if remaining.tags or remaining.entities or remaining.times:
+            content = ' '.join(
+                [tags2line(remaining.tags)]
+                + [e.dumps(content_only=True) for e in remaining.entities]
+                + [t.content for t in remaining.times]
+            ).strip()
+            snippet = self.snippets.add(content)
+            for entity in remaining.entities:
+                snippet.add_entity(entity)
+            for time in remaining.times:
+                snippet.add_time(time)
+        self.meta.touch()
+        self.update_annotations()
+        return remaining
+
+    def to_queue(self, task_type: TaskType = TaskType.ANNOTATE) -> bool:
+        """Queues the note for a background task, AI annotation by default (see `hn ai worker`)."""
+        from ..automation import enqueue
+        return enqueue(task_type, note_id=self.meta.id)
+
     def remove(self, confirm: bool = True, from_index: bool = True):
         """Removes the note from the workspace."""
         if confirm:
@@ -65,6 +122,9 @@ class Note(BaseModel):
         if from_index:
             self.remove_from_index(self.meta.id)
 
+        from ..embeddings import remove_embeddings
+        remove_embeddings(self.meta.id)
+
     # --- Serialization Methods ---
 
     def __get_filler__(self, title: str) -> str:
@@ -88,6 +148,10 @@ class Note(BaseModel):
         # Dump annotations
         data += self.__get_filler__("ANNOTATIONS")
         data += self.annotations.dumps()
+        # Dump the log of the AI-annotated snippets, if any
+        if self.annotation_log.entries:
+            data += self.__get_filler__("AI ANNOTATION LOG")
+            data += self.annotation_log.dumps()
         # Dump closing line
         data += self.__get_filler__("END OF HACKERNOTE")
         return data
@@ -118,16 +182,31 @@ class Note(BaseModel):
         meta = NoteMeta.loads(sections["HACKERNOTE METADATA"])
         annotations = Annotations.loads(sections["ANNOTATIONS"])
         snippets = Snippets.loads(sections["SNIPPETS"], ext_annotations=annotations)
+        annotation_log = AnnotationLog.loads(sections.get("AI ANNOTATION LOG", ""))
         # Create the note object
-        note = Note(meta=meta, snippets=snippets, annotations=annotations)
+        note = Note(meta=meta, snippets=snippets, annotations=annotations, annotation_log=annotation_log)
         return note
     
     # --- File Operations ---
 
-    def persist(self):
-        """Persists the note to a file."""
-        with open(self.file_path, "w") as f:
-            f.write(self.dumps())
+    def persist(self, embed: bool = False, queue: bool = True):
+        """
+        Persists the note to a file. The file is replaced atomically, so a crash never leaves a truncated note.
+        If the workspace has a semantic index, the embeddings of the changed snippets are updated now with
+        `embed` (a model call), otherwise with `queue` their update is queued for the automation workers.
+        """
+        write_atomic(self.file_path, lambda f: f.write(self.dumps()))
+        if embed:
+            self.update_embeddings()
+        elif queue:
+            from ..embeddings import EmbeddingIndex
+            if EmbeddingIndex.exists_in():
+                self.to_queue(TaskType.EMBED)
+
+    def update_embeddings(self):
+        """Re-embeds the snippets whose content changed, if the workspace has a semantic index."""
+        from ..embeddings import update_embeddings
+        update_embeddings([self])
 
     @classmethod
     def read(cls, id: str) -> "Note":
@@ -145,40 +224,29 @@ class Note(BaseModel):
     @classmethod
     def remove_from_index(cls, note_id: str, index_fn: str = "__index__.tsv", ws: Workspace = None):
         """
-        Remove note from the index
+        Remove note from the index (nothing to do if the note is not indexed)
         """
         if not ws:
             ws = Workspace.get()
         index_full_path = os.path.join(ws.base_dir, index_fn)
-                
-        df = pd.read_csv(index_full_path, sep="\t")
-        df.set_index("ID", inplace=True)
-        # delete the note from the index
-        df.drop(note_id, inplace=True)
-
-        # Save the index file
-        df.to_csv(index_full_path, sep="\t", index=True)
-        print_sys(f"[+] Removed note '{note_id}' from index in workspace '{ws.name}'")
+        with _index_lock:
+            if not os.path.exists(index_full_path):
+                return
 
-    @classmethod
-    def index(cls, note_id: str, index_fn: str = "__index__.tsv", ws: Workspace = None):
-        """
-        Indexes a note by ID. If no ID is provided, index all notes in the workspace.
-        """
-        if not ws:
-            ws = Workspace.get()
-        index_full_path = os.path.join(ws.base_dir, index_fn)
+            df = pd.read_csv(index_full_path, sep="\t")
+            df.set_index("ID", inplace=True)
+            if note_id not in df.index:
+                return
+            # delete the note from the index
+            df.drop(note_id, inplace=True)
 
-        # Check if the note exists
-        try:
-            note = Note.read(note_id)
-            if not note:
-                raise ValueError("Null note...")
-        except Exception as e:
-            print_warn(f"Cannot index note with ID {note_id}... ({e})")
-            return 
+            # Save the index file
+            cls.__write_index__(df, index_full_path)
+        print_sys(f"[+] Removed note '{note_id}' from index in workspace '{ws.name}'")
 
-        # Open or create the index file
+    @staticmethod
+    def __read_index__(index_full_path: str) -> pd.DataFrame:
+        """Opens the index file or creates an empty index."""
         try:
             df = pd.read_csv(index_full_path, sep="\t")
             df.set_index("ID", inplace=True)
@@ -194,23 +262,69 @@ class Note(BaseModel):
             ])
             # make ID the index
             df.set_index("ID", inplace=True)
+        return df
 
-        # print(df)
+    @staticmethod
+    def __write_index__(df: pd.DataFrame, index_full_path: str):
+        """Replaces the index file atomically, so a reader never sees it half-written."""
+        write_atomic(index_full_path, lambda f: df.to_csv(f, sep="\t", index=True))
 
-        # Create or update the note entry
-        df.loc[note.meta.id] = [
-            dt_dumps(note.meta.created_at),
-            dt_dumps(note.meta.updated_at),
-            note.meta.title,
-            note.annotations.tags_serialized or "--",
-            note.annotations.entities_serialized or "--",
+    def __index_entry__(self) -> list:
+        """Returns the index row of the note."""
+        return [
+            dt_dumps(self.meta.created_at),
+            dt_dumps(self.meta.updated_at),
+            self.meta.title,
+            self.annotations.tags_serialized or "--",
+            self.annotations.entities_serialized or "--",
             # "TODO", # note.annotations.times
         ]
 
-        # Save the index file
-        df.to_csv(index_full_path, sep="\t", index=True)
+    @classmethod
+    def index(cls, note_id: str, index_fn: str = "__index__.tsv", ws: Workspace = None):
+        """
+        Indexes a note by ID. If no ID is provided, index all notes in the workspace.
+        """
+        if not ws:
+            ws = Workspace.get()
+        index_full_path = os.path.join(ws.base_dir, index_fn)
+
+        # Check if the note exists
+        try:
+            note = Note.read(note_id)
+            if not note:
+                raise ValueError("Null note...")
+        except Exception as e:
+            print_warn(f"Cannot index note with ID {note_id}... ({e})")
+            return 
+
+        with _index_lock:
+            # Open or create the index file
+            df = cls.__read_index__(index_full_path)
+
+            # Create or update the note entry
+            df.loc[note.meta.id] = note.__index_entry__()
+
+            # Save the index file
+            cls.__write_index__(df, index_full_path)
         print_sys(f"[+] Indexed note '{note.meta.title}' with ID '{note.meta.id}' in workspace '{ws.name}'")
 
+    @classmethod
+    def index_many(cls, notes: List["Note"], index_fn: str = "__index__.tsv", ws: Workspace = None):
+        """
+        Indexes many (already loaded) notes at once: the index file is read and written only once.
+        """
+        if not ws:
+            ws = Workspace.get()
+        index_full_path = os.path.join(ws.base_dir, index_fn)
+
+        with _index_lock:
+            df = cls.__read_index__(index_full_path)
+            for note in notes:
+                df.loc[note.meta.id] = note.__index_entry__()
+            cls.__write_index__(df, index_full_path)
+        print_sys(f"[+] Indexed {len(notes)} notes in workspace '{ws.name}'")
+
     @classmethod
     def index_all(cls, index_fn: str = "__index__.tsv"):
         """
@@ -229,9 +343,9 @@ class Note(BaseModel):
             cls.index(note_id)
 
     @classmethod
-    def concat_notes(cls, **kwargs) -> str:
+    def notes_texts(cls, **kwargs) -> List[str]:
         """
-        Concatenates all notes in the workspace into a single string.
+        Returns the snippets text of every note in the workspace matching the filters.
         """
 
         # Get ids from index
@@ -239,13 +353,19 @@ class Note(BaseModel):
         index_df = ws.list_notes(**kwargs)
         note_ids = index_df.index.tolist()
 
-        # Concatenate notes
-        output = ""
+        texts = []
         for note_id in note_ids:
             note = Note.read(note_id)
             if note:
-                output += note.snippets.dumps() + "\n\n"
+                texts.append(note.snippets.dumps())
             else:
                 print_warn(f"Note '{note_id}' not found.")
 
-        return output
\ No newline at end of file
+        return texts
+
+    @classmethod
+    def concat_notes(cls, **kwargs) -> str:
+        """
+        Concatenates all notes in the workspace into a single string.
+        """
+        return "".join(text + "\n\n" for text in cls.notes_texts(**kwargs))
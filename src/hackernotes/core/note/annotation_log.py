@@ -0,0 +1,70 @@
+import re
+from typing import Dict, Iterable, Set
+
+from pydantic import BaseModel
+
+from ..snippets import Snippets
+
+HASH_LENGTH = 16
+
+class AnnotationLogEntry(BaseModel):
+    """Snippets annotated for one annotation kind, by a model with a version of the prompt."""
+    model: str
+    prompt_version: str
+    hashes: Set[str] = set()
+
+class AnnotationLog(BaseModel):
+    """
+    Per note record of the snippets already annotated by the model, by content hash: for each annotation kind
+    (tags, entities, times), the model and prompt version used and the hashes of the snippets it has seen.
+    A re-run only sends the snippets that are new or changed since, or all of them if the model or the prompt changed.
+    """
+    entries: Dict[str, AnnotationLogEntry] = {}
+
+    @staticmethod
+    def snippet_hash(snippet) -> str:
+        return snippet.content_hash[:HASH_LENGTH]
+
+    def pending(self, snippets: Snippets, kind: str, model: str, prompt_version: str) -> Set[int]:
+        """The ords of the (non-empty) snippets not annotated yet for the kind with this model and prompt version."""
+        entry = self.entries.get(kind)
+        known = entry.hashes if entry and (entry.model, entry.prompt_version) == (model, prompt_version) else set()
+        return {
+            ord for ord, snippet in enumerate(snippets)
+            if snippet.content.strip() and self.snippet_hash(snippet) not in known
+        }
+
+    def record(self, snippets: Snippets, kinds: Iterable[str], model: str, prompt_versions: Dict[str, str]) -> bool:
+        """
+        Logs the current snippets as annotated for the kinds (hashes of removed snippets are forgotten).
+        Returns whether the log changed.
+        """
+        hashes = {self.snippet_hash(snippet) for snippet in snippets if snippet.content.strip()}
+        changed = False
+        for kind in kinds:
+            entry = AnnotationLogEntry(model=model, prompt_version=prompt_versions[kind], hashes=hashes)
+            if self.entries.get(kind) != entry:
+                self.entries[kind] = entry
+                changed = True
+        return changed
+
+    # --- Serialization Methods ---
+
+    def dumps(self) -> str:
+        """Serialize the log to a string: one `[kind model prompt_version] hash hash...` line per kind."""
+        return "".join(
+            f"[{kind} {entry.model} {entry.prompt_version}] {' '.join(sorted(entry.hashes))}\n"
+            for kind, entry in sorted(self.entries.items())
+        )
+
+    @classmethod
+    def loads(cls, content: str) -> "AnnotationLog":
+        """Deserialize the log from a string."""
+        entries = {}
+        for line in content.strip().split("\n"):
+            match = re.match(r"\[(\S+) (\S+) (\S+)\]\s*(.*)", line.strip())
+            if not match:
+                continue
+            kind, model, prompt_version, hashes = match.groups()
+            entries[kind] = AnnotationLogEntry(model=model, prompt_version=prompt_version, hashes=set(hashes.split()))
+        return cls(entries=entries)
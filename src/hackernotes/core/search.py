@@ -0,0 +1,45 @@
+from typing import List, Tuple
+
+from .ann import IVFIndex
+from .embeddings import EmbeddingIndex, SnippetHit
+from .note import Note
+from .workspace import Workspace
+
+def keyword_search(query: str, limit: int = 10) -> List[SnippetHit]:
+    """Snippets containing every word of the query (case insensitive), scored by the number of occurrences."""
+    words = query.lower().split()
+    hits = []
+    for note_id in Workspace.get().get_index().index:
+        note = Note.read(note_id)
+        if not note:
+            continue
+        for ord, snippet in enumerate(note.snippets):
+            content = snippet.content.lower()
+            if words and all(word in content for word in words):
+                hits.append(SnippetHit(note_id=note_id, ord=ord, score=sum(content.count(word) for word in words)))
+    hits.sort(key=lambda hit: hit.score, reverse=True)
+    return hits[:limit]
+
+def semantic_search(query: str, limit: int = 10) -> List[SnippetHit]:
+    """Snippets closest in meaning to the query, from the workspace embeddings."""
+    return EmbeddingIndex().search(query, k=limit)
+
+def build_semantic_index() -> int:
+    """(Re)builds the embeddings of every note in the workspace. Returns the number of embedded snippets."""
+    notes = [Note.read(note_id) for note_id in Workspace.get().get_index().index]
+    return EmbeddingIndex().rebuild(note for note in notes if note)
+
+def build_related_index() -> int:
+    """(Re)builds the related notes index from the note vectors (embedding the workspace first if needed)."""
+    index = EmbeddingIndex()
+    if not index.exists():
+        build_semantic_index()
+        index = EmbeddingIndex()
+    note_ids, vectors = index.note_vectors()
+    if note_ids:
+        IVFIndex().build(note_ids, vectors)
+    return len(note_ids)
+
+def related_notes(note_id: str, limit: int = 10, nprobe: int = None, exact: bool = False) -> List[Tuple[str, float]]:
+    """Notes most similar to the given one, with their cosine similarity."""
+    return IVFIndex().related(note_id, k=limit, nprobe=nprobe, exact=exact)
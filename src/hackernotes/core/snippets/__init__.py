@@ -4,6 +4,7 @@ from pydantic import BaseModel
 from hackernotes.core.annotations import Annotations
 from hackernotes.core.annotations.entity import Entity
 from hackernotes.core.annotations.tag import Tag
+from hackernotes.core.annotations.time import Time
 
 from .snippet import Snippet
 
@@ -13,6 +14,11 @@ class Snippets(BaseModel):
     """
     __snippets__: dict[int, Snippet] = {}
 
+    def __init__(self, **data):
+        super().__init__(**data)
+        # NOTE: a fresh dict per instance, otherwise all the notes loaded in one process share their snippets
+        self.__snippets__ = {}
+
     # --- Properties ---
 
     @property
@@ -35,6 +41,14 @@ class Snippets(BaseModel):
         for snippet in self.__snippets__.values():
             entities.update(snippet.annotations.entities)
         return entities
+
+    @property
+    def times(self) -> Set[Time]:
+        """Returns the times of the snippets."""
+        times = set()
+        for snippet in self.__snippets__.values():
+            times.update(snippet.annotations.times)
+        return times
     
     @property
     def last_snippet(self) -> Snippet:
@@ -103,10 +117,11 @@ class Snippets(BaseModel):
 
     # --- Serialization Methods ---
 
-    def dumps(self) -> str:
-        """Serializes the snippets to a string."""
+    def dumps(self, ords: Set[int] = None) -> str:
+        """Serializes the snippets (or only the ones with the given ords) to a string."""
         return "\n\n".join(
             f"[{ord}] {snippet.dumps()}" for ord, snippet in self.__snippets__.items()
+            if ords is None or ord in ords
         )+"\n\n"
     
     @classmethod
@@ -1,6 +1,10 @@
+import hashlib
+
 from pydantic import BaseModel
 
+from hackernotes.core.annotations.entity import Entity
 from hackernotes.core.annotations.tag import Tag
+from hackernotes.core.annotations.time import Time
 
 from ..annotations import Annotations
 import re
@@ -9,6 +13,11 @@ class Snippet(BaseModel):
     content: str
     annotations: Annotations = Annotations()
 
+    @property
+    def content_hash(self) -> str:
+        """Hash of the snippet content, used to detect changed snippets."""
+        return hashlib.sha256(self.content.strip().encode()).hexdigest()
+
     # --- Annotations Methods ---
     def prefix_tag(self, tag_value: str) -> None:
         """ Adds # to each occurrence of the tag in the snippet content. The tag value should not contain #. """
@@ -23,6 +32,25 @@ class Snippet(BaseModel):
         self.prefix_tag(tag.content)
         self.annotations.add_tag(tag.content)
 
+    def prefix_entity(self, entity_value: str) -> None:
+        """ Adds @ to each occurrence of the entity in the snippet content. The entity value should not contain @. """
+        pattern = r'(?<!@)\b' + re.escape(entity_value) + r'\b'
+        self.content = re.sub(pattern, f"@{entity_value}", self.content)
+
+    def add_entity(self, entity: Entity) -> None:
+        """ Adds an entity to the snippet, replacing the same entity of another (e.g. unknown) type. """
+        if entity.content.startswith("@"):
+            entity.content = entity.content[1:]
+
+        self.prefix_entity(entity.content)
+        self.annotations.entities = {e for e in self.annotations.entities if e.content != entity.content}
+        self.annotations.add_entity(entity)
+
+    def add_time(self, time: Time) -> None:
+        """ Adds a (resolved) time to the snippet, replacing the same literal. """
+        self.annotations.times = {t for t in self.annotations.times if t.content != time.content}
+        self.annotations.add_time(time)
+
     # --- Serialization Methods ---
     def dumps(self) -> str:
         """Serialize the snippet to a string."""
@@ -37,5 +65,5 @@ class Snippet(BaseModel):
             # Filter the annotations to only include those that are in the snippet
             annotations.tags = {tag for tag in ext_annotations.tags if tag.occurs(content)}
             annotations.entities = {entity for entity in ext_annotations.entities if entity.occurs(content)}
-            # TODO etc.
+            annotations.times = {time for time in ext_annotations.times if time.occurs(content)}
         return Snippet(content=content.strip(), annotations=annotations)
\ No newline at end of file
@@ -0,0 +1,250 @@
+import math
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from .annotations.tag import Tag
+from .incremental import IncrementalModel, index_mtime
+from .note import Note
+from .workspace import Workspace
+from ..utils.config import section_config
+
+TAGGER_DEFAULTS = {
+    "enabled": True,
+    "threshold": 0.6, # confidence under which the model is asked
+    "min_support": 2, # notes a tag (or a word) must appear in to be learnt
+    "max_tags": 5,
+}
+
+def tagger_config() -> dict:
+    """Returns the `tagger` config merged with the defaults."""
+    return section_config("tagger", TAGGER_DEFAULTS)
+
+TOKEN_PATTERN = r"[a-z][a-z0-9_-]{2,}"
+
+STOPWORDS = frozenset("""
+    about above after again against all also and any are because been before being below between both but can cannot
+    could did does doing down during each few for from further had has have having her here hers herself him himself his
+    how into its itself just more most myself nor not now off once only other ought our ours ourselves out over own same
+    she should some such than that the their theirs them themselves then there these they this those through too under
+    until very was were what when where which while who whom why will with would you your yours yourself yourselves
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words of a text, annotation markers stripped and stopwords dropped."""
+    return [token for token in re.findall(TOKEN_PATTERN, text.lower().replace("#", " ").replace("@", " ")) if token not in STOPWORDS]
+
+class TagProposal(BaseModel):
+    """A tag proposed by the local tagger, with its confidence in [0, 1]."""
+    tag: str
+    confidence: float
+
+class LocalTagger(IncrementalModel):
+    """
+    Statistical tagger learnt from the tags already in the workspace. A word of a note is evidence for the tags
+    it co-occurs with, P(tag | word), weighted by its TF-IDF in the note; tags already on the note are evidence
+    for the tags they co-occur with. The evidence is combined as a noisy-OR into a confidence per known tag.
+    Proposing is a few dictionary lookups per word, so it runs before (and often instead of) a model call.
+    It is learnt incrementally (see `IncrementalModel`); the words and tags under `min_support` are skipped
+    when proposing.
+    """
+    MODEL_FN = "__tagger__.json"
+    SIGNATURE_COLUMN = "Tags"
+
+    def __init__(self, settings: dict = None):
+        super().__init__(settings or tagger_config())
+        self.notes = 0
+        self.word_notes: Dict[str, int] = {}
+        self.tag_notes: Dict[str, int] = {}
+        self.word_tags: Dict[str, Dict[str, int]] = {}
+        self.tag_tags: Dict[str, Dict[str, int]] = {}
+
+    # --- Learning ---
+
+    def features(self, note: Note) -> dict:
+        return {"words": sorted(set(tokenize(note.snippets.dumps()))), "tags": sorted(tag.content for tag in note.annotations.tags)}
+
+    def _count(self, features: dict, n: int):
+        words, tags = set(features["words"]), set(features["tags"])
+        def add(counts: Dict[str, int], key: str):
+            counts[key] = counts.get(key, 0) + n
+            if counts[key] <= 0:
+                del counts[key]
+        def add_pair(counts: Dict[str, Dict[str, int]], key: str, other: str):
+            add(counts.setdefault(key, {}), other)
+            if not counts[key]:
+                del counts[key]
+
+        self.notes += n
+        for word in words:
+            add(self.word_notes, word)
+        for tag in tags:
+            add(self.tag_notes, tag)
+            for word in words:
+                add_pair(self.word_tags, word, tag)
+            for other in tags:
+                if other != tag:
+                    add_pair(self.tag_tags, tag, other)
+
+    def fit(self, notes: Iterable[Tuple[str, Set[str]]]) -> "LocalTagger":
+        """Learns the statistics from (text, tags) pairs."""
+        self.__init__(self.settings)
+        for text, tags in notes:
+            self._count({"words": tokenize(text), "tags": tags}, 1)
+        return self
+
+    @property
+    def vocabulary(self) -> Tuple[int, int]:
+        """Number of words and tags with enough support to be used."""
+        return sum(1 for word in self.word_notes if self._known_word(word)), sum(1 for tag in self.tag_notes if self._known_tag(tag))
+
+    def _known_word(self, word: str) -> bool:
+        return self.word_notes.get(word, 0) >= self.settings["min_support"] and word in self.word_tags
+
+    def _known_tag(self, tag: str) -> bool:
+        return self.tag_notes.get(tag, 0) >= self.settings["min_support"]
+
+    # --- Proposing ---
+
+    def idf(self, word: str) -> float:
+        return math.log((self.notes + 1) / (self.word_notes.get(word, 0) + 1)) + 1
+
+    def propose(self, text: str, existing_tags: Set[str] = None) -> List[TagProposal]:
+        """The known tags supported by the text (and the note's existing tags), by decreasing confidence."""
+        existing_tags = existing_tags or set()
+        counts = Counter(word for word in tokenize(text) if self._known_word(word))
+        if not counts and not existing_tags:
+            return []
+
+        weights = {word: n * self.idf(word) for word, n in counts.items()}
+        top_weight = max(weights.values(), default=1.0)
+        # Noisy-OR: log of the probability that no evidence supports the tag
+        none_log = defaultdict(float)
+        for word, weight in weights.items():
+            reliability = weight / top_weight
+            smoothing = self.word_notes[word] + 1
+            for tag, n in self.word_tags[word].items():
+                if self._known_tag(tag):
+                    none_log[tag] += math.log1p(-reliability * n / smoothing)
+        for tag in existing_tags:
+            if not self._known_tag(tag):
+                continue
+            smoothing = self.tag_notes[tag] + 1
+            for other, n in self.tag_tags.get(tag, {}).items():
+                if self._known_tag(other):
+                    none_log[other] += math.log1p(-n / smoothing)
+
+        proposals = [
+            TagProposal(tag=tag, confidence=1 - math.exp(log))
+            for tag, log in none_log.items() if tag not in existing_tags
+        ]
+        proposals.sort(key=lambda p: (-p.confidence, p.tag))
+        return proposals
+
+    def confident_tags(self, text: str, existing_tags: Set[str] = None) -> Optional[Set[Tag]]:
+        """
+        The proposed tags above the confidence threshold, or None if there are none and the model has to be asked.
+        """
+        threshold = self.settings["threshold"]
+        proposals = [p for p in self.propose(text, existing_tags) if p.confidence >= threshold]
+        if not proposals:
+            return None
+        return {Tag(content=p.tag) for p in proposals[:self.settings["max_tags"]]}
+
+    # --- Storage ---
+
+    def dump(self) -> dict:
+        return {
+            "notes": self.notes,
+            "word_notes": self.word_notes,
+            "tag_notes": self.tag_notes,
+            "word_tags": self.word_tags,
+            "tag_tags": self.tag_tags,
+        }
+
+_taggers: Dict[str, LocalTagger] = {}
+
+def get_tagger(rebuild: bool = False) -> LocalTagger:
+    """
+    The local tagger of the active workspace. When the workspace index changed since it was saved (the index
+    is rewritten whenever notes or their tags change), it learns the changed notes only (see `LocalTagger.update`).
+    """
+    ws = Workspace.get()
+    if not index_mtime(ws):
+        return LocalTagger()
+    tagger = None if rebuild else _taggers.get(ws.name) or LocalTagger.load(ws)
+    tagger = tagger or LocalTagger()
+    tagger.refresh(ws)
+    _taggers[ws.name] = tagger
+    return tagger
+
+def local_tags(text: str, existing_tags: Set[Tag] = None) -> Optional[Set[Tag]]:
+    """
+    The tags the local tagger is confident about for the text, or None if the model should be asked
+    (or the tagger is disabled).
+    """
+    if not tagger_config()["enabled"]:
+        return None
+    return get_tagger().confident_tags(text, {tag.content for tag in existing_tags or ()})
+
+# --- Evaluation ---
+
+class TaggerReport(BaseModel):
+    """Cross-validated evaluation of the local tagger against the tags of the workspace."""
+    notes: int = 0
+    local: int = 0 # notes tagged without the model
+    correct: int = 0 # locally proposed tags that the note has
+    proposed: int = 0
+    expected: int = 0 # tags of the locally tagged notes
+    propose_us: float = 0.0
+
+    @property
+    def call_reduction(self) -> float:
+        """Share of the tag extraction model calls avoided."""
+        return self.local / self.notes if self.notes else 0.0
+
+    @property
+    def precision(self) -> float:
+        return self.correct / self.proposed if self.proposed else 0.0
+
+    @property
+    def recall(self) -> float:
+        return self.correct / self.expected if self.expected else 0.0
+
+def without_tags(text: str, tags: Set[str]) -> str:
+    """The text without the words of the tags, written as #tags or not."""
+    if not tags:
+        return text
+    words = "|".join(re.escape(tag) for tag in sorted(tags, key=len, reverse=True))
+    return re.sub(rf"#?(?<![\w-])(?:{words})(?![\w-])", " ", text, flags=re.IGNORECASE)
+
+def evaluate(notes: List[Tuple[str, Set[str]]], folds: int = 5, settings: dict = None) -> TaggerReport:
+    """
+    K-fold evaluation: every tagged note is tagged by a tagger learnt on the other folds, and the proposals
+    are compared to its actual tags. The tags are inline, so the words of a note's tags are removed from its
+    text (as #tags or not): they may have been added with the tags, the tags must be found from the rest.
+    """
+    settings = settings or tagger_config()
+    report = TaggerReport()
+    elapsed = 0.0
+    for fold in range(folds):
+        tagger = LocalTagger(settings).fit(note for i, note in enumerate(notes) if i % folds != fold)
+        for text, tags in notes[fold::folds]:
+            if not tags:
+                continue
+            report.notes += 1
+            started = time.perf_counter()
+            proposed = tagger.confident_tags(without_tags(text, tags))
+            elapsed += time.perf_counter() - started
+            if proposed is None:
+                continue
+            proposed = {tag.content for tag in proposed}
+            report.local += 1
+            report.proposed += len(proposed)
+            report.correct += len(proposed & tags)
+            report.expected += len(tags)
+    report.propose_us = elapsed / report.notes * 1e6 if report.notes else 0.0
+    return report
@@ -43,6 +43,10 @@ class TaskStatus(HackerEnum):
     SUCCESS = "SUCCESS"
     FAILED = "FAILED"
 
+class TaskType(HackerEnum):
+    ANNOTATE = "ANNOTATE"
+    EMBED = "EMBED"
+
 class EntityType(HackerEnum):
     UNKNOWN = "UNKNOWN"
     PERSON = "PERSON"
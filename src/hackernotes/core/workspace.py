@@ -224,6 +224,7 @@ class Workspace(BaseModel):
             created_before: datetime = None,
             updated_after: datetime = None,
             updated_before: datetime = None,
+            tags: List[str] = None,
         ) -> pd.DataFrame:
         """
         Lists all notes in the workspace.
@@ -241,4 +242,9 @@ class Workspace(BaseModel):
         if updated_before:
             index_df = index_df[index_df["Updated At"] < updated_before]
 
+        # Filter by tags (all of them must be present)
+        for tag in tags or []:
+            tag = tag.lstrip("#")
+            index_df = index_df[index_df["Tags"].str.split().apply(lambda ts: f"#{tag}" in ts)]
+
         return index_df
\ No newline at end of file
@@ -2,21 +2,99 @@
 import os
 
 import sqlite3
-from sqlalchemy import create_engine
+from typing import Dict, Tuple
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.pool import NullPool, QueuePool
 
 # from .schema import SCHEMA_SQL
 from .models import Base
+from .migrations import migrate
 from ..utils.config import config, update_config
 from ..utils.term import print_sys
 
 DB_PATH = config["db_path"]
 
-def get_engine(path: str = DB_PATH):
+# Engine profiles: connection pragmas and pool, overridable per profile under `db_profiles` in the config
+ENGINE_PROFILES = {
+    # CLI commands and the automation workers: concurrent readers and a writer, short transactions
+    "interactive": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16_000, # KiB
+        "mmap_size": 64 * 1024**2,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5_000, # ms
+        "pool": "queue",
+        "pool_size": 5,
+    },
+    # Large ingests: no fsync (a load interrupted by a power loss must be re-run), big page cache
+    "bulk": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -256_000,
+        "mmap_size": 256 * 1024**2,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30_000,
+        "pool": "queue",
+        "pool_size": 1,
+    },
+    # Read-only analytics: many concurrent readers over a memory-mapped database, writes refused
+    "analytics": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64_000,
+        "mmap_size": 1024**3,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5_000,
+        "query_only": "ON",
+        "pool": "queue",
+        "pool_size": 8,
+    },
+}
+PRAGMAS = ["busy_timeout", "journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "query_only"]
+
+def engine_profile(name: str = None) -> dict:
+    """Returns the settings of an engine profile (the configured `db_profile` by default) merged with the config."""
+    name = name or config.get("db_profile", "interactive")
+    if name not in ENGINE_PROFILES:
+        raise ValueError(f"Unknown database profile: {name} (available: {', '.join(ENGINE_PROFILES)})")
+    return {**ENGINE_PROFILES[name], **config.get("db_profiles", {}).get(name, {})}
+
+_engines: Dict[Tuple[str, str], Engine] = {}
+
+def get_engine(path: str = DB_PATH, profile: str = None) -> Engine:
     """
-    Create a SQLAlchemy engine for the database.
+    Create a SQLAlchemy engine for the database, tuned by an engine profile (see `ENGINE_PROFILES`):
+    the pragmas are set on every new connection. Engines are shared per path and profile.
     """
-    return create_engine(f"sqlite:///{path}", future=True)
+    profile = profile or config.get("db_profile", "interactive")
+    key = (os.path.expanduser(path), profile)
+    if key in _engines:
+        return _engines[key]
+
+    settings = engine_profile(profile)
+    if settings["pool"] == "null":
+        engine = create_engine(f"sqlite:///{path}", future=True, poolclass=NullPool)
+    else:
+        engine = create_engine(f"sqlite:///{path}", future=True, poolclass=QueuePool, pool_size=settings["pool_size"])
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        for pragma in PRAGMAS:
+            if settings.get(pragma) is not None:
+                cursor.execute(f"PRAGMA {pragma} = {settings[pragma]}")
+        cursor.close()
+
+    _engines[key] = engine
+    return engine
+
+def use_profile(profile: str, path: str = None):
+    """Binds the sessions (`SessionLocal`) to an engine of the profile, for the rest of the command."""
+    SessionLocal.configure(bind=get_engine(path=path or SessionLocal.kw["bind"].url.database, profile=profile))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
 
@@ -39,7 +117,7 @@ def init_db(db_path: str = DB_PATH, db_suffix: str = ".db"):
 
     # Initialize the database
     engine = get_engine(path=db_path)
-    Base.metadata.create_all(engine)
+    migrate(engine)
     print_sys(f"[+] Database initialized at {db_path}")
 
     # Update config
@@ -58,6 +136,10 @@ def delete_db():
     """Delete the database file."""
     if db_exists():
         os.remove(DB_PATH)
+        # WAL mode side files
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(DB_PATH + suffix):
+                os.remove(DB_PATH + suffix)
         print_sys(f"[+] Deleted database at {DB_PATH}")
     else:
         print_sys(f"[!] No database found at {DB_PATH}")
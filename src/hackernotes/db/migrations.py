@@ -0,0 +1,118 @@
+# hackernotes/db/migrations.py
+from sqlalchemy.engine import Connection, Engine
+
+from .models import Base
+from ..utils.term import print_sys
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str):
+    """Adds a column to an existing table, unless it is already there."""
+    columns = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+def _automation_queue_scheduling(conn: Connection):
+    """Automation queue: retries, per-workspace claims and status/scheduled_at lookups."""
+    _add_column(conn, "automation_queue", "workspace", "VARCHAR")
+    _add_column(conn, "automation_queue", "attempts", "INTEGER NOT NULL DEFAULT 0")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_automation_queue_status_scheduled_at "
+        "ON automation_queue (status, scheduled_at)"
+    )
+
+FTS_TRIGGERS = ("insert", "delete", "update")
+
+def _create_snippet_fts(conn: Connection):
+    """
+    FTS5 table over `snippet.content` keyed on the stable `snippet.id` (`snippet` has no INTEGER PRIMARY KEY,
+    its rowids may change on a VACUUM), kept in sync by triggers. `snippet_fts_rowid` maps the snippet ids to
+    the rowids of the index (an INTEGER PRIMARY KEY, kept by a VACUUM), so that a snippet is removed from the
+    index by its rowid rather than by a scan of the `id` column.
+    """
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS snippet_fts "
+        "USING fts5(id UNINDEXED, content, tokenize='unicode61 remove_diacritics 2')"
+    )
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS snippet_fts_rowid (fts_rowid INTEGER PRIMARY KEY, snippet_id VARCHAR NOT NULL UNIQUE)"
+    )
+    insert = (
+        "INSERT INTO snippet_fts_rowid (snippet_id) VALUES (new.id); "
+        "INSERT INTO snippet_fts (rowid, id, content) "
+        "SELECT fts_rowid, new.id, new.content FROM snippet_fts_rowid WHERE snippet_id = new.id; "
+    )
+    delete = (
+        "DELETE FROM snippet_fts WHERE rowid = (SELECT fts_rowid FROM snippet_fts_rowid WHERE snippet_id = old.id); "
+        "DELETE FROM snippet_fts_rowid WHERE snippet_id = old.id; "
+    )
+    conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS snippet_fts_insert AFTER INSERT ON snippet BEGIN {insert}END")
+    conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS snippet_fts_delete AFTER DELETE ON snippet BEGIN {delete}END")
+    conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS snippet_fts_update AFTER UPDATE OF id, content ON snippet BEGIN {delete}{insert}END")
+    rebuild_fts(conn)
+
+def _snippet_fts(conn: Connection):
+    """Snippet full-text index: FTS5 table over `snippet.content`, kept in sync by triggers, backfilled."""
+    _create_snippet_fts(conn)
+
+def rebuild_fts(conn: Connection):
+    """Re-indexes every snippet in the full-text index (e.g. after the snippets were changed with the triggers off)."""
+    conn.exec_driver_sql("DELETE FROM snippet_fts")
+    conn.exec_driver_sql("DELETE FROM snippet_fts_rowid")
+    conn.exec_driver_sql("INSERT INTO snippet_fts_rowid (snippet_id) SELECT id FROM snippet")
+    conn.exec_driver_sql(
+        "INSERT INTO snippet_fts (rowid, id, content) "
+        "SELECT r.fts_rowid, s.id, s.content FROM snippet s JOIN snippet_fts_rowid r ON r.snippet_id = s.id"
+    )
+
+def _note_listing_indexes(conn: Connection):
+    """Note listing: workspace/updated_at, snippet/note and reverse annotation lookups."""
+    for name, table, columns in (
+        ("ix_note_workspace_id_updated_at", "note", "workspace_id, updated_at, id"),
+        ("ix_note_updated_at", "note", "updated_at"),
+        ("ix_snippet_note_id", "snippet", "note_id, position"),
+        ("ix_snippet_tag_tag_name", "snippet_tag", "tag_name, snippet_id"),
+        ("ix_snippet_entity_entity_name", "snippet_entity", "entity_name, snippet_id"),
+        ("ix_snippet_time_expr_time_expr_id", "snippet_time_expr", "time_expr_id, snippet_id"),
+    ):
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    conn.exec_driver_sql("ANALYZE")
+
+def _snippet_fts_by_id(conn: Connection):
+    """Snippet full-text index keyed on `snippet.id`: replaces the index over the rowids of `snippet`."""
+    columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(snippet_fts)")}
+    if "id" in columns:
+        return
+    for trigger in FTS_TRIGGERS:
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS snippet_fts_{trigger}")
+    conn.exec_driver_sql("DROP TABLE IF EXISTS snippet_fts")
+    _create_snippet_fts(conn)
+
+# Ordered schema upgrades; the index+1 of the last applied one is kept in SQLite's `user_version`.
+# Each step must be idempotent, as tables created from the latest models already contain its changes.
+MIGRATIONS = [
+    _automation_queue_scheduling,
+    _snippet_fts,
+    _note_listing_indexes,
+    _snippet_fts_by_id,
+]
+
+def migrate(engine: Engine, verbose: bool = False) -> int:
+    """
+    Brings the database schema up to date: creates the missing tables and applies the pending migrations.
+    Returns the number of migrations applied.
+    """
+    Base.metadata.create_all(engine)
+    applied = 0
+    with engine.begin() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        for i, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            step(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {i}")
+            applied += 1
+            if verbose:
+                print_sys(f"[+] Applied migration {i}: {step.__doc__}")
+    return applied
+
+def schema_version(engine: Engine) -> int:
+    """Returns the current schema version of the database."""
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from sqlalchemy import (
-    Column, String, Text, Table, JSON, Boolean, DateTime, ForeignKey, Integer, CheckConstraint
+    Column, String, Text, Table, JSON, Boolean, DateTime, ForeignKey, Integer, CheckConstraint, Index
 )
 from sqlalchemy.orm import declarative_base, relationship, backref
 
@@ -33,19 +33,22 @@ Base = declarative_base()
 snippet_tag = Table(
     "snippet_tag", Base.metadata,
     Column("snippet_id", String, ForeignKey("snippet.id", ondelete="CASCADE"), primary_key=True), # TODO check if ondelete is correctly implemented
-    Column("tag_name", String, ForeignKey("tag.name"), primary_key=True)
+    Column("tag_name", String, ForeignKey("tag.name"), primary_key=True),
+    Index("ix_snippet_tag_tag_name", "tag_name", "snippet_id"),
 )
 
 snippet_entity = Table(
     "snippet_entity", Base.metadata,
     Column("snippet_id", String, ForeignKey("snippet.id", ondelete="CASCADE"), primary_key=True), # TODO check if ondelete is correctly implemented
-    Column("entity_name", String, ForeignKey("entity.name"), primary_key=True)
+    Column("entity_name", String, ForeignKey("entity.name"), primary_key=True),
+    Index("ix_snippet_entity_entity_name", "entity_name", "snippet_id"),
 )
 
 snippet_time_expr = Table(
     "snippet_time_expr", Base.metadata,
     Column("snippet_id", String, ForeignKey("snippet.id", ondelete="CASCADE"), primary_key=True),
-    Column("time_expr_id", String, ForeignKey("time_expr.id", ondelete="CASCADE"),  primary_key=True)
+    Column("time_expr_id", String, ForeignKey("time_expr.id", ondelete="CASCADE"),  primary_key=True),
+    Index("ix_snippet_time_expr_time_expr_id", "time_expr_id", "snippet_id"),
 )
 
 # Main tables
@@ -75,6 +78,10 @@ class Workspace(Base):
 
 class Note(Base):
     __tablename__ = "note"
+    __table_args__ = (
+        Index("ix_note_workspace_id_updated_at", "workspace_id", "updated_at", "id"),
+        Index("ix_note_updated_at", "updated_at"),
+    )
     id = Column(String, primary_key=True)
     workspace_id = Column(String, ForeignKey("workspace.id", ondelete="CASCADE"))
     title = Column(String, default="Untitled", nullable=False)
@@ -86,6 +93,9 @@ class Note(Base):
 
 class Snippet(Base):
     __tablename__ = "snippet"
+    __table_args__ = (
+        Index("ix_snippet_note_id", "note_id", "position"),
+    )
     id = Column(String, primary_key=True)
     note_id = Column(String, ForeignKey("note.id", ondelete="CASCADE"))
     content = Column(Text, nullable=False)
@@ -150,7 +160,11 @@ class Prompt(Base):
 
 class AutomationQueue(Base):
     __tablename__ = "automation_queue"
+    __table_args__ = (
+        Index("ix_automation_queue_status_scheduled_at", "status", "scheduled_at"),
+    )
     id = Column(Integer, primary_key=True)
+    workspace = Column(String)
     note_id = Column(String)
     snippet_id = Column(String)
     model_id = Column(String)
@@ -159,6 +173,7 @@ class AutomationQueue(Base):
         f"status IN ({TaskStatus.to_str()})"
     ), default=TaskStatus.PENDING.name)
     status_detail = Column(Text)
+    attempts = Column(Integer, default=0, nullable=False)
     scheduled_at = Column(DateTime)
     executed_at = Column(DateTime)
     result = Column(Text)
@@ -1,16 +1,22 @@
 # hackernotes/db/query.py
+import base64
+import json
+import re
 from datetime import datetime
 from uuid import uuid4
-from typing import Optional, List, Set
+from typing import Iterable, Iterator, Optional, List, Set, Tuple
 
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, aliased, selectinload
+from sqlalchemy import DateTime, delete, exists, func, insert, intersect, literal, literal_column, select, table, text, tuple_, update
+from sqlalchemy.engine import Row
 from tabulate import tabulate
 
-from hackernotes.core.types import TimeIntelligence, EntityIntelligence
+from hackernotes.core.annotations.entity import Entity as EntityAnnotation
+from hackernotes.core.types import TaskStatus, TimeIntelligence
 from hackernotes.utils.parsers import tags2line
 
-from .models import Entity, Note, Snippet, Tag, TimeExpr, User, Workspace
+from .models import AutomationQueue, Entity, Note, Snippet, Tag, TimeExpr, User, Workspace, snippet_entity, snippet_tag, snippet_time_expr
 from ..utils.config import config
 from ..utils.term import fwarn, print_sys, print_warn
 
@@ -134,6 +140,56 @@ class UserCRUD:
         session.commit()
         return user
     
+# Rows per `IN (...)` lookup, under SQLite's limit of bound parameters per statement
+IN_CHUNK_SIZE = 500
+
+def _existing(session: Session, column, values: Set[str]) -> Set[str]:
+    """The values already in the (primary key) column, looked up with one `IN` query per chunk."""
+    values = sorted(values)
+    existing = set()
+    for i in range(0, len(values), IN_CHUNK_SIZE):
+        existing.update(session.execute(select(column).where(column.in_(values[i:i + IN_CHUNK_SIZE]))).scalars())
+    return existing
+
+def fts_query(query: str) -> str:
+    """
+    The FTS5 MATCH expression of a free text query: its words as a phrase, the last one as a prefix
+    (so "deploy pyth" matches "deploy python", much like a substring of the content).
+    """
+    words = re.findall(r"\w+", query)
+    return '"' + " ".join(words) + '"*' if words else ""
+
+def _fts_match(query: str):
+    """The ids of the snippets matching the query in the full-text index (see `migrations._create_snippet_fts`)."""
+    return select(literal_column("id"))\
+        .select_from(table("snippet_fts"))\
+        .where(literal_column("snippet_fts").op("MATCH")(fts_query(query)))
+
+# Eager loading of a note: the snippets, then their annotations, by a query each (`SELECT ... IN`), instead
+# of joins multiplying the rows (snippets x tags x entities x times)
+NOTE_LOADING = (
+    selectinload(Note.snippets).selectinload(Snippet.tags),
+    selectinload(Note.snippets).selectinload(Snippet.entities),
+    selectinload(Note.snippets).selectinload(Snippet.time_exprs),
+)
+
+# Stable listing order (`updated_at` alone has ties), as the `ix_note_workspace_id_updated_at` index
+LISTING_ORDER = (Note.updated_at.desc(), Note.id.desc())
+# Columns of a note listing: no content, snippets or annotations
+LISTING_COLUMNS = (Note.id, Note.title, Note.archived, Note.created_at, Note.updated_at)
+
+def encode_cursor(updated_at: datetime, note_id: str) -> str:
+    """The opaque cursor of a position in a note listing (see `NoteCRUD.page`)."""
+    data = json.dumps([updated_at.isoformat(), note_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        updated_at, note_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(updated_at), str(note_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
 class NoteCRUD:
     @classmethod
     def create(
@@ -143,25 +199,65 @@ class NoteCRUD:
         title: Optional[str],
         snippets: List[dict],
     ) -> Note:
-        note = Note(
-            id=str(uuid4()),
-            workspace_id=workspace_id,
-            title=title,
-        )
-
-        session.add(note)
-        session.flush()  # get note.id before inserting snippets
+        note_id, = cls.bulk_create(session, workspace_id, [dict(title=title, snippets=snippets)])
+        return session.get(Note, note_id)
 
-        for i, snippet_kwargs in enumerate(snippets):
-            SnippetCRUD.create(
-                session,
-                note_id=note.id,
-                position=i,
-                **snippet_kwargs
-            )
-
-        session.commit()
-        return note
+    @classmethod
+    def bulk_create(cls, session: Session, workspace_id: str, notes: Iterable[dict]) -> List[str]:
+        """
+        Creates many notes in a single transaction. Each note is a dict with a `title` (and optionally an `id`)
+        and its `snippets`, given as the keyword arguments of `SnippetCRUD.create`. The tags and entities are
+        resolved with one `IN` query per kind and the missing ones inserted, then the notes, snippets and
+        association rows are inserted with executemany. Returns the ids of the notes, in order.
+        """
+        now = datetime.now()
+        note_rows, snippet_rows, time_rows = [], [], []
+        tag_links, entity_links, time_snippets = [], [], []
+        for note in notes:
+            note_id = note.get("id") or str(uuid4())
+            note_rows.append(dict(id=note_id, workspace_id=workspace_id, title=note.get("title") or "Untitled",
+                archived=False, created_at=now, updated_at=now))
+            for position, snippet in enumerate(note.get("snippets", [])):
+                if snippet.get("content") is None:
+                    raise ValueError("Snippet content must be provided.")
+                snippet_id = str(uuid4())
+                snippet_rows.append(dict(id=snippet_id, note_id=note_id, content=snippet["content"], position=position,
+                    annotations_only=snippet.get("annotations_only") or False, created_at=now, updated_at=now))
+                tag_links.extend(dict(snippet_id=snippet_id, tag_name=tag) for tag in snippet.get("tags") or ())
+                entity_links.extend(dict(snippet_id=snippet_id, entity_name=entity) for entity in snippet.get("entities") or ())
+                for time_kwargs in snippet.get("times") or ():
+                    time_rows.append({"value": None, "scope": None, **time_kwargs})
+                    time_snippets.append(snippet_id)
+
+        try:
+            # Tags and entities: only the missing ones are inserted (and a concurrent insert is not an error)
+            tags = {link["tag_name"] for link in tag_links}
+            missing_tags = tags - _existing(session, Tag.name, tags)
+            if missing_tags:
+                session.execute(sqlite_insert(Tag).on_conflict_do_nothing(), [dict(name=tag) for tag in sorted(missing_tags)])
+            entities = {link["entity_name"] for link in entity_links}
+            missing_entities = entities - _existing(session, Entity.name, entities)
+            if missing_entities:
+                session.execute(sqlite_insert(Entity).on_conflict_do_nothing(), [dict(name=entity, entity_type=None) for entity in sorted(missing_entities)])
+
+            if note_rows:
+                session.execute(insert(Note), note_rows)
+            if snippet_rows:
+                session.execute(insert(Snippet), snippet_rows)
+            if tag_links:
+                session.execute(insert(snippet_tag), tag_links)
+            if entity_links:
+                session.execute(insert(snippet_entity), entity_links)
+            if time_rows:
+                time_ids = session.execute(insert(TimeExpr).returning(TimeExpr.id, sort_by_parameter_order=True), time_rows).scalars().all()
+                session.execute(insert(snippet_time_expr), [
+                    dict(snippet_id=snippet_id, time_expr_id=time_id) for snippet_id, time_id in zip(time_snippets, time_ids)
+                ])
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        return [row["id"] for row in note_rows]
 
     @classmethod
     def get(cls, session: Session, note_id: str = None, title: str = None) -> Optional[Note]: #TODO add fetch security -- what about workspace id? not needed because user is quite specific!
@@ -171,12 +267,7 @@ class NoteCRUD:
 
         # Basic query
         stmt = select(Note)\
-            .options(
-                joinedload(Note.snippets),  # Eagerly load snippets
-                joinedload(Note.snippets, Snippet.tags),  # Eagerly load snippet tags
-                joinedload(Note.snippets, Snippet.entities),  # Eagerly load snippet entities
-                joinedload(Note.snippets, Snippet.time_exprs),  # Eagerly load snippet time expressions
-            )\
+            .options(*NOTE_LOADING)\
             .limit(1)
         
         if note_id is None and title is None:
@@ -192,53 +283,59 @@ class NoteCRUD:
         else:
             raise ValueError("Weird... this should not happen. Please check the code.")
 
-        return session.execute(stmt).unique().scalars().one_or_none()
+        return session.execute(stmt).scalars().one_or_none()
 
     @classmethod
-    def list_by_workspace(cls, session: Session, workspace_name: str = config["active_workspace"], **filters) -> List[Note]:
-        # Get workspace ID from name
-        workspace_id = WorkspaceCRUD.get(session, workspace_name=workspace_name).id
-        if not workspace_id:
+    def filter_note_ids(cls, tags: Iterable[str] = (), entities: Iterable[str] = (), content: Iterable[str] = ()):
+        """
+        The ids of the notes having every tag, every entity and every content term (each in any of their
+        snippets), as an INTERSECT of one indexed lookup per filter; None without filters.
+        """
+        selects = [
+            select(Snippet.note_id).join(snippet_tag, snippet_tag.c.snippet_id == Snippet.id).where(snippet_tag.c.tag_name == tag)
+            for tag in tags
+        ] + [
+            select(Snippet.note_id).join(snippet_entity, snippet_entity.c.snippet_id == Snippet.id).where(snippet_entity.c.entity_name == entity)
+            for entity in entities
+        ] + [
+            select(Snippet.note_id).where(Snippet.id.in_(_fts_match(c)))
+            for c in content if fts_query(c)
+        ]
+        if not selects:
+            return None
+        return selects[0] if len(selects) == 1 else intersect(*selects)
+
+    @classmethod
+    def filter_by_workspace(cls, session: Session, stmt, workspace_name: str, **filters):
+        """Restricts a statement over notes to those of a workspace matching the listing filters."""
+        ws = WorkspaceCRUD.get(session, workspace_name=workspace_name)
+        if not ws:
             raise ValueError(f"Workspace `{workspace_name}` not found.")
-        
-        print_sys(f"Listing notes for workspace: {workspace_name} ({workspace_id}) with filters {filters}")
+        stmt = stmt.where(Note.workspace_id == ws.id)
 
-        # Prepare the base query - eager join
-        stmt = select(Note)\
-            .where(Note.workspace_id == workspace_id)\
-            .options(
-                joinedload(Note.snippets),  # Eagerly load snippets
-                joinedload(Note.snippets, Snippet.tags),  # Eagerly load snippet tags
-                joinedload(Note.snippets, Snippet.entities),  # Eagerly load snippet entities
-                joinedload(Note.snippets, Snippet.time_exprs),  # Eagerly load snippet time expressions
-            )
-        
         # Handle archived and active notes
         if filters.get("archived", False): # list only archived notes when `archived` is specified
-            # print_sys(f"Listing archived notes for workspace: {workspace_name} ({workspace_id})")
             stmt = stmt.where(Note.archived == True)
         elif not filters.get("all", False): # list only active = non-archived notes when `all` is not specified
-            # print_sys(f"Listing active notes for workspace: {workspace_name} ({workspace_id})")
             stmt = stmt.where(Note.archived == False)
 
-        # Handle tags
-        tags = filters.get("tag", None)
-        if tags:
-            for tag in tags:
-                stmt = stmt.join(Note.snippets).join(Snippet.tags).where(Tag.name.in_(tags))
-
-        # Handle entities
-        entities = filters.get("entity", None)
-        if entities:
-            for entity in entities:
-                stmt = stmt.join(Note.snippets).join(Snippet.entities).where(Entity.name.in_(entities))
+        # Handle tags, entities and content (looked up in the full-text index)
+        note_ids = cls.filter_note_ids(
+            tags=filters.get("tag") or (),
+            entities=filters.get("entity") or (),
+            content=filters.get("content") or (),
+        )
+        if note_ids is not None:
+            stmt = stmt.where(Note.id.in_(note_ids))
+        return stmt
 
-        # Handle content
-        content = filters.get("content", None)
-        if content:
-            for c in content:
-                stmt = stmt.where(Note.snippets.any(Snippet.content.ilike(f"%{c}%")))
+    @classmethod
+    def list_by_workspace(cls, session: Session, workspace_name: str = config["active_workspace"], **filters) -> List[Note]:
+        print_sys(f"Listing notes for workspace: {workspace_name} with filters {filters}")
 
+        # Prepare the base query - the snippets and their annotations are loaded by a query each
+        stmt = select(Note).options(*NOTE_LOADING)
+        stmt = cls.filter_by_workspace(session, stmt, workspace_name, **filters)
 
         # Handle limit
         limit = filters.get("limit", None)
@@ -248,9 +345,51 @@ class NoteCRUD:
             print_warn(f"WARNING: Listing ALL notes in workspace. Please provide a limit or filters for better results.")
 
         # Handle order
-        stmt.order_by(Note.updated_at.desc())
+        stmt = stmt.order_by(*LISTING_ORDER)
+
+        return session.execute(stmt).scalars().all()
+
+    @classmethod
+    def page(
+        cls,
+        session: Session,
+        workspace_name: str = config["active_workspace"],
+        cursor: Optional[str] = None,
+        page_size: int = 50,
+        **filters,
+    ) -> Tuple[List[Row], Optional[str]]:
+        """
+        A page of the notes of a workspace (most recently updated first), with the listing columns only
+        (`LISTING_COLUMNS`), and the cursor of the next page (None on the last one). The page starts after
+        the cursor row (keyset pagination on the `ix_note_workspace_id_updated_at` index), so it is as fast
+        at any depth and stable when notes are added meanwhile.
+        """
+        stmt = cls.filter_by_workspace(session, select(*LISTING_COLUMNS), workspace_name, **filters)
+        if cursor:
+            updated_at, note_id = decode_cursor(cursor)
+            stmt = stmt.where(tuple_(Note.updated_at, Note.id) < tuple_(literal(updated_at, DateTime), literal(note_id)))
+        rows = session.execute(stmt.order_by(*LISTING_ORDER).limit(page_size + 1)).all()
+        if len(rows) <= page_size:
+            return rows, None
+        rows = rows[:page_size]
+        return rows, encode_cursor(rows[-1].updated_at, rows[-1].id)
 
-        return session.execute(stmt).unique().scalars().all()
+    @classmethod
+    def iter_by_workspace(
+        cls,
+        session: Session,
+        workspace_name: str = config["active_workspace"],
+        batch_size: int = 1000,
+        **filters,
+    ) -> Iterator[Row]:
+        """
+        Streams the notes of a workspace (most recently updated first, listing columns only), fetched
+        `batch_size` rows at a time from a server-side cursor (`yield_per`): memory stays constant
+        whatever the number of notes.
+        """
+        stmt = cls.filter_by_workspace(session, select(*LISTING_COLUMNS), workspace_name, **filters)
+        stmt = stmt.order_by(*LISTING_ORDER).execution_options(yield_per=batch_size)
+        yield from session.execute(stmt)
 
     @classmethod
     def delete(cls, session: Session, note_id: str, confirm: bool = True) -> bool:
@@ -286,7 +425,7 @@ class NoteCRUD:
         title: Optional[str] = None,
         snippets: Optional[List[dict]] = None,
         tags: Optional[Set[str]] = None,
-        entities: Optional[List[EntityIntelligence]] = None,
+        entities: Optional[List[EntityAnnotation]] = None,
         times: Optional[List[TimeIntelligence]] = None,
     ) -> Note:
         
@@ -334,16 +473,16 @@ class NoteCRUD:
                             content = content.replace(tag, f"#{tag}")
                             added_tags.add(tag)
                 # --- ENTITIES ---
-                snippet_entities = {EntityIntelligence(value=e.name, type=e.entity_type) for e in snippet.entities}
+                snippet_entities = {EntityAnnotation(content=e.name, type=e.entity_type) for e in snippet.entities}
                 all_existing_entities = all_existing_entities.union(snippet_entities)
                 # iterate over entities
                 if entities:
                     for entity in entities:
                         # if the snippet does not have the entity yet and the entity is in the content, add it to the snippet
-                        if entity not in snippet_entities and entity.value in content:
+                        if entity not in snippet_entities and entity.content in content:
                             # add entity to snippet
-                            content = content.replace(entity.value, f"@{entity.value}:{entity.type.name}")
-                            added_tags.add(entity.value)
+                            content = content.replace(entity.content, f"@{entity.content}:{entity.type.name}")
+                            added_tags.add(entity.content)
 
                 SnippetCRUD.update(
                         session,
@@ -392,6 +531,33 @@ class NoteCRUD:
         # return note
     
 class SnippetCRUD:
+    @classmethod
+    def search(
+        cls,
+        session: Session,
+        query: str,
+        workspace_id: Optional[str] = None,
+        limit: int = 10,
+        highlight: tuple = ("[", "]"),
+    ) -> List[Row]:
+        """
+        Snippets matching the query in the full-text index, best ranked (bm25) first, optionally of a workspace.
+        Returns rows of (snippet_id, note_id, title, rank, passage), the passage with the matches highlighted.
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        stmt = text(
+            "SELECT s.id AS snippet_id, s.note_id, n.title, snippet_fts.rank, "
+            "snippet(snippet_fts, 1, :open, :close, '…', 16) AS passage "
+            "FROM snippet_fts JOIN snippet s ON s.id = snippet_fts.id JOIN note n ON n.id = s.note_id "
+            "WHERE snippet_fts MATCH :match AND (:workspace_id IS NULL OR n.workspace_id = :workspace_id) "
+            "ORDER BY snippet_fts.rank LIMIT :limit"
+        )
+        return session.execute(stmt, dict(
+            match=match, workspace_id=workspace_id, limit=limit, open=highlight[0], close=highlight[1],
+        )).all()
+
     @classmethod
     def create(
         cls,
@@ -487,4 +653,149 @@ class SnippetCRUD:
                 time_expr = TimeExpr(**time_kwargs)
                 snippet.time_exprs.append(time_expr)
         session.commit()
-        return snippet
\ No newline at end of file
+        return snippet
+
+class TaskCRUD:
+    @classmethod
+    def enqueue(
+        cls,
+        session: Session,
+        task_type: str,
+        workspace: str = None,
+        note_id: str = None,
+        scheduled_at: Optional[datetime] = None,
+        deduplicate: bool = True,
+    ) -> AutomationQueue:
+        """
+        Enqueue a task. With `deduplicate`, an already pending task of the same type for the same note is reused.
+        """
+        if deduplicate:
+            stmt = select(AutomationQueue).where(
+                AutomationQueue.status == TaskStatus.PENDING.value,
+                AutomationQueue.task_type == task_type,
+                AutomationQueue.workspace == workspace,
+                AutomationQueue.note_id == note_id,
+            ).limit(1)
+            task = session.execute(stmt).scalars().first()
+            if task:
+                return task
+
+        task = AutomationQueue(
+            workspace=workspace,
+            note_id=note_id,
+            task_type=task_type,
+            status=TaskStatus.PENDING.value,
+            attempts=0,
+            scheduled_at=scheduled_at or datetime.now(),
+        )
+        session.add(task)
+        session.commit()
+        return task
+
+    @classmethod
+    def claim(cls, session: Session, workspace: str = None, worker: str = None) -> Optional[AutomationQueue]:
+        """
+        Atomically claim the next due PENDING task (PENDING -> RUNNING) in a single UPDATE statement,
+        so concurrent workers never get the same task. The tasks of a note that already has a RUNNING task
+        wait for it, so two workers never work on the same note.
+        """
+        now = datetime.now()
+        running = aliased(AutomationQueue)
+        note_busy = exists().where(
+            running.status == TaskStatus.RUNNING.value,
+            running.workspace == AutomationQueue.workspace,
+            running.note_id == AutomationQueue.note_id,
+        )
+        next_task = select(AutomationQueue.id)\
+            .where(
+                AutomationQueue.status == TaskStatus.PENDING.value,
+                AutomationQueue.scheduled_at <= now,
+                AutomationQueue.workspace == workspace,
+                AutomationQueue.note_id.is_(None) | ~note_busy,
+            )\
+            .order_by(AutomationQueue.scheduled_at.asc(), AutomationQueue.id.asc())\
+            .limit(1)\
+            .scalar_subquery()
+        stmt = update(AutomationQueue)\
+            .where(AutomationQueue.id == next_task, AutomationQueue.status == TaskStatus.PENDING.value)\
+            .values(
+                status=TaskStatus.RUNNING.value,
+                status_detail=f"Claimed by {worker}" if worker else None,
+                attempts=AutomationQueue.attempts + 1,
+                executed_at=now,
+                updated_at=now,
+            )\
+            .returning(AutomationQueue.id)
+        task_id = session.execute(stmt).scalar_one_or_none()
+        session.commit()
+        if task_id is None:
+            return None
+        return session.get(AutomationQueue, task_id)
+
+    @classmethod
+    def complete(cls, session: Session, task_id: int, result: str = None) -> None:
+        """Mark a task as successfully executed."""
+        session.execute(
+            update(AutomationQueue)
+            .where(AutomationQueue.id == task_id)
+            .values(status=TaskStatus.SUCCESS.value, status_detail=None, result=result, updated_at=datetime.now())
+        )
+        session.commit()
+
+    @classmethod
+    def fail(cls, session: Session, task_id: int, error: str, retry_at: Optional[datetime] = None) -> None:
+        """Mark a task as failed, or put it back to PENDING to be retried at `retry_at`."""
+        values = dict(status_detail=error, updated_at=datetime.now())
+        if retry_at:
+            values.update(status=TaskStatus.PENDING.value, scheduled_at=retry_at)
+        else:
+            values.update(status=TaskStatus.FAILED.value)
+        session.execute(update(AutomationQueue).where(AutomationQueue.id == task_id).values(**values))
+        session.commit()
+
+    @classmethod
+    def requeue_stale(cls, session: Session, running_before: datetime, workspace: str = None) -> int:
+        """Put back to PENDING the RUNNING tasks claimed before `running_before` (e.g. by a crashed worker)."""
+        result = session.execute(
+            update(AutomationQueue)
+            .where(
+                AutomationQueue.status == TaskStatus.RUNNING.value,
+                AutomationQueue.executed_at < running_before,
+                AutomationQueue.workspace == workspace,
+            )
+            .values(status=TaskStatus.PENDING.value, status_detail="Requeued (stale)", updated_at=datetime.now())
+        )
+        session.commit()
+        return result.rowcount
+
+    @classmethod
+    def list(cls, session: Session, workspace: str = None, status: Optional[str] = None, limit: Optional[int] = None) -> List[AutomationQueue]:
+        """List the tasks of a workspace, most recently scheduled first."""
+        stmt = select(AutomationQueue)\
+            .where(AutomationQueue.workspace == workspace)\
+            .order_by(AutomationQueue.scheduled_at.desc(), AutomationQueue.id.desc())
+        if status:
+            stmt = stmt.where(AutomationQueue.status == status)
+        if limit:
+            stmt = stmt.limit(limit)
+        return session.execute(stmt).scalars().all()
+
+    @classmethod
+    def counts(cls, session: Session, workspace: str = None) -> dict:
+        """Count the tasks of a workspace per status."""
+        stmt = select(AutomationQueue.status, func.count())\
+            .where(AutomationQueue.workspace == workspace)\
+            .group_by(AutomationQueue.status)
+        return dict(session.execute(stmt).all())
+
+    @classmethod
+    def delete(cls, session: Session, task_id: Optional[int] = None, workspace: str = None) -> int:
+        """Delete a task of a workspace, or all its PENDING and FAILED tasks if no task is specified."""
+        stmt = delete(AutomationQueue).where(AutomationQueue.workspace == workspace)
+        if task_id is not None:
+            stmt = stmt.where(AutomationQueue.id == task_id)
+        else:
+            stmt = stmt.where(AutomationQueue.status.in_([TaskStatus.PENDING.value, TaskStatus.FAILED.value]))
+        result = session.execute(stmt)
+        session.commit()
+        return result.rowcount
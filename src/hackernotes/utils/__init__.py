@@ -1,7 +1,33 @@
+import os
+import stat
+import tempfile
+
+# The umask can only be read by setting it, which changes it for every thread: read once, at import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 def wrap(text, width=30):
     """
     Wrap text to a specified width.
     """
     import textwrap
-    return textwrap.fill(text, width=width)
\ No newline at end of file
+    return textwrap.fill(text, width=width)
+
+def write_atomic(path: str, write):
+    """
+    Writes a file through a temporary file replaced atomically, `write` being called with the open file.
+    The file keeps its permissions, a new one gets the default ones (the temporary file is private).
+    """
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, "w") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+from .config import CONFIG_DIR, section_config
+from .store import SqliteStore
+
+CACHE_DEFAULTS = {
+    "enabled": True,
+    "path": os.path.join(CONFIG_DIR, "llm_cache.db"),
+    "max_size_mb": 64,
+    "ttl_days": 30,
+}
+
+def _sha(content: str) -> str:
+    """Returns the sha256 hex digest of a string."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def cache_key(backend: str, model: str, sys_prompt: str, user_prompt: str, format: dict = None) -> str:
+    """
+    Content-addressed key of an LLM call: backend, model, system prompt hash, user prompt hash and format schema.
+    """
+    format_hash = _sha(json.dumps(format, sort_keys=True)) if format else ""
+    parts = [backend, model, _sha(sys_prompt), _sha(user_prompt), format_hash]
+    return _sha("\x1f".join(parts))
+
+class LLMCache(SqliteStore):
+    """
+    On-disk (SQLite) cache of LLM responses with size-bounded LRU eviction, TTL and hit/miss statistics.
+    """
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            backend TEXT,
+            model TEXT,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed_at ON llm_cache (accessed_at)",
+        "CREATE TABLE IF NOT EXISTS llm_cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    )
+
+    def __init__(self, path: str, max_size_mb: float = 64, ttl_days: float = 30):
+        super().__init__(path)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.ttl = ttl_days * 24 * 3600 if ttl_days else None
+
+    def _bump(self, name: str, n: int = 1):
+        self.conn.execute(
+            "INSERT INTO llm_cache_stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, n),
+        )
+
+    # --- Cache Operations ---
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached response or None. Expired entries count as misses and are dropped."""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl and now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self._bump("misses")
+                return None
+            self.conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._bump("hits")
+            return row[0]
+
+    def put(self, key: str, response: str, backend: str = None, model: str = None):
+        """Stores a response and evicts the least recently used entries beyond the size bound."""
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, backend, model, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, backend, model, response, size, now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        """Drops expired entries, then the least recently used ones until the cache fits in max_bytes."""
+        if self.ttl:
+            cur = self.conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            if cur.rowcount > 0:
+                self._bump("expired", cur.rowcount)
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self.conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        self._bump("evictions", evicted)
+
+    def clear(self):
+        """Removes all cached responses and resets the statistics."""
+        with self._lock:
+            self.conn.execute("DELETE FROM llm_cache")
+            self.conn.execute("DELETE FROM llm_cache_stats")
+            self.conn.execute("VACUUM")
+
+    def stats(self) -> dict:
+        """Returns the cache statistics: entries, size, hits, misses, hit rate, evictions."""
+        with self._lock:
+            entries, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+            counters = dict(self.conn.execute("SELECT name, value FROM llm_cache_stats").fetchall())
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "evictions": counters.get("evictions", 0),
+            "expired": counters.get("expired", 0),
+        }
+
+_cache: Optional[LLMCache] = None
+
+def get_cache() -> Optional[LLMCache]:
+    """Returns the process-wide LLM cache configured under `llm_cache` in the config, or None if disabled."""
+    global _cache
+    cache_config = section_config("llm_cache", CACHE_DEFAULTS)
+    if not cache_config["enabled"]:
+        return None
+    if _cache is None:
+        _cache = LLMCache(
+            path=cache_config["path"],
+            max_size_mb=cache_config["max_size_mb"],
+            ttl_days=cache_config["ttl_days"],
+        )
+    return _cache
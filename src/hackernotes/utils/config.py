@@ -46,4 +46,14 @@ def update_config(**kwargs):
     config.update(kwargs)
     with open(CONFIG_PATH, "w") as f:
         toml.dump(config, f)
-    # print_sys(f"[+] Updated config file at with new values: {kwargs}")
\ No newline at end of file
+    # print_sys(f"[+] Updated config file at with new values: {kwargs}")
+def section_config(section: str, defaults: dict) -> dict:
+    """
+    Returns the `section` config merged with its defaults. The settings that are tables (e.g. per priority
+    class) are merged with their defaults too.
+    """
+    settings = {**defaults, **config.get(section, {})}
+    for key, value in defaults.items():
+        if isinstance(value, dict):
+            settings[key] = {**value, **(settings[key] or {})}
+    return settings
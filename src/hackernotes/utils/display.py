@@ -55,8 +55,8 @@ def display_note(note: Note, width: int = 80, footer: bool = True):
             print(fsys("[TAGS] ")+ftag(note.annotations.tags_serialized))
         if note.annotations.entities:
             print(fsys("[ENTITIES] ")+fentity(note.annotations.entities_serialized))
-        # if self.timesAll: # TODO 
-        #     print(fsys("Times: ")+', '.join([f"{time.literal} ({time.scope})" for time in self.timesAll]))
+        if note.annotations.times:
+            print(fsys("[TIMES] ")+note.annotations.times_serialized)
         # if self.urls: # TODO ??
         #     print(fsys("URLs: ")+', '.join([f"{Fore.LIGHTBLACK_EX}{url.value}{Style.RESET_ALL}" for url in self.urls]))
 
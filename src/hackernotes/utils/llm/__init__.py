@@ -0,0 +1,207 @@
+import json
+import logging
+import time
+from contextlib import nullcontext
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .backends import BACKENDS, CHARS_PER_TOKEN, LLMBackend, LLMResponse, estimate_tokens
+from .metrics import prompt_context, queued, record_cached
+from .scheduler import RequestCancelled, SchedulerFull, get_scheduler, priority
+from ..cache import cache_key, get_cache
+from ..config import config
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+def _messages(sys_prompt: str, user_prompt: str) -> list[dict]:
+    """Builds the chat messages of a system + user prompt call."""
+    return [
+        {
+            'role': 'system',
+            'content': sys_prompt,
+        },
+        {
+            'role': 'user',
+            'content': user_prompt,
+        }
+    ]
+
+# --- Backends ---
+
+_settings: Dict[Tuple[str, str], Tuple[str, dict]] = {}
+_backends: Dict[Tuple[str, str], LLMBackend] = {}
+
+def model_settings(backend: str = None) -> Tuple[str, dict]:
+    """
+    Backend name and settings of the active workspace: its `model_backend` and `model_config` columns
+    (when the database exists) over the `<backend>_config` section of the config file.
+    """
+    workspace = config.get("active_workspace")
+    if (workspace, backend) not in _settings:
+        from ...db import SessionLocal, db_exists
+        from ...db.query import WorkspaceCRUD
+
+        name, ws_config = config.get("model_backend", "ollama"), {}
+        if db_exists():
+            with SessionLocal() as session:
+                ws = WorkspaceCRUD.get_current(session)
+                if ws:
+                    name = ws.model_backend or name
+                    ws_config = ws.model_config or {}
+                    if isinstance(ws_config, str):
+                        ws_config = json.loads(ws_config)
+        name = backend or name
+        _settings[(workspace, backend)] = (name, {**config.get(f"{name}_config", {}), **ws_config})
+    return _settings[(workspace, backend)]
+
+def get_backend(backend: str = None) -> LLMBackend:
+    """The (shared, long-lived) backend of the active workspace, or the named one."""
+    name, settings = model_settings(backend)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {name} (available: {', '.join(BACKENDS)})")
+    key = (name, json.dumps(settings, sort_keys=True, default=str))
+    if key not in _backends:
+        _backends[key] = BACKENDS[name](settings)
+    return _backends[key]
+
+def warm_up(backend: str = None) -> Optional[float]:
+    """
+    Loads the model of the workspace backend ahead of the first real call, so that call does not pay the cold
+    start. Returns the load time, or None if the backend could not be reached (the calls will report it).
+    """
+    try:
+        return get_backend(backend).warm_up()
+    except Exception as e:
+        logger.warning("Could not warm up the model: %s", e)
+        return None
+
+# --- Generation ---
+
+def llm_generate(sys_prompt: str, user_prompt: str, format: dict = None, use_cache: bool = True) -> str:
+    """Generates a response with the workspace backend. Responses are served from the on-disk cache when possible."""
+    backend = get_backend()
+    cache = get_cache() if use_cache else None
+    if cache:
+        key = cache_key(backend.name, backend.model, sys_prompt, user_prompt, format)
+        cached = cache.get(key)
+        if cached is not None:
+            record_cached(backend.name, backend.model)
+            return cached
+
+    content = backend.chat(_messages(sys_prompt, user_prompt), format=format).content
+
+    if cache:
+        cache.put(key, content, backend=backend.name, model=backend.model)
+    return content
+
+async def llm_agenerate(sys_prompt: str, user_prompt: str, format: dict = None, use_cache: bool = True) -> str:
+    """Asynchronous counterpart of `llm_generate`."""
+    backend = get_backend()
+    cache = get_cache() if use_cache else None
+    if cache:
+        key = cache_key(backend.name, backend.model, sys_prompt, user_prompt, format)
+        cached = cache.get(key)
+        if cached is not None:
+            record_cached(backend.name, backend.model)
+            return cached
+
+    content = (await backend.achat(_messages(sys_prompt, user_prompt), format=format)).content
+
+    if cache:
+        cache.put(key, content, backend=backend.name, model=backend.model)
+    return content
+
+def llm_generate_batch(sys_prompt: str, user_prompts: List[str], format: dict = None, use_cache: bool = True, concurrency: int = 4) -> List[str]:
+    """Generates the responses of many user prompts (same system prompt) concurrently, in the order of the prompts."""
+    backend = get_backend()
+    cache = get_cache() if use_cache else None
+    keys = [cache_key(backend.name, backend.model, sys_prompt, prompt, format) for prompt in user_prompts]
+    responses = [cache.get(key) if cache else None for key in keys]
+
+    missing = [i for i, response in enumerate(responses) if response is None]
+    for _ in range(len(responses) - len(missing)):
+        record_cached(backend.name, backend.model)
+    if missing:
+        generated = backend.batch([_messages(sys_prompt, user_prompts[i]) for i in missing], format=format, concurrency=concurrency)
+        for i, response in zip(missing, generated):
+            responses[i] = response.content
+            if cache:
+                cache.put(keys[i], response.content, backend=backend.name, model=backend.model)
+    return responses
+
+def llm_embed(texts: List[str], model: str = None) -> List[List[float]]:
+    """Embeds a batch of texts with the workspace backend."""
+    return get_backend().embed(texts, model=model)
+
+# --- Streaming ---
+
+class GenerationStats(BaseModel):
+    """Timings of a (streamed) generation call."""
+    streamed: bool = False
+    cached: bool = False
+    ttft: Optional[float] = None # seconds until the first chunk
+    elapsed: float = 0.0
+    tokens: int = 0
+
+    @property
+    def tokens_per_s(self) -> float:
+        """Generated tokens per second, after the first token."""
+        decode_time = self.elapsed - (self.ttft or 0.0)
+        return self.tokens / decode_time if decode_time > 0 else 0.0
+
+    def summary(self) -> str:
+        if self.cached:
+            return f"Served from cache in {self.elapsed:.2f}s"
+        if not self.streamed:
+            return f"Generated in {self.elapsed:.2f}s (not streamed)"
+        ttft = f"TTFT {self.ttft:.2f}s, " if self.ttft is not None else ""
+        return f"{ttft}{self.tokens} tokens in {self.elapsed:.2f}s ({self.tokens_per_s:.1f} tokens/s)"
+
+def generate_stream(sys_prompt: str, user_prompt: str, use_cache: bool = True, stats: GenerationStats = None, stream: bool = True, prompt: str = None) -> Iterator[str]:
+    """
+    Streams the response chunks as the workspace backend produces them. Backends that cannot stream
+    (or `stream=False`) fall back to a regular call whose response is yielded as a single chunk.
+    The full response is cached once complete, and a cached response is yielded at once.
+    Timings are recorded in `stats`, and the model call is labelled with the `prompt` name if given
+    (a prompt context around the consumer of the generator would stay set between the chunks).
+    """
+    stats = stats if stats is not None else GenerationStats()
+    backend = get_backend()
+    started = time.perf_counter()
+    cache = get_cache() if use_cache else None
+    if cache:
+        key = cache_key(backend.name, backend.model, sys_prompt, user_prompt, None)
+        cached = cache.get(key)
+        if cached is not None:
+            record_cached(backend.name, backend.model, kind="stream", prompt=prompt)
+            stats.cached = True
+            stats.ttft = stats.elapsed = time.perf_counter() - started
+            yield cached
+            return
+
+    if not (stream and backend.supports_streaming):
+        with prompt_context(prompt) if prompt else nullcontext():
+            content = backend.chat(_messages(sys_prompt, user_prompt)).content
+        stats.elapsed = time.perf_counter() - started
+        if cache:
+            cache.put(key, content, backend=backend.name, model=backend.model)
+        yield content
+        return
+
+    stats.streamed = True
+    chunks = []
+    for chunk in backend.stream(_messages(sys_prompt, user_prompt), prompt=prompt):
+        if chunk.content:
+            if stats.ttft is None:
+                stats.ttft = time.perf_counter() - started
+            chunks.append(chunk.content)
+            stats.tokens += 1
+            yield chunk.content
+        if chunk.done and chunk.completion_tokens:
+            stats.tokens = chunk.completion_tokens
+    stats.elapsed = time.perf_counter() - started
+
+    if cache:
+        cache.put(key, "".join(chunks), backend=backend.name, model=backend.model)
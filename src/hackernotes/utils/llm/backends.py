@@ -0,0 +1,541 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Iterator, List, Optional, Type
+
+import numpy as np
+from ollama import AsyncClient, Client
+from pydantic import BaseModel
+
+from .metrics import CallTimer, current_prompt, prompt_context, queued
+from .scheduler import get_scheduler
+from ..config import CONFIG_DIR, config
+
+DEFAULT_MODEL = "llama3.2:latest"
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+# How long the server keeps the model loaded after a call (ollama duration, or seconds; -1 for ever)
+DEFAULT_KEEP_ALIVE = "30m"
+
+# Rough number of characters per token, used when no tokenizer is at hand
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens of a text."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+class LLMResponse(BaseModel):
+    """A chat response (or a streamed chunk of it) with its token counts and TTFT, when the backend reports them."""
+    content: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    ttft: Optional[float] = None # server-side seconds until the first token (model load + prompt evaluation)
+    done: bool = True
+    context: Optional[List[int]] = None # conversation state kept by the backend, on the last chunk (see `converse`)
+
+class LLMBackend:
+    """
+    Model backend interface. A backend instance is long-lived (see `get_backend`) and keeps its connections
+    open between calls. Caching is done by the callers, on top of the backend.
+    Backends implement `_chat` (and optionally `_achat`, `_stream`, `_converse`, `_embed`); the public methods
+    wrap them to record the timings and token counts of every call (see `metrics`).
+    """
+    name: str = ""
+    supports_streaming: bool = False
+    supports_context: bool = False
+
+    def __init__(self, settings: dict = None):
+        self.settings = settings or {}
+        self.model = self.settings.get("model") or DEFAULT_MODEL
+        self.embed_model = self.settings.get("embed_model") or DEFAULT_EMBED_MODEL
+
+    def _chat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        raise NotImplementedError
+
+    async def _achat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        """Asynchronous chat, by default the sync one in a thread."""
+        return await asyncio.to_thread(self._chat, messages, format)
+
+    def _stream(self, messages: List[dict]) -> Iterator[LLMResponse]:
+        """Streams the response chunks, by default a single chunk."""
+        yield self._chat(messages)
+
+    def _converse(self, system: str, prompt: str, context: Optional[List[int]]) -> Iterator[LLMResponse]:
+        """
+        Streams the response to the next prompt of a conversation whose previous turns are in `context`.
+        By default the backend keeps no context: the prompt must carry the history.
+        """
+        return self._stream([{"role": "system", "content": system}, {"role": "user", "content": prompt}])
+
+    def _embed(self, texts: List[str], model: str) -> List[List[float]]:
+        raise NotImplementedError
+
+    def _warm_up(self):
+        """Loads the model, by default nothing to load."""
+
+    def warm_up(self) -> float:
+        """Makes the model resident before the first real call (e.g. at daemon or batch start). Returns the load time."""
+        with prompt_context("warm_up"):
+            timer = CallTimer(self.name, self.model)
+            try:
+                self._warm_up()
+            except Exception as e:
+                timer.finish(error=e)
+                raise
+            timer.finish()
+        return timer.record.total
+
+    def unload(self):
+        """Unloads the model, by default nothing to unload."""
+
+    @contextmanager
+    def _slot(self):
+        """Holds a slot of the scheduler (see `scheduler`) in the priority class of the context. Yields the wait."""
+        scheduler = get_scheduler()
+        if scheduler is None:
+            yield 0.0
+            return
+        with scheduler.slot() as waited:
+            yield waited
+
+    @asynccontextmanager
+    async def _aslot(self):
+        scheduler = get_scheduler()
+        if scheduler is None:
+            yield 0.0
+            return
+        async with scheduler.aslot() as waited:
+            yield waited
+
+    def chat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        with self._slot() as waited:
+            timer = CallTimer(self.name, self.model)
+            timer.add_wait(waited)
+            try:
+                response = self._chat(messages, format)
+            except Exception as e:
+                timer.finish(error=e)
+                raise
+            timer.finish(response)
+            return response
+
+    async def achat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        async with self._aslot() as waited:
+            timer = CallTimer(self.name, self.model)
+            timer.add_wait(waited)
+            try:
+                response = await self._achat(messages, format)
+            except Exception as e:
+                timer.finish(error=e)
+                raise
+            timer.finish(response)
+            return response
+
+    def stream(self, messages: List[dict], prompt: str = None) -> Iterator[LLMResponse]:
+        """
+        Streams the response chunks, the call labelled with the `prompt` name when given. A prompt context
+        cannot label a stream: set around the consumer of the chunks, it would stay set between them.
+        """
+        with self._slot() as waited:
+            timer = CallTimer(self.name, self.model, kind="stream", prompt=prompt)
+            timer.add_wait(waited)
+            last = None
+            try:
+                for chunk in self._stream(messages):
+                    if chunk.content:
+                        timer.first_token()
+                    last = chunk
+                    yield chunk
+            except Exception as e:
+                timer.finish(error=e)
+                raise
+            timer.finish(last)
+
+    def converse(self, system: str, prompt: str, context: List[int] = None, label: str = None) -> Iterator[LLMResponse]:
+        """
+        Streams the response to a conversation turn. With `supports_context`, the last chunk carries the new
+        context to pass with the next turn, so the previous turns are neither resent nor evaluated again.
+        The call is labelled with `label` when given, as in `stream`.
+        """
+        with self._slot() as waited:
+            timer = CallTimer(self.name, self.model, kind="stream", prompt=label)
+            timer.add_wait(waited)
+            last = None
+            try:
+                for chunk in self._converse(system, prompt, context or None):
+                    if chunk.content:
+                        timer.first_token()
+                    last = chunk
+                    yield chunk
+            except Exception as e:
+                timer.finish(error=e)
+                raise
+            timer.finish(last)
+
+    async def abatch(self, requests: List[List[dict]], format: dict = None, concurrency: int = 4) -> List[LLMResponse]:
+        """Runs many chats with at most `concurrency` in flight, the responses in the order of the requests."""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        async def one(messages: List[dict]) -> LLMResponse:
+            waiting = time.perf_counter()
+            async with semaphore:
+                with queued(time.perf_counter() - waiting):
+                    return await self.achat(messages, format)
+        return await asyncio.gather(*(one(messages) for messages in requests))
+
+    def batch(self, requests: List[List[dict]], format: dict = None, concurrency: int = 4) -> List[LLMResponse]:
+        """Synchronous counterpart of `abatch`."""
+        return asyncio.run(self.abatch(requests, format, concurrency))
+
+    def embed(self, texts: List[str], model: str = None) -> List[List[float]]:
+        model = model or self.embed_model
+        with self._slot() as waited:
+            timer = CallTimer(self.name, model, kind="embed")
+            timer.add_wait(waited)
+            try:
+                embeddings = self._embed(texts, model)
+            except Exception as e:
+                timer.finish(error=e)
+                raise
+            timer.finish()
+            return embeddings
+
+class OllamaBackend(LLMBackend):
+    """
+    Ollama server backend (`api_url`, `api_key`, `model`, `embed_model`, `keep_alive` settings). The HTTP clients
+    are created once and reused: one sync client, and one async client per event loop (they cannot be shared
+    across loops). Every call renews the `keep_alive` of the model, so it stays loaded between interactive commands.
+    """
+    name = "ollama"
+    supports_streaming = True
+    supports_context = True
+
+    def __init__(self, settings: dict = None):
+        super().__init__(settings)
+        self.host = self.settings.get("api_url") or None
+        api_key = self.settings.get("api_key")
+        self.client_kwargs = {"headers": {"Authorization": f"Bearer {api_key}"}} if api_key else {}
+        self.keep_alive = self.settings.get("keep_alive", DEFAULT_KEEP_ALIVE)
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self) -> Client:
+        if self._client is None:
+            self._client = Client(host=self.host, **self.client_kwargs)
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncClient:
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            self._async_clients[loop] = AsyncClient(host=self.host, **self.client_kwargs)
+        return self._async_clients[loop]
+
+    @staticmethod
+    def _response(response) -> LLMResponse:
+        """A chat or generate response (or chunk). Durations are reported in nanoseconds, on the final one only."""
+        ttft = None
+        if response.prompt_eval_duration is not None:
+            ttft = ((response.load_duration or 0) + response.prompt_eval_duration) / 1e9
+        message = getattr(response, "message", None)
+        return LLMResponse(
+            content=(message.content if message else getattr(response, "response", "")) or "",
+            prompt_tokens=response.prompt_eval_count or 0,
+            completion_tokens=response.eval_count or 0,
+            ttft=ttft,
+            done=bool(response.done),
+        )
+
+    def _chat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        return self._response(self.client.chat(model=self.model, messages=messages, format=format, keep_alive=self.keep_alive))
+
+    async def _achat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        return self._response(await self.async_client.chat(
+            model=self.model, messages=messages, format=format, keep_alive=self.keep_alive,
+        ))
+
+    def _stream(self, messages: List[dict]) -> Iterator[LLMResponse]:
+        for chunk in self.client.chat(model=self.model, messages=messages, stream=True, keep_alive=self.keep_alive):
+            yield self._response(chunk)
+
+    def _converse(self, system: str, prompt: str, context: Optional[List[int]]) -> Iterator[LLMResponse]:
+        # The system prompt is already in the context after the first turn
+        for chunk in self.client.generate(
+            model=self.model, prompt=prompt, system=None if context else system, context=context,
+            stream=True, keep_alive=self.keep_alive,
+        ):
+            response = self._response(chunk)
+            if chunk.done:
+                response.context = list(chunk.context or [])
+            yield response
+
+    def _embed(self, texts: List[str], model: str) -> List[List[float]]:
+        return self.client.embed(model=model, input=texts, keep_alive=self.keep_alive).embeddings
+
+    def _warm_up(self):
+        # A chat without messages only loads the model
+        self.client.chat(model=self.model, messages=[], keep_alive=self.keep_alive)
+
+    def unload(self):
+        """Unloads the model from the server (to measure cold starts)."""
+        self.client.chat(model=self.model, messages=[], keep_alive=0)
+
+def _schema_instance(schema: dict, words: List[str], defs: dict):
+    """A deterministic instance of a JSON schema, filled with words of the prompt."""
+    if "$ref" in schema:
+        return _schema_instance(defs[schema["$ref"].split("/")[-1]], words, defs)
+    if "anyOf" in schema:
+        return _schema_instance(schema["anyOf"][0], words, defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type")
+    if kind == "object":
+        return {key: _schema_instance(value, words, defs) for key, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        items = schema.get("items", {})
+        if items.get("type") == "string":
+            return words[:3]
+        return [_schema_instance(items, words, defs)]
+    if kind == "string":
+        return words[0] if words else ""
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return None
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic in-process backend, for offline tests and load tests of the AI pipelines: the same request
+    always gets the same response, after `latency_ms` (time to first token) and at `tokens_per_s` (0 for
+    instant) when streamed. Structured requests get a valid instance of their schema. A call on an unloaded
+    model first pays `cold_start_ms`; the model unloads after `keep_alive` seconds idle (never if unset).
+    Conversations keep a context of placeholder tokens, only the new prompt is counted (evaluated) at each turn.
+    """
+    name = "stub"
+    supports_streaming = True
+    supports_context = True
+
+    def __init__(self, settings: dict = None):
+        super().__init__(settings)
+        self.model = self.settings.get("model") or "stub"
+        self.latency = self.settings.get("latency_ms", 0) / 1000
+        self.tokens_per_s = self.settings.get("tokens_per_s", 0)
+        self.dim = self.settings.get("dim", 64)
+        self.cold_start = self.settings.get("cold_start_ms", 0) / 1000
+        self.keep_alive = self.settings.get("keep_alive")
+        self._last_used = None
+
+    def _load_delay(self) -> float:
+        """Seconds to wait for the model to be loaded, and renews its keep alive."""
+        now = time.monotonic()
+        cold = self._last_used is None or (self.keep_alive is not None and 0 <= self.keep_alive < now - self._last_used)
+        self._last_used = now
+        return self.cold_start if cold else 0.0
+
+    def _warm_up(self):
+        time.sleep(self._load_delay())
+
+    def unload(self):
+        self._last_used = None
+
+    def _respond(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        text = messages[-1]["content"]
+        words = sorted(set(re.findall(r"[A-Za-z][\w-]{3,}", text)), key=lambda word: (-len(word), word))
+        if format:
+            content = json.dumps(_schema_instance(format, words, format.get("$defs", {})))
+        else:
+            digest = hashlib.sha256(json.dumps(messages).encode()).hexdigest()[:8]
+            content = f"[stub {digest}] " + " ".join(words[:32])
+        return LLMResponse(
+            content=content,
+            prompt_tokens=sum(estimate_tokens(message["content"]) for message in messages),
+            completion_tokens=estimate_tokens(content),
+        )
+
+    def _chat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        time.sleep(self._load_delay() + self.latency)
+        return self._respond(messages, format)
+
+    async def _achat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        await asyncio.sleep(self._load_delay() + self.latency)
+        return self._respond(messages, format)
+
+    def _stream(self, messages: List[dict]) -> Iterator[LLMResponse]:
+        time.sleep(self._load_delay() + self.latency)
+        response = self._respond(messages)
+        for word in re.findall(r"\S+\s*", response.content):
+            if self.tokens_per_s:
+                time.sleep(1 / self.tokens_per_s)
+            yield LLMResponse(content=word, done=False)
+        yield LLMResponse(prompt_tokens=response.prompt_tokens, completion_tokens=response.completion_tokens)
+
+    def _converse(self, system: str, prompt: str, context: Optional[List[int]]) -> Iterator[LLMResponse]:
+        messages = [{"role": "user", "content": prompt}] if context else [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+        for chunk in self._stream(messages):
+            if chunk.done:
+                chunk.context = (context or []) + [0] * (chunk.prompt_tokens + chunk.completion_tokens)
+            yield chunk
+
+    def _embed(self, texts: List[str], model: str) -> List[List[float]]:
+        """Hashed bag of words vectors: texts sharing words are close."""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[i, int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % self.dim] += 1
+        return vectors.tolist()
+
+class CassetteMiss(LookupError):
+    """A replayed request that the cassette has no recording of."""
+
+class CassetteBackend(LLMBackend):
+    """
+    Record/replay backend, to benchmark and regression-test the AI pipelines without a model server.
+    With `mode: record`, the calls go to the `backend` backend (its `<backend>_config` settings, then
+    `backend_config`) and are appended to the `path` cassette (JSONL) with their responses and latencies.
+    With `mode: replay` (the default), the same requests get the recorded responses, after the recorded latencies
+    times `latency_scale` (0 for instant); identical requests are replayed in the order they were recorded, and
+    a request not in the cassette raises `CassetteMiss`. Record and replay with the response cache bypassed,
+    otherwise the cached calls are neither recorded nor replayed.
+    """
+    name = "cassette"
+
+    def __init__(self, settings: dict = None):
+        super().__init__(settings)
+        self.mode = self.settings.get("mode", "replay")
+        self.path = os.path.expanduser(self.settings.get("path") or os.path.join(CONFIG_DIR, "cassette.jsonl"))
+        self.latency_scale = self.settings.get("latency_scale", 1.0)
+        self._lock = threading.Lock()
+        self._recordings: Dict[str, List[dict]] = {}
+        self._replayed: Dict[str, int] = {}
+        self.inner = None
+
+        if self.mode == "record":
+            inner = self.settings.get("backend", "ollama")
+            self.inner = BACKENDS[inner]({**config.get(f"{inner}_config", {}), **self.settings.get("backend_config", {})})
+            header = {
+                "backend": inner,
+                "model": self.inner.model,
+                "embed_model": self.inner.embed_model,
+                "supports_streaming": self.inner.supports_streaming,
+                "supports_context": self.inner.supports_context,
+            }
+            if not os.path.exists(self.path) or not os.path.getsize(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "w") as f:
+                    f.write(json.dumps(header) + "\n")
+        elif self.mode == "replay":
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f"No cassette at {self.path}, record one first (mode: record).")
+            with open(self.path) as f:
+                header = json.loads(f.readline())
+                for line in f:
+                    entry = json.loads(line)
+                    self._recordings.setdefault(entry["key"], []).append(entry)
+        else:
+            raise ValueError(f"Unknown cassette mode: {self.mode} (record or replay)")
+        self.model, self.embed_model = header["model"], header["embed_model"]
+        self.supports_streaming, self.supports_context = header["supports_streaming"], header["supports_context"]
+
+    @staticmethod
+    def _key(kind: str, request: dict) -> str:
+        return hashlib.sha256(json.dumps([kind, request], sort_keys=True).encode()).hexdigest()
+
+    def _record(self, key: str, kind: str, **recording):
+        entry = {"key": key, "kind": kind, "prompt": current_prompt(), **recording}
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def _take(self, key: str) -> dict:
+        """The next recording of the request (the last one again once they are all replayed)."""
+        with self._lock:
+            recordings = self._recordings.get(key)
+            if not recordings:
+                raise CassetteMiss(f"The cassette {self.path} has no recording of this request, record it again.")
+            i = self._replayed.get(key, 0)
+            self._replayed[key] = i + 1
+        return recordings[min(i, len(recordings) - 1)]
+
+    # --- Single responses ---
+
+    def _chat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        key = self._key("chat", {"messages": messages, "format": format})
+        if self.inner:
+            started = time.perf_counter()
+            response = self.inner._chat(messages, format)
+            self._record(key, "chat", latency=time.perf_counter() - started, response=response.model_dump())
+            return response
+        entry = self._take(key)
+        time.sleep(entry["latency"] * self.latency_scale)
+        return LLMResponse(**entry["response"])
+
+    async def _achat(self, messages: List[dict], format: dict = None) -> LLMResponse:
+        key = self._key("chat", {"messages": messages, "format": format})
+        if self.inner:
+            started = time.perf_counter()
+            response = await self.inner._achat(messages, format)
+            self._record(key, "chat", latency=time.perf_counter() - started, response=response.model_dump())
+            return response
+        entry = self._take(key)
+        await asyncio.sleep(entry["latency"] * self.latency_scale)
+        return LLMResponse(**entry["response"])
+
+    def _embed(self, texts: List[str], model: str) -> List[List[float]]:
+        key = self._key("embed", {"texts": texts, "model": model})
+        if self.inner:
+            started = time.perf_counter()
+            embeddings = [list(map(float, vector)) for vector in self.inner._embed(texts, model)]
+            self._record(key, "embed", latency=time.perf_counter() - started, embeddings=embeddings)
+            return embeddings
+        entry = self._take(key)
+        time.sleep(entry["latency"] * self.latency_scale)
+        return entry["embeddings"]
+
+    # --- Streams: each chunk with its offset from the start of the call ---
+
+    def _replay_chunks(self, key: str) -> Iterator[LLMResponse]:
+        entry = self._take(key)
+        previous = 0.0
+        for offset, chunk in entry["chunks"]:
+            time.sleep((offset - previous) * self.latency_scale)
+            previous = offset
+            yield LLMResponse(**chunk)
+
+    def _record_chunks(self, key: str, kind: str, chunks: Iterator[LLMResponse]) -> Iterator[LLMResponse]:
+        started = time.perf_counter()
+        recorded = []
+        for chunk in chunks:
+            recorded.append((time.perf_counter() - started, chunk.model_dump()))
+            yield chunk
+        self._record(key, kind, chunks=recorded)
+
+    def _stream(self, messages: List[dict]) -> Iterator[LLMResponse]:
+        key = self._key("stream", {"messages": messages})
+        if self.inner:
+            return self._record_chunks(key, "stream", self.inner._stream(messages))
+        return self._replay_chunks(key)
+
+    def _converse(self, system: str, prompt: str, context: Optional[List[int]]) -> Iterator[LLMResponse]:
+        key = self._key("converse", {"system": system, "prompt": prompt, "context": context})
+        if self.inner:
+            return self._record_chunks(key, "converse", self.inner._converse(system, prompt, context))
+        return self._replay_chunks(key)
+
+    def _warm_up(self):
+        if self.inner:
+            self.inner._warm_up()
+
+    def unload(self):
+        if self.inner:
+            self.inner.unload()
+
+BACKENDS: Dict[str, Type[LLMBackend]] = {
+    OllamaBackend.name: OllamaBackend,
+    StubBackend.name: StubBackend,
+    CassetteBackend.name: CassetteBackend,
+}
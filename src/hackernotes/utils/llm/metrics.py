@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+import pandas as pd
+from pydantic import BaseModel
+
+from ..config import CONFIG_DIR, section_config
+from ..store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+METRICS_DEFAULTS = {
+    "enabled": True,
+    "path": os.path.join(CONFIG_DIR, "llm_metrics.db"),
+    "trace_path": "", # JSONL trace of every call, for offline analysis
+    "max_records": 100_000,
+}
+
+class CallRecord(BaseModel):
+    """Timings (seconds) and token counts of a model call."""
+    timestamp: float
+    prompt: str
+    backend: str
+    model: str
+    kind: str = "chat" # chat, stream or embed
+    queue_wait: float = 0.0
+    ttft: Optional[float] = None
+    total: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached: bool = False
+    error: Optional[str] = None
+
+# --- Call Context ---
+
+class _CallContext:
+    """
+    Labels of the model calls made in a context: the prompt name, and a pending queue wait (shared with the
+    nested contexts) charged to the next call.
+    """
+    def __init__(self, prompt: str = None, wait: List[float] = None):
+        self.prompt = prompt
+        self.wait = wait if wait is not None else [0.0]
+
+_context: ContextVar[Optional[_CallContext]] = ContextVar("llm_call_context", default=None)
+
+@contextmanager
+def prompt_context(prompt: str):
+    """Labels the model calls made in the block (and the tasks it starts) with a prompt name."""
+    current = _context.get()
+    token = _context.set(_CallContext(prompt, current.wait if current else None))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+@contextmanager
+def queued(seconds: float):
+    """Charges the time spent waiting for a concurrency slot to the next model call made in the block."""
+    current = _context.get()
+    token = _context.set(_CallContext(current.prompt if current else None, [seconds]))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def current_prompt() -> Optional[str]:
+    """The prompt name of the current context, if any."""
+    current = _context.get()
+    return current.prompt if current else None
+
+# --- Recording ---
+
+class CallTimer:
+    """
+    Times a model call from its start: `first_token` when the first chunk arrives, `finish` once done.
+    An explicit `prompt` name takes precedence over the one of the context.
+    """
+
+    def __init__(self, backend: str, model: str, kind: str = "chat", prompt: str = None):
+        current = _context.get()
+        self.started = time.perf_counter()
+        self.record = CallRecord(
+            timestamp=time.time(),
+            prompt=prompt or (current and current.prompt) or ("embed" if kind == "embed" else "unnamed"),
+            backend=backend,
+            model=model,
+            kind=kind,
+        )
+        if current:
+            # Only the first call after the wait is charged with it
+            self.record.queue_wait, current.wait[0] = current.wait[0], 0.0
+
+    def add_wait(self, seconds: float):
+        """Charges a wait spent before the call started (e.g. for a scheduler slot)."""
+        self.record.queue_wait += seconds
+
+    def first_token(self):
+        if self.record.ttft is None:
+            self.record.ttft = time.perf_counter() - self.started
+
+    def finish(self, response=None, error: BaseException = None, cached: bool = False):
+        """Completes the record with the response token counts (and server-side TTFT if reported), and stores it."""
+        self.record.total = time.perf_counter() - self.started
+        self.record.cached = cached
+        if response is not None:
+            self.record.prompt_tokens = response.prompt_tokens
+            self.record.completion_tokens = response.completion_tokens
+            if self.record.ttft is None and response.ttft is not None:
+                self.record.ttft = response.ttft
+        if cached:
+            self.record.ttft = self.record.total
+        if error is not None:
+            self.record.error = str(error) or type(error).__name__
+        store = get_metrics()
+        if store:
+            store.add(self.record)
+
+def record_cached(backend: str, model: str, kind: str = "chat", prompt: str = None):
+    """Records a call served from the response cache."""
+    CallTimer(backend, model, kind, prompt).finish(cached=True)
+
+# --- Storage ---
+
+class MetricsStore(SqliteStore):
+    """
+    On-disk (SQLite) log of the model calls, trimmed to the `max_records` most recent ones, aggregated
+    on demand. Every record is also appended to the JSONL trace file when one is configured.
+    """
+    FIELDS = list(CallRecord.model_fields)
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp REAL NOT NULL,
+            prompt TEXT NOT NULL,
+            backend TEXT NOT NULL,
+            model TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            queue_wait REAL NOT NULL,
+            ttft REAL,
+            total REAL NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            cached INTEGER NOT NULL,
+            error TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_llm_calls_timestamp ON llm_calls (timestamp)",
+    )
+
+    def __init__(self, path: str, trace_path: str = None, max_records: int = 100_000):
+        super().__init__(path)
+        self.trace_path = os.path.expanduser(trace_path) if trace_path else None
+        self.max_records = max_records
+
+    def add(self, record: CallRecord):
+        """Stores a call record. Failures are logged, they never fail the call itself."""
+        values = record.model_dump()
+        try:
+            with self._lock:
+                cur = self.conn.execute(
+                    f"INSERT INTO llm_calls ({', '.join(self.FIELDS)}) VALUES ({', '.join('?' * len(self.FIELDS))})",
+                    [values[field] for field in self.FIELDS],
+                )
+                if self.max_records and cur.lastrowid % 1000 == 0:
+                    self.conn.execute("DELETE FROM llm_calls WHERE id <= ?", (cur.lastrowid - self.max_records,))
+                if self.trace_path:
+                    with open(self.trace_path, "a") as f:
+                        f.write(json.dumps(values) + "\n")
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("Could not record LLM call metrics: %s", e)
+
+    def records(self, since: float = None) -> pd.DataFrame:
+        """The call records, optionally only the ones after the `since` timestamp."""
+        with self._lock:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(self.FIELDS)} FROM llm_calls WHERE timestamp >= ? ORDER BY id",
+                self.conn,
+                params=(since or 0,),
+            )
+
+    def aggregate(self, since: float = None) -> List[dict]:
+        """
+        Per prompt name and model: number of calls (cached, failed), mean queue wait and TTFT, median and p95 total
+        time, token counts and decode throughput. Timings are over the calls actually sent to the model.
+        """
+        records = self.records(since)
+        stats = []
+        for (prompt, model), calls in records.groupby(["prompt", "model"], sort=True):
+            sent = calls[(calls["cached"] == 0) & calls["error"].isna()]
+            decode_time = (sent["total"] - sent["ttft"].fillna(0)).clip(lower=0).sum()
+            stats.append({
+                "prompt": prompt,
+                "model": model,
+                "calls": len(calls),
+                "cached": int(calls["cached"].sum()),
+                "errors": int(calls["error"].notna().sum()),
+                "queue_wait": float(sent["queue_wait"].mean()) if len(sent) else 0.0,
+                "ttft": float(sent["ttft"].mean()) if sent["ttft"].notna().any() else None,
+                "p50": float(sent["total"].quantile(0.5)) if len(sent) else 0.0,
+                "p95": float(sent["total"].quantile(0.95)) if len(sent) else 0.0,
+                "prompt_tokens": int(sent["prompt_tokens"].sum()),
+                "completion_tokens": int(sent["completion_tokens"].sum()),
+                "tokens_per_s": float(sent["completion_tokens"].sum() / decode_time) if decode_time > 0 else 0.0,
+            })
+        return stats
+
+    def clear(self):
+        """Removes all the call records."""
+        with self._lock:
+            self.conn.execute("DELETE FROM llm_calls")
+            self.conn.execute("VACUUM")
+
+_metrics: Optional[MetricsStore] = None
+
+def get_metrics() -> Optional[MetricsStore]:
+    """Returns the process-wide metrics store configured under `llm_metrics` in the config, or None if disabled."""
+    global _metrics
+    metrics_config = section_config("llm_metrics", METRICS_DEFAULTS)
+    if not metrics_config["enabled"]:
+        return None
+    if _metrics is None:
+        _metrics = MetricsStore(
+            path=metrics_config["path"],
+            trace_path=metrics_config["trace_path"],
+            max_records=metrics_config["max_records"],
+        )
+    return _metrics
@@ -0,0 +1,354 @@
+"""
+Priority scheduler in front of the model server, shared by all the hn processes of the machine (interactive
+commands, the automation workers, batch runs) through a small SQLite table of the requests waiting for, or
+holding, a slot. A request is admitted when its class is under its concurrency limit, no request of a higher
+class is waiting, and it is the oldest waiting one of its class; the lower classes never take the last
+`reserved_interactive` slots, so an interactive request starts at once even during a batch run. A request
+that can be admitted when it arrives is registered as running at once: only the requests that wait poll.
+The asynchronous requests of an event loop wait in process, on futures: only the first one of each class is
+registered in the table, and its admission is polled from a thread, never on the event loop.
+"""
+import asyncio
+import os
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional, Tuple
+
+from ..config import CONFIG_DIR, section_config
+from ..store import SqliteStore
+
+INTERACTIVE, BACKGROUND, BULK = "interactive", "background", "bulk"
+PRIORITIES = [INTERACTIVE, BACKGROUND, BULK] # highest first
+
+SCHEDULER_DEFAULTS = {
+    "enabled": True,
+    "path": os.path.join(CONFIG_DIR, "llm_scheduler.db"),
+    "max_concurrency": 4, # requests in flight on the model server, all classes
+    "reserved_interactive": 1, # slots only interactive requests can take
+    "limits": {INTERACTIVE: 4, BACKGROUND: 2, BULK: 3},
+    "max_queue": {INTERACTIVE: 16, BACKGROUND: 64, BULK: 256}, # waiting requests, beyond new ones are refused
+    "poll_ms": {INTERACTIVE: 10, BACKGROUND: 50, BULK: 100},
+    "sweep_s": 5, # interval of the removal of the requests of dead processes
+}
+
+class SchedulerFull(RuntimeError):
+    """The queue of the priority class is full: the request is refused (admission control)."""
+
+class RequestCancelled(RuntimeError):
+    """The waiting request was cancelled (see `Scheduler.cancel`)."""
+
+def scheduler_config() -> dict:
+    """Returns the `llm_scheduler` config merged with the defaults (the per class settings too)."""
+    return section_config("llm_scheduler", SCHEDULER_DEFAULTS)
+
+_priority: ContextVar[str] = ContextVar("llm_priority", default=INTERACTIVE)
+
+@contextmanager
+def priority(name: str):
+    """Runs the model calls made in the block (and the tasks it starts) in a priority class."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority class: {name} (available: {', '.join(PRIORITIES)})")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def current_priority() -> str:
+    return _priority.get()
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class Scheduler(SqliteStore):
+    """Slots of the model server, see the module documentation."""
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS llm_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pid INTEGER NOT NULL,
+            priority TEXT NOT NULL,
+            state TEXT NOT NULL,
+            since REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_llm_requests_state ON llm_requests (state, priority, id)",
+    )
+
+    def __init__(self, settings: dict = None):
+        self.settings = settings or scheduler_config()
+        super().__init__(self.settings["path"])
+        self._swept = 0.0
+        self._admissions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopAdmission]" = weakref.WeakKeyDictionary()
+
+    # --- Admission ---
+
+    def _maybe_sweep(self):
+        """Removes the requests of the dead processes (e.g. killed while holding a slot), every `sweep_s`."""
+        if time.monotonic() - self._swept < self.settings["sweep_s"]:
+            return
+        pids = [row[0] for row in self.conn.execute("SELECT DISTINCT pid FROM llm_requests")]
+        dead = [pid for pid in pids if pid != os.getpid() and not _alive(pid)]
+        if dead:
+            self.conn.execute(f"DELETE FROM llm_requests WHERE pid IN ({', '.join('?' * len(dead))})", dead)
+        self._swept = time.monotonic()
+
+    def _admissible(self, name: str, request_id: Optional[int]) -> bool:
+        """
+        Whether a request of the class can take a slot: the class is under its limits, no request of a higher
+        class waits, and the request is the oldest waiting one of its class (a new one, `request_id` None, when
+        none waits).
+        """
+        running = dict(self.conn.execute(
+            "SELECT priority, COUNT(*) FROM llm_requests WHERE state = 'running' GROUP BY priority"
+        ).fetchall())
+        higher = PRIORITIES[:PRIORITIES.index(name)]
+        higher_waiting = higher and self.conn.execute(
+            f"SELECT 1 FROM llm_requests WHERE state = 'waiting' AND priority IN ({', '.join('?' * len(higher))}) LIMIT 1",
+            higher,
+        ).fetchone()
+        first = self.conn.execute(
+            "SELECT MIN(id) FROM llm_requests WHERE state = 'waiting' AND priority = ?", (name,)
+        ).fetchone()[0]
+        capacity = self.settings["max_concurrency"] - (0 if name == INTERACTIVE else self.settings["reserved_interactive"])
+        return (
+            sum(running.values()) < capacity
+            and running.get(name, 0) < self.settings["limits"][name]
+            and not higher_waiting
+            and first == request_id
+        )
+
+    def _enqueue(self, name: str) -> Tuple[int, bool]:
+        """
+        Registers a request, running at once when it is admissible (so an uncontended request never polls),
+        otherwise waiting, unless the queue of its class is full. Returns its id and whether it was admitted.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._maybe_sweep()
+                admitted = self._admissible(name, None)
+                if not admitted:
+                    waiting = self.conn.execute(
+                        "SELECT COUNT(*) FROM llm_requests WHERE priority = ? AND state = 'waiting'", (name,)
+                    ).fetchone()[0]
+                    if waiting >= self.settings["max_queue"][name]:
+                        raise SchedulerFull(f"Too many {name} model requests waiting ({waiting}), try again later.")
+                request_id = self.conn.execute(
+                    "INSERT INTO llm_requests (pid, priority, state, since) VALUES (?, ?, ?, ?)",
+                    (os.getpid(), name, "running" if admitted else "waiting", time.time()),
+                ).lastrowid
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return request_id, admitted
+
+    def _try_admit(self, request_id: int, name: str) -> bool:
+        """Admits the waiting request if a slot of its class is free for it. Raises if it was cancelled."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._maybe_sweep()
+                state = self.conn.execute("SELECT state FROM llm_requests WHERE id = ?", (request_id,)).fetchone()
+                if state is None or state[0] == "cancelled":
+                    self.conn.execute("DELETE FROM llm_requests WHERE id = ?", (request_id,))
+                    self.conn.execute("COMMIT")
+                    raise RequestCancelled(f"The {name} model request was cancelled.")
+                admitted = self._admissible(name, request_id)
+                if admitted:
+                    self.conn.execute("UPDATE llm_requests SET state = 'running', since = ? WHERE id = ?", (time.time(), request_id))
+                self.conn.execute("COMMIT")
+            except RequestCancelled:
+                raise
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return admitted
+
+    def _release(self, request_id: int):
+        with self._lock:
+            self.conn.execute("DELETE FROM llm_requests WHERE id = ?", (request_id,))
+
+    @contextmanager
+    def slot(self, name: str = None):
+        """Holds a slot of the priority class (the current one by default) in the block. Yields the wait, in seconds."""
+        name = name or current_priority()
+        started = time.perf_counter()
+        request_id, admitted = self._enqueue(name)
+        try:
+            while not admitted:
+                time.sleep(self.settings["poll_ms"][name] / 1000)
+                admitted = self._try_admit(request_id, name)
+            yield time.perf_counter() - started
+        finally:
+            self._release(request_id)
+
+    @asynccontextmanager
+    async def aslot(self, name: str = None):
+        """
+        Asynchronous counterpart of `slot`: the task waits on a future of the admission of its event loop
+        (see `_LoopAdmission`), the database is only accessed from threads.
+        """
+        name = name or current_priority()
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        if loop not in self._admissions:
+            self._admissions[loop] = _LoopAdmission(self)
+        request_id = await self._admissions[loop].admit(name)
+        try:
+            yield time.perf_counter() - started
+        finally:
+            await self._admissions[loop].release(name, request_id)
+
+    # --- Management ---
+
+    def cancel(self, name: str = None) -> int:
+        """Cancels the waiting requests of a class (all if None), of every process. Returns their number."""
+        with self._lock:
+            query = "UPDATE llm_requests SET state = 'cancelled' WHERE state = 'waiting'"
+            params = ()
+            if name:
+                query += " AND priority = ?"
+                params = (name,)
+            return self.conn.execute(query, params).rowcount
+
+    def status(self) -> Dict[str, Dict[str, int]]:
+        """Number of waiting and running requests per class (requests of dead processes excluded)."""
+        with self._lock:
+            rows = self.conn.execute("SELECT pid, priority, state FROM llm_requests").fetchall()
+        status = {name: {"waiting": 0, "running": 0} for name in PRIORITIES}
+        alive = {pid: _alive(pid) for pid in {row[0] for row in rows}}
+        for pid, name, state in rows:
+            if alive[pid] and state in ("waiting", "running"):
+                status[name][state] += 1
+        return status
+
+class _LoopAdmission:
+    """
+    Admission of the asynchronous requests of one event loop. They wait in process, per class in arrival
+    order, and a single task registers the first waiting request of each class in the database and polls
+    for its slot (in threads), then hands the slot to it. When a registered request is found cancelled, all
+    the requests of its class waiting in the process are cancelled with it.
+    """
+
+    def __init__(self, scheduler: Scheduler):
+        self.scheduler = scheduler
+        self.waiters: Dict[str, Deque[asyncio.Future]] = {name: deque() for name in PRIORITIES}
+        self.running: Dict[str, int] = {name: 0 for name in PRIORITIES}
+        self.registered: Dict[str, int] = {} # class -> id of its registered request
+        self.task: Optional[asyncio.Task] = None
+
+    async def admit(self, name: str) -> int:
+        """Waits for a slot of the class. Returns the id of the admitted request, to release."""
+        settings = self.scheduler.settings
+        # The requests that can start at once are not queued
+        free = max(min(settings["limits"][name], settings["max_concurrency"]) - self.running[name], 0)
+        queued = len(self.waiters[name]) - free
+        if queued >= settings["max_queue"][name]:
+            raise SchedulerFull(f"Too many {name} model requests waiting ({queued}), try again later.")
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[name].append(future)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # Admitted as the task was cancelled: give the slot back
+            if future.done() and not future.cancelled() and future.exception() is None:
+                await self.release(name, future.result())
+            raise
+
+    async def release(self, name: str, request_id: int):
+        self.running[name] -= 1
+        # The thread completes even if the task is cancelled
+        await asyncio.to_thread(self.scheduler._release, request_id)
+
+    def _fail(self, name: str, error: BaseException):
+        while self.waiters[name]:
+            future = self.waiters[name].popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    def _poll(self, name: str) -> bool:
+        """Registers the first waiting request of the class if needed and tries to admit it (in a thread)."""
+        if name not in self.registered:
+            self.registered[name], admitted = self.scheduler._enqueue(name)
+            if admitted:
+                return True
+        try:
+            return self.scheduler._try_admit(self.registered[name], name)
+        except RequestCancelled:
+            del self.registered[name]
+            raise
+
+    async def run(self):
+        scheduler = self.scheduler
+        # Polls are recorded in `registered` by the thread, so the requests are released even if this task
+        # is cancelled during a poll (e.g. when the event loop is shut down)
+        poll: Optional[asyncio.Future] = None
+        try:
+            while any(self.waiters.values()):
+                admitted_any = False
+                for name in PRIORITIES:
+                    waiters = self.waiters[name]
+                    while waiters and waiters[0].done(): # the waiting task was cancelled
+                        waiters.popleft()
+                    if not waiters:
+                        if name in self.registered:
+                            await asyncio.to_thread(scheduler._release, self.registered.pop(name))
+                        continue
+                    poll = asyncio.ensure_future(asyncio.to_thread(self._poll, name))
+                    try:
+                        admitted = await asyncio.shield(poll)
+                    except SchedulerFull as e:
+                        waiters.popleft().set_exception(e)
+                        continue
+                    except RequestCancelled as e:
+                        self._fail(name, e)
+                        continue
+                    if admitted:
+                        admitted_any = True
+                        request_id = self.registered.pop(name)
+                        self.running[name] += 1
+                        future = waiters.popleft()
+                        if future.done():
+                            await self.release(name, request_id)
+                        else:
+                            future.set_result(request_id)
+                # Poll again at once after an admission, there may be another free slot
+                delays = [scheduler.settings["poll_ms"][name] for name in PRIORITIES if self.waiters[name]]
+                if delays and not admitted_any:
+                    await asyncio.sleep(min(delays) / 1000)
+        except BaseException as e:
+            for name in PRIORITIES:
+                self._fail(name, e if isinstance(e, Exception) else RequestCancelled("The model request admission was stopped."))
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            if poll is not None and not poll.done():
+                await asyncio.wait([poll])
+                if not poll.cancelled():
+                    poll.exception() # the outcome of the poll is in `registered`
+            while self.registered:
+                await asyncio.to_thread(scheduler._release, self.registered.popitem()[1])
+
+_scheduler: Optional[Scheduler] = None
+
+def get_scheduler() -> Optional[Scheduler]:
+    """Returns the process-wide scheduler configured under `llm_scheduler` in the config, or None if disabled."""
+    global _scheduler
+    settings = scheduler_config()
+    if not settings["enabled"]:
+        return None
+    if _scheduler is None:
+        _scheduler = Scheduler(settings)
+    return _scheduler
@@ -0,0 +1,30 @@
+import os
+import sqlite3
+import threading
+from typing import Tuple
+
+class SqliteStore:
+    """
+    Base of the SQLite stores shared by the threads of a process (the LLM cache, metrics and scheduler):
+    the database is opened on first use, in autocommit and WAL mode, with its `SCHEMA` statements run once.
+    The subclasses hold `_lock` around their use of the connection.
+    """
+    SCHEMA: Tuple[str, ...] = ()
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Lazily opens the database (autocommit, WAL)."""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
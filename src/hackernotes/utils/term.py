@@ -23,15 +23,15 @@ def ftag(content: str):
     """ Format string for tag output. """
     return f"{Fore.GREEN}{content}{Style.RESET_ALL}"
 
-# def fstatus(status: str):
-#     if status == QueueStatus.PENDING:
-#         return Fore.YELLOW + status + Style.RESET_ALL
-#     elif status == QueueStatus.PROCESSING:
-#         return Fore.CYAN + status + Style.RESET_ALL
-#     elif status == QueueStatus.COMPLETED:
-#         return Fore.GREEN + status + Style.RESET_ALL
-#     elif status == QueueStatus.FAILED:
-#         return Fore.RED + status + Style.RESET_ALL
+def fstatus(status: str):
+    """ Format string for task status output. """
+    colors = {
+        "PENDING": Fore.YELLOW,
+        "RUNNING": Fore.CYAN,
+        "SUCCESS": Fore.GREEN,
+        "FAILED": Fore.RED,
+    }
+    return f"{colors.get(status, '')}{status}{Style.RESET_ALL}"
 
 # def furl(content: str) -> str:
 #     """Formats URLs in gray color."""
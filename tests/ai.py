@@ -0,0 +1,135 @@
+import hackernotes.core.ai as ai
+from hackernotes.core.ai import ExtractedAnnotations, ExtractedTags, extract_annotations, parse_structured
+from hackernotes.core.annotations import Annotations
+from hackernotes.core.annotations.time import Time
+from hackernotes.core.types import TimeScope
+
+def test_parse_structured():
+    """Test the strict parsing of structured responses and the local repairs."""
+    assert parse_structured('{"tags": ["python"]}', ExtractedTags).tags == ["python"]
+    assert parse_structured('```json\n{"tags": ["python",],}\n```', ExtractedTags).tags == ["python"]
+    assert parse_structured('Here you go: {"tags": ["a"]} Hope it helps!', ExtractedTags).tags == ["a"]
+    assert parse_structured('{"tags": "python"}', ExtractedTags) is None
+    assert parse_structured('not json at all', ExtractedTags) is None
+
+def test_generate_structured_repairs(monkeypatch):
+    """Test that the sync and async structured generations share the repair round trips and their labels."""
+    import asyncio
+    import pytest
+
+    calls = []
+    def fake_generate(sys_prompt, user_prompt, format=None, use_cache=True, **kwargs):
+        calls.append((ai.REPAIR_SYS_PROMPT == sys_prompt, user_prompt))
+        return responses.pop(0)
+    async def fake_agenerate(**kwargs):
+        return fake_generate(**kwargs)
+    monkeypatch.setattr(ai, "llm_generate", fake_generate)
+    monkeypatch.setattr(ai, "llm_agenerate", fake_agenerate)
+
+    for generate in (ai.generate_structured, lambda *args, **kwargs: asyncio.run(ai.agenerate_structured(*args, **kwargs))):
+        calls.clear()
+        responses = ['{"tags": ', '{"tags": ["python"]}']
+        assert generate("sys", "text", ExtractedTags, use_cache=False).tags == ["python"]
+        assert calls == [(False, "text"), (True, '{"tags": ')]
+
+        responses = ['{"tags": ', '{"tags": ']
+        with pytest.raises(ValueError):
+            generate("sys", "text", ExtractedTags, use_cache=False, max_repairs=1)
+        assert not responses
+
+def test_time_serialization():
+    """Test the time annotation (de)serialization."""
+    time = Time(content="tomorrow", value="2025-05-01 00:00:00", scope=TimeScope.DAY)
+    assert time.dumps() == "^tomorrow (2025-05-01 00:00:00, DAY)"
+    assert Time.loads(time.dumps()) == time
+    assert Time.loads("^tomorrow") == Time(content="tomorrow")
+
+    annotations = Annotations(times={time})
+    assert Annotations.loads(annotations.dumps()).times == {time}
+
+def test_combined_extraction(monkeypatch):
+    """Test that a single call extracts everything, with one repair round trip and the split fallback."""
+    calls = []
+    def fake_generate(sys_prompt, user_prompt, format=None, use_cache=True, **kwargs):
+        calls.append(format["title"])
+        return responses.pop(0)
+    monkeypatch.setattr(ai, "llm_generate", fake_generate)
+    monkeypatch.setattr(ai, "local_tags", lambda text, existing_tags=None: None)
+
+    combined = ExtractedAnnotations.model_json_schema()["title"]
+    responses = [
+        '{"tags": ["#python"], "entities": [{"content": "@Alice", "type": "PERSON"}], '
+        '"times": [{"literal": "tomorrow", "value": "2025-05-01", "scope": "DAY"}]}',
+    ]
+    annotations = extract_annotations("text", extract_times=True, use_cache=False, verbose=False, mode="combined", local_times=False, local_entities=False)
+    assert calls == [combined]
+    assert {t.content for t in annotations.tags} == {"python"}
+    assert {e.content for e in annotations.entities} == {"Alice"}
+    assert {t.content for t in annotations.times} == {"tomorrow"}
+
+    # Malformed twice (initial + repair), then the split calls
+    calls.clear()
+    responses = ['{"tags": ', '{"tags": ', '{"tags": ["python"]}', '{"entities": []}']
+    annotations = extract_annotations("text", use_cache=False, verbose=False, mode="combined", local_entities=False)
+    assert calls[:2] == [combined, combined] and len(calls) == 4
+    assert {t.content for t in annotations.tags} == {"python"}
+
+def test_generate_stream(monkeypatch):
+    """Test that the chunks are streamed as they arrive, with timings, and the non-streaming fallback."""
+    import hackernotes.utils.llm as llm
+    from hackernotes.utils.llm import GenerationStats, generate_stream
+    from hackernotes.utils.llm.backends import StubBackend
+
+    backend = StubBackend({"latency_ms": 10})
+    monkeypatch.setattr(llm, "get_backend", lambda backend_name=None: backend)
+    expected = backend.chat([{"role": "system", "content": "sys"}, {"role": "user", "content": "hello streaming world"}]).content
+
+    stats = GenerationStats()
+    chunks = list(generate_stream("sys", "hello streaming world", use_cache=False, stats=stats))
+    assert len(chunks) > 1 and "".join(chunks) == expected
+    assert stats.streamed and stats.tokens == backend.chat([{"role": "user", "content": expected}]).prompt_tokens
+    assert stats.ttft >= 0.01 and stats.elapsed >= stats.ttft
+
+    stats = GenerationStats()
+    assert list(generate_stream("sys", "hello streaming world", use_cache=False, stats=stats, stream=False)) == [expected]
+    assert not stats.streamed
+
+def test_stable_prompt_prefix():
+    """Test that the system prompt does not depend on the note, only the user prompt does."""
+    from hackernotes.core.annotations.tag import Tag
+
+    (sys_a, user_a, _), = ai._extraction_steps("combined", "note a", True, True, False, {Tag(content="python")}, set())
+    (sys_b, user_b, _), = ai._extraction_steps("combined", "note b", True, True, False, set(), set())
+    assert sys_a == sys_b
+    assert user_a.endswith("note a") and "#python" in user_a and user_b == "note b"
+
+def test_incremental_annotation(monkeypatch):
+    """Test that only the snippets new or changed since they were annotated (by the same model and prompt) are pending."""
+    from hackernotes.core.note import Note
+    from hackernotes.core.snippets import Snippets
+    from hackernotes.utils.llm.backends import StubBackend
+
+    backend = StubBackend({"model": "small"})
+    monkeypatch.setattr(ai, "get_backend", lambda backend_name=None: backend)
+    note = Note(snippets=Snippets())
+    note.add("Deploying the cluster.")
+    note.add("Reading about databases.")
+
+    pending = ai.pending_annotation(note, True, True, False)
+    assert pending.ords == {0, 1} and pending.extract_tags and pending.extract_entities and not pending.extract_times
+    assert ai.log_annotated(note, pending)
+    assert not ai.log_annotated(note, pending)
+    assert not ai.pending_annotation(note, True, True, False).ords
+
+    # An edited snippet, a new kind, a new model, and the log round trip through the note file
+    note.snippets.update(1, "Reading about #databases.")
+    pending = ai.pending_annotation(note, True, False, True)
+    assert pending.ords == {0, 1} and pending.extract_tags and pending.extract_times
+    assert note.snippets.dumps(pending.ords) == "[0] Deploying the cluster.\n\n[1] Reading about #databases.\n\n"
+    assert ai.pending_annotation(note, True, False, False).ords == {1}
+    ai.log_annotated(note, ai.pending_annotation(note, True, False, False))
+    assert Note.loads(note.dumps()).annotation_log == note.annotation_log
+    assert not ai.pending_annotation(Note.loads(note.dumps()), True, False, False).ords
+    assert ai.pending_annotation(note, True, False, False, incremental=False).ords == {0, 1}
+    backend.model = "large"
+    assert ai.pending_annotation(note, True, False, False).ords == {0, 1}
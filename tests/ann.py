@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from hackernotes.core.ann import ANN_DEFAULTS, IVFIndex, kmeans
+from hackernotes.core.embeddings import normalize
+
+def clustered_vectors(n: int = 2000, dim: int = 32, clusters: int = 20, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return normalize(centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+
+def make_index(tmp_path, **settings) -> IVFIndex:
+    return IVFIndex(ws=SimpleNamespace(base_dir=str(tmp_path)), settings={**ANN_DEFAULTS, **settings})
+
+def test_kmeans():
+    """Test that the centroids are normalized and all used."""
+    vectors = clustered_vectors()
+    centroids = kmeans(vectors, 20)
+    assert centroids.shape == (20, 32)
+    assert np.allclose(np.linalg.norm(centroids, axis=1), 1, atol=1e-5)
+    assert len(np.unique(np.argmax(vectors @ centroids.T, axis=1))) == 20
+
+def test_ivf_recall(tmp_path):
+    """Test that the approximate search finds the exact neighbours, more of them with more probes."""
+    vectors = clustered_vectors()
+    note_ids = [f"n{i}" for i in range(len(vectors))]
+    index = make_index(tmp_path)
+    index.build(note_ids, vectors)
+
+    def recall(nprobe):
+        hits = 0
+        for q in vectors[:50]:
+            exact = {note_id for note_id, _ in index.search(q, 10, exact=True)}
+            hits += len(exact & {note_id for note_id, _ in index.search(q, 10, nprobe=nprobe)})
+        return hits / 500
+
+    assert recall(1) <= recall(8) <= recall(index.centroids.shape[0]) == 1.0
+    assert recall(8) > 0.9
+
+def test_ivf_update(tmp_path):
+    """Test the incremental updates of the index."""
+    vectors = clustered_vectors(n=200)
+    index = make_index(tmp_path)
+    index.build([f"n{i}" for i in range(200)], vectors)
+
+    # n0 moves next to n1, a new note is added next to n2, n3 is removed
+    index.update(["n0", "new", "n3"], ["n0", "new"], vectors[[1, 2]])
+    index = make_index(tmp_path)
+    assert index.related("n1", k=1, exact=True)[0][0] == "n0"
+    assert index.related("new", k=1, exact=True)[0][0] == "n2"
+    assert index.vector("n3") is None
+    assert "n3" not in {note_id for note_id, _ in index.search(vectors[3], 200, exact=True)}
+    assert index.size == 200
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import hackernotes.core.automation as automation
+from hackernotes.core.ai import PendingAnnotation
+from hackernotes.core.annotations import Annotations
+from hackernotes.core.annotations.tag import Tag
+from hackernotes.core.automation import NoteChanged, annotate_task, backoff_delay
+from hackernotes.core.note import Note
+from hackernotes.core.note.meta import NoteMeta
+from hackernotes.core.types import TaskStatus, TaskType
+from hackernotes.db.migrations import MIGRATIONS, migrate, schema_version
+from hackernotes.db.models import AutomationQueue
+from hackernotes.db.query import TaskCRUD
+
+def create_test_session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/test.db", future=True)
+    migrate(engine)
+    return engine, sessionmaker(bind=engine)()
+
+def test_migrate(tmp_path):
+    """Test that migrations bring a fresh database to the latest version and are idempotent."""
+    engine, _ = create_test_session(tmp_path)
+    assert schema_version(engine) == len(MIGRATIONS)
+    assert migrate(engine) == 0
+
+def test_task_claim(tmp_path):
+    """Test that due tasks are claimed once, in scheduling order."""
+    _, session = create_test_session(tmp_path)
+    now = datetime.now()
+    TaskCRUD.enqueue(session, TaskType.ANNOTATE.value, workspace="ws", note_id="later", scheduled_at=now + timedelta(hours=1))
+    TaskCRUD.enqueue(session, TaskType.ANNOTATE.value, workspace="ws", note_id="second", scheduled_at=now - timedelta(minutes=1))
+    TaskCRUD.enqueue(session, TaskType.ANNOTATE.value, workspace="ws", note_id="first", scheduled_at=now - timedelta(minutes=2))
+    # Deduplicated: the pending task of the same note is reused
+    TaskCRUD.enqueue(session, TaskType.ANNOTATE.value, workspace="ws", note_id="first")
+    # Another workspace
+    TaskCRUD.enqueue(session, TaskType.ANNOTATE.value, workspace="other", note_id="first")
+
+    first = TaskCRUD.claim(session, workspace="ws", worker="w0")
+    assert first.note_id == "first"
+    assert first.status == TaskStatus.RUNNING.value
+    assert first.attempts == 1
+    second = TaskCRUD.claim(session, workspace="ws", worker="w1")
+    assert second.note_id == "second"
+    # The remaining task is not due yet
+    assert TaskCRUD.claim(session, workspace="ws", worker="w0") is None
+    assert TaskCRUD.counts(session, workspace="ws") == {"PENDING": 1, "RUNNING": 2}
+
+def test_task_claim_note_busy(tmp_path):
+    """Test that the tasks of a note wait while another task of the note is running."""
+    _, session = create_test_session(tmp_path)
+    TaskCRUD.enqueue(session, TaskType.ANNOTATE.value, workspace="ws", note_id="note")
+    TaskCRUD.enqueue(session, TaskType.EMBED.value, workspace="ws", note_id="note")
+    TaskCRUD.enqueue(session, TaskType.EMBED.value, workspace="ws", note_id="other")
+    first = TaskCRUD.claim(session, workspace="ws")
+    assert first.task_type == TaskType.ANNOTATE.value
+    assert TaskCRUD.claim(session, workspace="ws").note_id == "other"
+    assert TaskCRUD.claim(session, workspace="ws") is None
+    TaskCRUD.complete(session, first.id)
+    assert TaskCRUD.claim(session, workspace="ws").task_type == TaskType.EMBED.value
+
+def test_annotate_task_note_changed(monkeypatch, tmp_path):
+    """Test that a note saved during its annotation is not overwritten by the worker's older copy."""
+    monkeypatch.setattr(Note, "__get_path__", staticmethod(lambda id: str(tmp_path / f"{id}.hnote")))
+    monkeypatch.setattr(Note, "update_embeddings", lambda self: None)
+    monkeypatch.setattr(Note, "index", classmethod(lambda cls, note_id: None))
+    monkeypatch.setattr(automation, "pending_annotation", lambda note, **kwargs: PendingAnnotation(ords={0}, extract_tags=True))
+    monkeypatch.setattr(automation, "log_annotated", lambda note, pending: True)
+    note = Note(meta=NoteMeta(id="note", title="Note"))
+    note.add("python script")
+    note.persist(queue=False)
+
+    def edit_during_extraction(text, **kwargs):
+        edited = Note.read("note")
+        edited.add("edited meanwhile")
+        edited.persist(queue=False)
+        return Annotations(tags={Tag(content="python")})
+    monkeypatch.setattr(automation, "extract_annotations", edit_during_extraction)
+    with pytest.raises(NoteChanged):
+        annotate_task(AutomationQueue(note_id="note"))
+    assert [s.content for s in Note.read("note").snippets][-1] == "edited meanwhile"
+
+    monkeypatch.setattr(automation, "extract_annotations", lambda text, **kwargs: Annotations(tags={Tag(content="python")}))
+    assert annotate_task(AutomationQueue(note_id="note")) == "#python"
+    assert {t.content for t in Note.read("note").annotations.tags} == {"python"}
+
+def test_task_retry(tmp_path):
+    """Test that failed tasks are rescheduled and only claimed again when due."""
+    _, session = create_test_session(tmp_path)
+    TaskCRUD.enqueue(session, TaskType.ANNOTATE.value, workspace="ws", note_id="note")
+    task = TaskCRUD.claim(session, workspace="ws")
+    TaskCRUD.fail(session, task.id, "boom", retry_at=datetime.now() + timedelta(minutes=1))
+    assert TaskCRUD.claim(session, workspace="ws") is None
+
+    TaskCRUD.fail(session, task.id, "boom", retry_at=datetime.now() - timedelta(seconds=1))
+    task = TaskCRUD.claim(session, workspace="ws")
+    assert task.attempts == 2
+    TaskCRUD.complete(session, task.id, result="done")
+    assert TaskCRUD.counts(session, workspace="ws") == {"SUCCESS": 1}
+
+def test_task_delete(tmp_path):
+    """Test that a task is only deleted from its own workspace."""
+    _, session = create_test_session(tmp_path)
+    other = TaskCRUD.enqueue(session, TaskType.ANNOTATE.value, workspace="other", note_id="note")
+    assert TaskCRUD.delete(session, task_id=other.id, workspace="ws") == 0
+    assert TaskCRUD.delete(session, task_id=other.id, workspace="other") == 1
+
+def test_backoff_delay():
+    assert backoff_delay(1, 30, 3600) == 30
+    assert backoff_delay(3, 30, 3600) == 120
+    assert backoff_delay(10, 30, 3600) == 3600
+
+def test_ensure_schema_uninitialized(monkeypatch):
+    """Test that the queue commands never create the database when it was not initialized."""
+    import hackernotes.core.automation as automation
+
+    migrated = []
+    monkeypatch.setattr(automation, "_schema_ready", False)
+    monkeypatch.setattr(automation, "db_exists", lambda: False)
+    monkeypatch.setattr(automation, "migrate", migrated.append)
+    monkeypatch.setattr(automation, "get_engine", lambda: "engine")
+    assert not automation.ensure_schema()
+    assert automation.run_workers(workers=1, once=True) is None
+    assert migrated == []
+
+    monkeypatch.setattr(automation, "db_exists", lambda: True)
+    assert automation.ensure_schema() and automation.ensure_schema()
+    assert migrated == ["engine"]
@@ -0,0 +1,67 @@
+import asyncio
+
+import pandas as pd
+from click.testing import CliRunner
+
+import hackernotes.cli.ai as cli_ai
+import hackernotes.core.batch as batch
+from hackernotes.cli.ai import ai
+from hackernotes.core.ai import PendingAnnotation
+from hackernotes.core.annotations import Annotations
+from hackernotes.core.annotations.tag import Tag
+from hackernotes.core.batch import annotate_notes
+from hackernotes.core.note import Note
+from hackernotes.core.note.meta import NoteMeta
+from hackernotes.core.snippets import Snippets
+
+def setup_batch(monkeypatch) -> dict:
+    """Notes read on demand, annotated by a slow fake model; tracks the notes read but not done yet."""
+    state = {"open": 0, "max_open": 0, "persisted": [], "indexed": []}
+    def read(note_id):
+        if note_id == "missing":
+            return None
+        state["open"] += 1
+        state["max_open"] = max(state["max_open"], state["open"])
+        note = Note(meta=NoteMeta(id=note_id, title=f"Title {note_id}"), snippets=Snippets())
+        note.add(f"Notes about {note_id}")
+        return note
+    async def fake_aextract(text, **kwargs):
+        await asyncio.sleep(0.01)
+        state["open"] -= 1
+        note_id = text.split()[-1]
+        return Annotations(tags={Tag(content=note_id)}) if note_id in ("n0", "n1") else Annotations()
+    monkeypatch.setattr(batch.Note, "read", read)
+    monkeypatch.setattr(batch.Note, "persist", lambda self, **kwargs: state["persisted"].append(self.meta.id))
+    monkeypatch.setattr(batch.Note, "index_many", classmethod(lambda cls, notes: state["indexed"].extend(n.meta.id for n in notes)))
+    monkeypatch.setattr(batch, "pending_annotation", lambda note, *args: PendingAnnotation(ords={0}, extract_tags=True))
+    monkeypatch.setattr(batch, "log_annotated", lambda note, pending: False)
+    monkeypatch.setattr(batch, "aextract_annotations", fake_aextract)
+    monkeypatch.setattr(batch, "update_embeddings", lambda notes: 0)
+    monkeypatch.setattr(batch, "warm_up", lambda: None)
+    return state
+
+def test_annotate_notes_bounded(monkeypatch):
+    """Test that the notes are read as workers take them, so no more than `concurrency` are in memory."""
+    state = setup_batch(monkeypatch)
+    note_ids = [f"n{i}" for i in range(20)] + ["missing"]
+    report = annotate_notes(note_ids, concurrency=3, local_tagger=False, local_entities=False)
+    assert state["max_open"] <= 3
+    assert report.done == 21 and report.changed == 2 and list(report.failed) == ["missing"]
+    assert sorted(state["persisted"]) == sorted(state["indexed"]) == ["n0", "n1"]
+
+def test_run_all_options(monkeypatch):
+    """Test that `hn ai run --all` passes the extraction kinds and filters to the batch."""
+    calls = []
+    class FakeWorkspace:
+        def list_notes(self, **filters):
+            calls.append(filters)
+            return pd.DataFrame(index=["n0", "n1"])
+    monkeypatch.setattr(cli_ai.Workspace, "get", classmethod(lambda cls, name=None: FakeWorkspace()))
+    monkeypatch.setattr(cli_ai, "annotate_notes", lambda note_ids, **kwargs: calls.append((note_ids, kwargs)) or batch.BatchReport(total=len(note_ids)))
+
+    result = CliRunner().invoke(ai, ["run", "--all", "--times", "--tag", "work", "--no-local", "-j", "2"])
+    assert result.exit_code == 0, result.output
+    filters, (note_ids, options) = calls
+    assert filters["tags"] == ("work",) and note_ids == ["n0", "n1"]
+    assert options["extract_times"] and not options["extract_tags"] and not options["extract_entities"]
+    assert options["concurrency"] == 2 and not options["local_times"] and options["incremental"]
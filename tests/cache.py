@@ -0,0 +1,50 @@
+import os
+import time
+
+from hackernotes.utils.cache import LLMCache, cache_key
+
+def test_cache_key():
+    """Test that the cache key depends on every part of the request."""
+    key = cache_key("ollama", "llama3.2", "sys", "user")
+    assert key == cache_key("ollama", "llama3.2", "sys", "user")
+    assert key != cache_key("ollama", "llama2", "sys", "user")
+    assert key != cache_key("ollama", "llama3.2", "sys", "user2")
+    assert key != cache_key("ollama", "llama3.2", "sys", "user", format={"type": "object"})
+
+def test_cache_hit_miss(tmp_path):
+    """Test the cache hits, misses and statistics."""
+    cache = LLMCache(os.path.join(tmp_path, "cache.db"))
+    key = cache_key("ollama", "llama3.2", "sys", "user")
+
+    assert cache.get(key) is None
+    cache.put(key, "response")
+    assert cache.get(key) == "response"
+
+    stats = cache.stats()
+    assert stats["entries"] == 1
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+def test_cache_ttl(tmp_path):
+    """Test that expired entries are not served."""
+    cache = LLMCache(os.path.join(tmp_path, "cache.db"), ttl_days=1)
+    cache.put("key", "response")
+    cache.conn.execute("UPDATE llm_cache SET created_at = ?", (time.time() - 2 * 24 * 3600,))
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+def test_cache_lru_eviction(tmp_path):
+    """Test that the least recently used entries are evicted beyond the size bound."""
+    cache = LLMCache(os.path.join(tmp_path, "cache.db"), max_size_mb=2.5 / 1024)  # 2.5 KiB
+    cache.put("a", "x" * 1024)
+    time.sleep(0.01)
+    cache.put("b", "x" * 1024)
+    time.sleep(0.01)
+    cache.get("a")  # "a" is now more recently used than "b"
+    time.sleep(0.01)
+    cache.put("c", "x" * 1024)
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
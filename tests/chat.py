@@ -0,0 +1,54 @@
+import hackernotes.core.chat as chat
+from hackernotes.core.chat import ChatSession, RetrievedSnippet, ask
+from hackernotes.utils.llm.backends import StubBackend
+
+SNIPPETS = [
+    RetrievedSnippet(note_id="n1", ord=0, content="The cluster upgrade is planned with Alice. " * 10, score=2.0),
+    RetrievedSnippet(note_id="n2", ord=3, content="Budget review with Bob. " * 10, score=1.0),
+]
+
+def setup_chat(monkeypatch, tmp_path, backend: StubBackend) -> list:
+    searches = []
+    def fake_search(query, k):
+        searches.append(query)
+        return SNIPPETS[:k]
+    monkeypatch.setattr(chat, "get_backend", lambda backend_name=None: backend)
+    monkeypatch.setattr(chat, "search_snippets", fake_search)
+    monkeypatch.setattr(chat, "_notes_version", lambda: 1.0)
+    monkeypatch.setattr(ChatSession, "__get_dir__", classmethod(lambda cls, ws=None: str(tmp_path)))
+    return searches
+
+def test_chat_context_reuse(monkeypatch, tmp_path):
+    """Test that the turns reuse the backend context and the retrievals, and that sessions resume."""
+    searches = setup_chat(monkeypatch, tmp_path, StubBackend())
+    session = ChatSession.new()
+    answer = "".join(ask(session, "When is the cluster upgrade?", k=2))
+    assert answer and session.turns[0].sources == ["n1:0", "n2:3"]
+    first_tokens = session.turns[0].prompt_tokens
+
+    for _ in range(4):
+        "".join(ask(session, "When is the  cluster upgrade?", k=2))
+    assert searches == ["When is the cluster upgrade?"] # memoized
+    tokens = [turn.prompt_tokens for turn in session.turns[1:]]
+    assert max(tokens) < first_tokens / 4 and len(set(tokens)) == 1 # flat, snippets not resent
+
+    resumed = ChatSession.load(session.id)
+    assert resumed.context == session.context and resumed.sent == {"n1:0", "n2:3"}
+    "".join(ask(resumed, "When is the cluster upgrade?", k=2))
+    assert len(searches) == 1 and resumed.turns[-1].prompt_tokens == tokens[-1]
+    assert [s.id for s in ChatSession.list_sessions()] == [session.id]
+
+def test_chat_without_context(monkeypatch, tmp_path):
+    """Test that the recent turns are resent to backends keeping no context."""
+    backend = StubBackend()
+    backend.supports_context = False
+    setup_chat(monkeypatch, tmp_path, backend)
+    monkeypatch.setattr(chat, "chat_config", lambda: {**chat.CHAT_DEFAULTS, "history_turns": 2})
+    session = ChatSession.new()
+    for question in ["First question?", "Second question?", "Third question?"]:
+        "".join(ask(session, question, k=1))
+    assert not session.context and not session.sent
+    prompts = []
+    monkeypatch.setattr(backend, "_converse", lambda system, prompt, context: prompts.append(prompt) or iter([]))
+    "".join(ask(session, "Fourth question?", k=1))
+    assert "Second question?" in prompts[0] and "Third question?" in prompts[0] and "First question?" not in prompts[0]
@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+from hackernotes.core.context import ContextReport, keyword_scores, pack_context
+from hackernotes.core.note import Note
+from hackernotes.core.note.meta import NoteMeta
+from hackernotes.core.snippets import Snippets
+from hackernotes.utils.llm import estimate_tokens
+
+def create_note(id: str, days_ago: int, *contents: str) -> Note:
+    note = Note(meta=NoteMeta(id=id, created_at=datetime.now() - timedelta(days=days_ago)), snippets=Snippets())
+    for content in contents:
+        note.add(content)
+    return note
+
+NOTES = [
+    create_note("old", 10, "Kubernetes cluster upgrade went fine.", "Lunch with Bob."),
+    create_note("new", 1, "Kubernetes cluster upgrade went fine!", "The kubernetes ingress needs new certificates."),
+    create_note("other", 5, *[f"Grocery list item {i}: apples and pears" for i in range(50)]),
+]
+
+def test_keyword_scores():
+    """Test that the BM25 scores favour the snippets with the query words, rare words weighing more."""
+    candidates = [("a", 0, "kubernetes cluster"), ("b", 0, "cluster of apples"), ("c", 0, "nothing relevant")]
+    scores = keyword_scores("kubernetes cluster", candidates)
+    assert scores[0] > scores[1] > scores[2] == 0
+
+def test_pack_context():
+    """Test that the most relevant snippets are packed within the budget, duplicates dropped, in the notes order."""
+    report = ContextReport()
+    texts = pack_context(NOTES, "kubernetes", budget=30, scoring="keyword", report=report)
+    assert texts == [
+        "[1] Lunch with Bob.\n\n",
+        "[0] Kubernetes cluster upgrade went fine!\n\n[1] The kubernetes ingress needs new certificates.\n\n",
+    ]
+    assert report.candidates == 54 and report.selected == 3 and report.duplicates == 1
+    assert report.tokens <= 30 and sum(estimate_tokens(text) for text in texts) <= 30
+
+    # Bounded whatever the number of notes
+    notes = [create_note(f"n{i}", i, f"Note {i} about apples", f"Something else entirely, number {i}") for i in range(500)]
+    texts = pack_context(notes, "apples", budget=200, scoring="keyword")
+    assert sum(estimate_tokens(text) for text in texts) <= 200
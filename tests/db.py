@@ -0,0 +1,188 @@
+import pytest
+from sqlalchemy import create_engine, delete, func, select, text, tuple_, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from hackernotes.core.types import TimeScope
+from hackernotes.db import get_engine
+from hackernotes.db.migrations import MIGRATIONS, migrate
+from hackernotes.db.models import Entity, Note, Snippet, Tag, Workspace
+from hackernotes.db.query import LISTING_COLUMNS, LISTING_ORDER, NoteCRUD, SnippetCRUD, decode_cursor
+from hackernotes.utils.config import config
+
+def create_test_session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/test.db", future=True)
+    migrate(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Workspace(id="ws", name="test", model_backend="stub"))
+    session.commit()
+    return engine, session
+
+def test_bulk_create(tmp_path):
+    """Test that the bulk path creates the notes, their snippets and annotations, and reuses existing tags."""
+    _, session = create_test_session(tmp_path)
+    session.add(Tag(name="python"))
+    session.commit()
+
+    note_ids = NoteCRUD.bulk_create(session, "ws", [
+        dict(title="First", snippets=[
+            dict(content="Deploying with #python and @Alice", tags={"python", "devops"}, entities={"Alice"}),
+            dict(content="Due ^tomorrow", times=[dict(literal="tomorrow", scope=TimeScope.DAY.value)]),
+        ]),
+        dict(title="Second", snippets=[dict(content="More #devops", tags={"devops"})]),
+        dict(title=None, snippets=[]),
+    ])
+    assert len(note_ids) == 3
+
+    assert session.scalar(select(func.count()).select_from(Note)) == 3
+    assert session.scalar(select(func.count()).select_from(Snippet)) == 3
+    assert set(session.scalars(select(Tag.name))) == {"python", "devops"}
+    assert set(session.scalars(select(Entity.name))) == {"Alice"}
+
+    first = NoteCRUD.get(session, note_ids[0])
+    snippets = sorted(first.snippets, key=lambda snippet: snippet.position)
+    assert {tag.name for tag in snippets[0].tags} == {"python", "devops"}
+    assert [time.literal for time in snippets[1].time_exprs] == ["tomorrow"]
+    assert NoteCRUD.get(session, note_ids[2]).title == "Untitled"
+
+    note = NoteCRUD.create(session, "ws", "Single", [dict(content="Hello @Alice", entities={"Alice"})])
+    assert [snippet.content for snippet in note.snippets] == ["Hello @Alice"]
+    assert session.scalar(select(func.count()).select_from(Entity)) == 1
+
+def test_engine_profiles(tmp_path, monkeypatch):
+    """Test that each engine profile sets its pragmas on new connections, and that the analytics one refuses writes."""
+    monkeypatch.setitem(config, "db_profiles", {"bulk": {"cache_size": -1000}})
+
+    path = f"{tmp_path}/profiles.db"
+    migrate(get_engine(path, profile="interactive"))
+    assert get_engine(path, profile="interactive") is get_engine(path, profile="interactive")
+    with get_engine(path, profile="interactive").connect() as conn:
+        assert conn.scalar(text("PRAGMA journal_mode")) == "wal"
+        assert conn.scalar(text("PRAGMA synchronous")) == 1 # NORMAL
+    with get_engine(path, profile="bulk").connect() as conn:
+        assert conn.scalar(text("PRAGMA synchronous")) == 0 # OFF
+        assert conn.scalar(text("PRAGMA cache_size")) == -1000
+    with get_engine(path, profile="analytics").connect() as conn:
+        assert conn.scalar(text("SELECT count(*) FROM note")) == 0
+        with pytest.raises(OperationalError, match="readonly"):
+            conn.execute(text("INSERT INTO tag (name) VALUES ('python')"))
+
+def test_snippet_fts(tmp_path):
+    """Test that the full-text index is backfilled by the migration, kept in sync, and used by the content filter."""
+    engine, session = create_test_session(tmp_path)
+    note_ids = NoteCRUD.bulk_create(session, "ws", [
+        dict(title="Deploy", snippets=[dict(content="Deploying the café cluster"), dict(content="Budget review")]),
+        dict(title="Travel", snippets=[dict(content="Flight to the cluster summit")]),
+    ])
+    # An existing database with the index over the rowids of `snippet`: it is replaced and backfilled
+    with engine.begin() as conn:
+        for trigger in ("insert", "update", "delete"):
+            conn.exec_driver_sql(f"DROP TRIGGER snippet_fts_{trigger}")
+        conn.exec_driver_sql("DROP TABLE snippet_fts")
+        conn.exec_driver_sql("DROP TABLE snippet_fts_rowid")
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE snippet_fts USING fts5(content, content='snippet', content_rowid='rowid')")
+        conn.exec_driver_sql("INSERT INTO snippet_fts (snippet_fts) VALUES ('rebuild')")
+        conn.exec_driver_sql(f"PRAGMA user_version = {len(MIGRATIONS) - 1}")
+    assert migrate(engine) == 1
+
+    rows = SnippetCRUD.search(session, "cafe clust")
+    assert [row.note_id for row in rows] == [note_ids[0]]
+    assert rows[0].passage == "Deploying the [café cluster]"
+    assert {row.note_id for row in SnippetCRUD.search(session, "cluster", workspace_id="ws")} == set(note_ids)
+    assert SnippetCRUD.search(session, "cluster", workspace_id="other") == []
+    assert SnippetCRUD.search(session, "!!") == []
+
+    session.execute(update(Snippet).where(Snippet.content == "Budget review").values(content="Invoice review"))
+    session.execute(delete(Snippet).where(Snippet.content.like("Flight%")))
+    session.commit()
+    assert SnippetCRUD.search(session, "budget") == []
+    assert [row.title for row in SnippetCRUD.search(session, "invoice")] == ["Deploy"]
+    assert [row.title for row in SnippetCRUD.search(session, "cluster")] == ["Deploy"]
+
+    session.add(Workspace(id="ws-default", name=config["active_workspace"], model_backend="stub"))
+    session.commit()
+    NoteCRUD.bulk_create(session, "ws-default", [dict(title="Other", snippets=[dict(content="Invoice for the cluster")])])
+    notes = NoteCRUD.list_by_workspace(session, config["active_workspace"], content=["invoice", "cluster"])
+    assert [note.title for note in notes] == ["Other"]
+
+def test_snippet_fts_renumbered(tmp_path):
+    """Test that the full-text index still matches the right snippets when the rowids of `snippet` change (VACUUM)."""
+    engine, session = create_test_session(tmp_path)
+    NoteCRUD.bulk_create(session, "ws", [
+        dict(title="Deploy", snippets=[dict(content="Deploying the cluster")]),
+        dict(title="Budget", snippets=[dict(content="Budget review")]),
+    ])
+    # `snippet` has no INTEGER PRIMARY KEY: its rowids may be renumbered, as a VACUUM may do
+    with engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE snippet SET rowid = -rowid")
+        conn.exec_driver_sql("UPDATE snippet SET rowid = 3 + rowid") # swapped
+
+    assert [row.title for row in SnippetCRUD.search(session, "cluster")] == ["Deploy"]
+    assert [note.title for note in NoteCRUD.list_by_workspace(session, "test", content=["review"])] == ["Budget"]
+    session.execute(delete(Snippet).where(Snippet.content == "Budget review"))
+    session.execute(update(Snippet).where(Snippet.content.like("Deploying%")).values(content="Deploying the budget"))
+    session.commit()
+    assert [row.title for row in SnippetCRUD.search(session, "budget")] == ["Deploy"]
+    assert SnippetCRUD.search(session, "cluster") == [] and SnippetCRUD.search(session, "review") == []
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM snippet_fts").scalar() == 1
+        assert conn.exec_driver_sql("SELECT count(*) FROM snippet_fts_rowid").scalar() == 1
+
+def query_plan(engine, stmt) -> str:
+    sql = str(stmt.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        return "\n".join(row[3] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+
+def test_note_listing_filters(tmp_path):
+    """Test that the listing filters require every tag and entity, and that they are indexed lookups."""
+    engine, session = create_test_session(tmp_path)
+    session.add(Workspace(id="ws-default", name=config["active_workspace"], model_backend="stub"))
+    session.commit()
+    NoteCRUD.bulk_create(session, "ws-default", [
+        dict(title="Both", snippets=[dict(content="#python", tags={"python"}), dict(content="#devops @Alice", tags={"devops"}, entities={"Alice"})]),
+        dict(title="Python", snippets=[dict(content="#python @Alice", tags={"python"}, entities={"Alice"})]),
+        dict(title="Other", snippets=[dict(content="#devops", tags={"devops"})]),
+    ])
+    notes = NoteCRUD.list_by_workspace(session, config["active_workspace"], tag=["python", "devops"])
+    assert [note.title for note in notes] == ["Both"]
+    assert sorted(tag.name for snippet in notes[0].snippets for tag in snippet.tags) == ["devops", "python"]
+    notes = NoteCRUD.list_by_workspace(session, config["active_workspace"], tag=["python"], entity=["Alice"])
+    assert sorted(note.title for note in notes) == ["Both", "Python"]
+
+    note_ids = NoteCRUD.filter_note_ids(tags=["python", "devops"], entities=["Alice"], content=["python"])
+    plan = query_plan(engine, select(Note.id).where(Note.workspace_id == "ws", Note.id.in_(note_ids)).order_by(Note.updated_at.desc()))
+    assert "USING COVERING INDEX ix_note_workspace_id_updated_at (workspace_id=?)" in plan
+    assert plan.count("USING COVERING INDEX ix_snippet_tag_tag_name (tag_name=?)") == 2
+    assert "USING COVERING INDEX ix_snippet_entity_entity_name (entity_name=?)" in plan
+    assert "VIRTUAL TABLE INDEX 0:M" in plan
+    assert "SCAN snippet" not in plan.replace("SCAN snippet_fts", "")
+    assert "USING INDEX ix_snippet_note_id" in query_plan(engine, select(Snippet).where(Snippet.note_id.in_(["a", "b"])))
+
+def test_note_pages(tmp_path):
+    """Test that the pages cover every note once in a stable order, through the index, and that bad cursors are refused."""
+    engine, session = create_test_session(tmp_path)
+    session.add(Workspace(id="ws-default", name=config["active_workspace"], model_backend="stub"))
+    session.commit()
+    # One transaction: the notes share their `updated_at`, only the id breaks the ties
+    note_ids = NoteCRUD.bulk_create(session, "ws-default", [dict(title=f"Note {i}", snippets=[]) for i in range(7)])
+    session.execute(update(Note).where(Note.id == note_ids[0]).values(archived=True)) # and updated last
+    session.commit()
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = NoteCRUD.page(session, config["active_workspace"], cursor=cursor, page_size=3)
+        seen.extend(row.id for row in rows)
+        if cursor is None:
+            break
+    assert seen == sorted(note_ids[1:], reverse=True)
+    assert [row.id for row in NoteCRUD.iter_by_workspace(session, config["active_workspace"], batch_size=2, all=True)] == note_ids[:1] + seen
+    assert [note.id for note in NoteCRUD.list_by_workspace(session, config["active_workspace"], limit=2)] == seen[:2]
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        NoteCRUD.page(session, config["active_workspace"], cursor="not-a-cursor")
+
+    _, cursor = NoteCRUD.page(session, config["active_workspace"], page_size=3)
+    updated_at, note_id = decode_cursor(cursor)
+    stmt = select(*LISTING_COLUMNS).where(Note.workspace_id == "ws-default", tuple_(Note.updated_at, Note.id) < (updated_at, note_id))
+    plan = query_plan(engine, stmt.order_by(*LISTING_ORDER).limit(3))
+    assert "USING INDEX ix_note_workspace_id_updated_at (workspace_id=? AND (updated_at,id)<(?,?))" in plan
+    assert "TEMP B-TREE" not in plan
@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import hackernotes.core.embeddings as embeddings
+from hackernotes.core.embeddings import EmbeddingIndex, top_k
+from hackernotes.core.note import Note
+from hackernotes.core.note.meta import NoteMeta
+from hackernotes.core.snippets import Snippets
+from hackernotes.core.types import TaskType
+
+VOCABULARY = ["python", "sql", "docker", "kernel", "music", "coffee"]
+
+def fake_embed(texts, model=None):
+    """Bag-of-words vectors over a tiny vocabulary."""
+    return [[text.lower().count(word) + 0.01 for word in VOCABULARY] for text in texts]
+
+def make_note(id: str, *contents: str) -> Note:
+    snippets = Snippets()
+    for content in contents:
+        snippets.add(content)
+    meta = NoteMeta(title=id)
+    meta.id = id
+    return Note(meta=meta, snippets=snippets)
+
+def test_top_k():
+    """Test the partial sort top-k."""
+    scores = np.array([0.1, 0.9, 0.5, 0.7, -1.0])
+    assert top_k(scores, 3).tolist() == [1, 3, 2]
+    assert top_k(scores, 10).tolist() == [1, 3, 2, 0, 4]
+
+def test_semantic_index(tmp_path, monkeypatch):
+    """Test the incremental updates and the search of the embedding index."""
+    calls = []
+    def counting_embed(texts, model=None):
+        calls.append(len(texts))
+        return fake_embed(texts)
+    monkeypatch.setattr(embeddings, "llm_embed", counting_embed)
+    index = EmbeddingIndex(ws=SimpleNamespace(base_dir=str(tmp_path)), settings={**embeddings.EMBEDDINGS_DEFAULTS, "model": "fake", "batch_size": 2})
+
+    a = make_note("a", "python and sql", "docker kernel")
+    b = make_note("b", "music and coffee", "python and sql")
+    assert index.rebuild([a, b]) == 3 # the same content is embedded once
+    assert calls == [2, 1]
+    assert [(hit.note_id, hit.ord) for hit in index.search("coffee music", k=1)] == [("b", 0)]
+
+    # Unchanged notes are not embedded again
+    calls.clear()
+    assert index.update([a, b]) == 0 and not calls
+
+    # Only the changed snippet is embedded, its old row is not returned anymore
+    a.snippets.update(1, "coffee coffee")
+    assert index.update([a]) == 1
+    hits = index.search("docker kernel", k=10)
+    assert ("a", 1) in [(hit.note_id, hit.ord) for hit in hits]
+    assert len(hits) == 4
+    assert EmbeddingIndex(ws=SimpleNamespace(base_dir=str(tmp_path))).search("coffee", k=1)[0].note_id in ("a", "b")
+
+    index.remove("b")
+    assert {hit.note_id for hit in index.search("music", k=10)} == {"a"}
+
+    index.compact()
+    assert len(index.ids) == 2 and index.live.all()
+    assert [(hit.note_id, hit.ord) for hit in index.search("python", k=1)] == [("a", 0)]
+
+def test_persist_embedding(tmp_path, monkeypatch):
+    """Test that a save queues the re-embedding, only if the workspace has a semantic index, without touching the backend."""
+    ws = SimpleNamespace(base_dir=str(tmp_path), name="test")
+    monkeypatch.setattr(embeddings.Workspace, "get", classmethod(lambda cls, *args, **kwargs: ws))
+    def no_backend(*args, **kwargs):
+        raise AssertionError("the backend must not be resolved")
+    monkeypatch.setattr(embeddings, "get_backend", no_backend)
+    queued = []
+    monkeypatch.setattr(Note, "to_queue", lambda self, task_type=TaskType.ANNOTATE: queued.append(task_type) or True)
+
+    note = make_note("a", "python and sql")
+    note.persist()
+    assert not queued and embeddings.update_embeddings([note]) == 0
+    embeddings.remove_embeddings("a")
+
+    EmbeddingIndex(ws=ws, settings={**embeddings.EMBEDDINGS_DEFAULTS, "model": "fake"}).__write__()
+    note.persist()
+    note.persist(queue=False)
+    assert queued == [TaskType.EMBED]
+
+    monkeypatch.setattr(embeddings, "llm_embed", fake_embed)
+    note.persist(embed=True)
+    assert queued == [TaskType.EMBED]
+    assert len(EmbeddingIndex(ws=ws).ids) == 1
@@ -0,0 +1,48 @@
+import asyncio
+
+import hackernotes.core.fanout as fanout
+from hackernotes.core.fanout import FanOutReport, prompt_notes
+from hackernotes.core.note import Note
+from hackernotes.core.note.meta import NoteMeta
+from hackernotes.core.snippets import Snippets
+
+def setup_notes(monkeypatch, delays: dict) -> dict:
+    """Notes answered after their delay, with the maximum number of calls in flight."""
+    state = {"in_flight": 0, "max_in_flight": 0}
+    def read(note_id):
+        if note_id == "missing":
+            return None
+        note = Note(meta=NoteMeta(id=note_id, title=f"Title {note_id}"), snippets=Snippets())
+        note.add(f"Content of {note_id}")
+        return note
+    async def fake_agenerate(sys_prompt, user_prompt, use_cache=True, **kwargs):
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(delays[user_prompt.split()[-1]])
+        state["in_flight"] -= 1
+        return user_prompt.split()[-1].upper()
+    monkeypatch.setattr(fanout.Note, "read", read)
+    monkeypatch.setattr(fanout, "llm_agenerate", fake_agenerate)
+    monkeypatch.setattr(fanout, "warm_up", lambda: None)
+    return state
+
+def test_fan_out(monkeypatch):
+    """Test that the calls are bounded and the results come in completion order, errors included."""
+    delays = {f"n{i}": 0.05 * (5 - i) for i in range(5)}
+    state = setup_notes(monkeypatch, delays)
+    results = []
+    report = prompt_notes("Summarize", list(delays) + ["missing"], results.append, concurrency=2)
+    assert state["max_in_flight"] == 2
+    assert report.done == 6 and report.failed == 1
+    by_id = {r.note_id: r for r in results}
+    assert by_id["missing"].error == "note not found"
+    assert {note_id: by_id[note_id].response for note_id in delays} == {f"n{i}": f"N{i}" for i in range(5)}
+    assert results[0].note_id == "n1" and results[0].title == "Title n1" # completion order
+
+def test_fan_out_ordered(monkeypatch):
+    """Test that the ordered mode outputs the results in the order of the notes."""
+    delays = {f"n{i}": 0.02 * (5 - i) for i in range(5)}
+    setup_notes(monkeypatch, delays)
+    results = []
+    report = prompt_notes("Summarize", list(delays), results.append, concurrency=5, ordered=True, report=FanOutReport())
+    assert [r.note_id for r in results] == list(delays) and report.done == 5
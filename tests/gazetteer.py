@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+import hackernotes.core.ai as ai
+import hackernotes.core.gazetteer as gazetteer
+from hackernotes.core.ai import extract_annotations
+from hackernotes.core.annotations import Annotations
+from hackernotes.core.annotations.entity import Entity
+from hackernotes.core.gazetteer import Gazetteer
+from hackernotes.core.types import EntityType
+from hackernotes.utils.config import config
+
+ENTITIES = [
+    Entity(content="GrandVision", type=EntityType.ORGANIZATION),
+    Entity(content="GrandVision", type=EntityType.ORGANIZATION),
+    Entity(content="Alice", type=EntityType.PERSON),
+    Entity(content="Jordan", type=EntityType.PERSON),
+    Entity(content="Jordan", type=EntityType.LOCATION),
+    Entity(content="Bob"),
+]
+
+def test_gazetteer_find():
+    """Test that only the agreed types are learnt, and which entities of a text are left to the model."""
+    local_gazetteer = Gazetteer({"min_agreement": 0.75}).fit(ENTITIES)
+    assert local_gazetteer.learnt == {"GrandVision": "ORGANIZATION", "Alice": "PERSON"}
+
+    known, unknown = local_gazetteer.find("Meeting @GrandVision with Alice. Bob joins later, and @Carol.")
+    assert known == {Entity(content="GrandVision", type=EntityType.ORGANIZATION), Entity(content="Alice", type=EntityType.PERSON)}
+    # "Meeting" and "Bob" start sentences
+    assert unknown == {"Carol"}
+    assert local_gazetteer.find("Call with Alice", ignore={"Alice"}) == (set(), set())
+
+    # Single capitalized words written once (acronyms, products, after a colon) are not worth a model call
+    assert local_gazetteer.find("Deploy the API on Kubernetes, todo: Docker") == (set(), set())
+    known, unknown = local_gazetteer.find("Call with Alice Martin and Dan Brown about Kubernetes, then Kubernetes again. Alice will.")
+    assert known == {Entity(content="Alice", type=EntityType.PERSON)} and unknown == {"Dan Brown", "Kubernetes"}
+
+    local_gazetteer.user = {"Alice": "UNKNOWN", "Carol": "PERSON"}
+    known, unknown = local_gazetteer.find("Meeting with Alice and @Carol")
+    assert known == {Entity(content="Carol", type=EntityType.PERSON)} and unknown == {"Alice"}
+
+def test_gazetteer_evaluate():
+    """Test that a note is evaluated by a gazetteer that did not learn it, on its text without the @ markers."""
+    notes = [
+        ("Review with @GrandVision", {Entity(content="GrandVision", type=EntityType.ORGANIZATION)}),
+        ("Call @GrandVision and Alice", {Entity(content="GrandVision", type=EntityType.ORGANIZATION), Entity(content="Alice", type=EntityType.PERSON)}),
+        ("Lunch with Alice Martin", {Entity(content="Alice", type=EntityType.PERSON)}),
+    ]
+    report = gazetteer.evaluate(notes, folds=3, settings={"min_agreement": 0.75})
+    # Learnt from the two others: GrandVision is typed in the first two notes, Alice in the second and last
+    assert (report.notes, report.local, report.typed, report.correct, report.expected) == (3, 3, 4, 4, 4)
+    # Alice is not learnt from the first note: missed in the second one, but written once, not worth a model call
+    report = gazetteer.evaluate(notes[:2], folds=2, settings={"min_agreement": 0.75})
+    assert (report.local, report.correct, report.expected) == (2, 2, 3) and report.call_reduction == 1.0
+
+def test_gazetteer_typing(monkeypatch):
+    """Test that known entities are typed as they are written, and that the model is only asked for new ones."""
+    local_gazetteer = Gazetteer({"min_agreement": 0.75}).fit(ENTITIES)
+    monkeypatch.setitem(config, "active_workspace", "DEFAULT")
+    monkeypatch.setattr(gazetteer.Workspace, "exists", classmethod(lambda cls, name: True))
+    monkeypatch.setattr(gazetteer, "get_gazetteer", lambda rebuild=False, refresh=True: local_gazetteer)
+
+    annotations = Annotations.extract("Review with @GrandVision and @Bob")
+    assert annotations.entities == {Entity(content="GrandVision", type=EntityType.ORGANIZATION), Entity(content="Bob")}
+
+    calls = []
+    def fake_generate(sys_prompt, user_prompt, format=None, use_cache=True, **kwargs):
+        calls.append(user_prompt)
+        return '{"entities": [{"content": "Bob", "type": "PERSON"}]}'
+    monkeypatch.setattr(ai, "llm_generate", fake_generate)
+
+    annotations = extract_annotations("Review with @GrandVision and Alice", extract_tags=False, verbose=False, mode="split")
+    assert not calls
+    assert annotations.entities == {Entity(content="GrandVision", type=EntityType.ORGANIZATION), Entity(content="Alice", type=EntityType.PERSON)}
+
+    annotations = extract_annotations("Review with @GrandVision and @Bob", extract_tags=False, verbose=False, mode="split")
+    assert len(calls) == 1 and calls[0].startswith("You must ignore the entities that are already in the text:\n@GrandVision\n")
+    assert annotations.entities == {Entity(content="GrandVision", type=EntityType.ORGANIZATION), Entity(content="Bob", type=EntityType.PERSON)}
+
+def test_gazetteer_update(monkeypatch, tmp_path):
+    """Test that only the changed notes are read and learnt again, and that typing a snippet never learns."""
+    notes = {
+        "n0": [Entity(content="GrandVision", type=EntityType.ORGANIZATION), Entity(content="Alice", type=EntityType.PERSON)],
+        "n1": [Entity(content="GrandVision", type=EntityType.ORGANIZATION)],
+        "n2": [Entity(content="Jordan", type=EntityType.LOCATION)],
+    }
+    reads = []
+    def read(note_id):
+        reads.append(note_id)
+        return SimpleNamespace(meta=SimpleNamespace(id=note_id), annotations=SimpleNamespace(entities=set(notes[note_id])))
+    monkeypatch.setattr(gazetteer.Note, "read", staticmethod(read))
+    index = lambda: pd.DataFrame(
+        {"Updated At": ["2026-01-01"] * len(notes), "Entities": [",".join(sorted(f"{e.content}:{e.type.value}" for e in notes[i])) for i in notes]},
+        index=list(notes),
+    )
+    ws = SimpleNamespace(name="test", base_dir=str(tmp_path), get_index=index)
+
+    local_gazetteer = Gazetteer({"min_agreement": 0.75})
+    assert local_gazetteer.update(ws) == 3 and local_gazetteer.learnt == {"GrandVision": "ORGANIZATION", "Alice": "PERSON", "Jordan": "LOCATION"}
+    reads.clear()
+    notes["n2"] = [Entity(content="Jordan", type=EntityType.PERSON)]
+    notes["n3"] = [Entity(content="Jordan", type=EntityType.LOCATION)]
+    del notes["n0"]
+    assert local_gazetteer.update(ws) == 3 and sorted(reads) == ["n2", "n3"]
+    # Jordan's types now disagree
+    assert local_gazetteer.learnt == {"GrandVision": "ORGANIZATION"}
+    assert local_gazetteer.learnt == Gazetteer({"min_agreement": 0.75}).fit(e for entities in notes.values() for e in entities).learnt
+
+    # Nothing learnt nor saved yet: the entities of a snippet are left untyped, no note is read
+    reads.clear()
+    monkeypatch.setitem(config, "active_workspace", "test")
+    monkeypatch.setattr(gazetteer.Workspace, "exists", classmethod(lambda cls, name: True))
+    monkeypatch.setattr(gazetteer.Workspace, "get", classmethod(lambda cls, name=None: ws))
+    monkeypatch.setattr(gazetteer, "_gazetteers", {})
+    open(tmp_path / "__index__.tsv", "w").close()
+    assert gazetteer.type_entities({Entity(content="GrandVision")}) == {Entity(content="GrandVision")} and not reads
+    assert gazetteer.get_gazetteer().learnt == {"GrandVision": "ORGANIZATION"} and sorted(reads) == ["n1", "n2", "n3"]
+    assert gazetteer.type_entities({Entity(content="GrandVision")}) == {Entity(content="GrandVision", type=EntityType.ORGANIZATION)}
+    saved = Gazetteer.load(ws)
+    assert (saved.learnt, saved.counts, saved.learnt_notes) == (local_gazetteer.learnt, local_gazetteer.counts, local_gazetteer.learnt_notes)
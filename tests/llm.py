@@ -0,0 +1,132 @@
+import json
+import os
+import time
+
+import pytest
+
+import hackernotes.utils.llm as llm
+from hackernotes.core.ai import ExtractedAnnotations
+import hackernotes.utils.llm.metrics as metrics
+from hackernotes.utils.llm import get_backend, llm_generate, llm_generate_batch, prompt_context
+from hackernotes.utils.llm.backends import CassetteBackend, CassetteMiss, OllamaBackend, StubBackend
+
+MESSAGES = [{"role": "system", "content": "Extract."}, {"role": "user", "content": "Deploying the kubernetes cluster with Alice"}]
+
+def use_settings(monkeypatch, name: str, settings: dict):
+    monkeypatch.setattr(llm, "model_settings", lambda backend=None: (backend or name, settings))
+
+def test_get_backend(monkeypatch):
+    """Test that the backend follows the workspace settings and is reused between calls."""
+    use_settings(monkeypatch, "ollama", {"model": "qwen2.5:7b", "api_url": "http://localhost:11435"})
+    backend = get_backend()
+    assert isinstance(backend, OllamaBackend)
+    assert backend.model == "qwen2.5:7b" and backend.host == "http://localhost:11435"
+    assert get_backend() is backend
+    assert backend.client is backend.client
+    assert isinstance(get_backend("stub"), StubBackend)
+
+def test_stub_backend():
+    """Test that the stub backend is deterministic and returns valid structured output."""
+    backend = StubBackend({"latency_ms": 1})
+    assert backend.chat(MESSAGES).content == StubBackend().chat(MESSAGES).content
+    assert backend.chat(MESSAGES).content != backend.chat(MESSAGES[:1] + [{"role": "user", "content": "other"}]).content
+
+    response = backend.chat(MESSAGES, format=ExtractedAnnotations.model_json_schema())
+    extracted = ExtractedAnnotations.model_validate_json(response.content)
+    assert extracted.tags == ["kubernetes", "Deploying", "cluster"]
+    assert response.prompt_tokens > 0 and response.completion_tokens > 0
+
+    embeddings = backend.embed(["kubernetes cluster", "kubernetes cluster", "coffee"])
+    assert embeddings[0] == embeddings[1] != embeddings[2]
+
+def test_batch(monkeypatch):
+    """Test that the batch responses are in the order of the prompts, the cached ones not sent again."""
+    use_settings(monkeypatch, "stub", {"latency_ms": 20})
+    prompts = [f"note number {i}" for i in range(20)]
+    expected = [get_backend().chat(llm._messages("sys", prompt)).content for prompt in prompts]
+    assert llm_generate_batch("sys", prompts, use_cache=False, concurrency=20) == expected
+    assert json.loads(llm_generate_batch("sys", prompts[:1], format={"type": "object", "properties": {"n": {"type": "integer"}}}, use_cache=False)[0]) == {"n": 0}
+
+def test_metrics(monkeypatch, tmp_path):
+    """Test that the calls are timed, labelled with their prompt name and aggregated, and traced."""
+    store = metrics.MetricsStore(os.path.join(tmp_path, "metrics.db"), trace_path=os.path.join(tmp_path, "trace.jsonl"))
+    monkeypatch.setattr(metrics, "_metrics", store)
+    use_settings(monkeypatch, "stub", {"latency_ms": 20})
+
+    with prompt_context("summary"):
+        llm_generate("sys", "first note", use_cache=False)
+        list(get_backend().stream(llm._messages("sys", "second note")))
+    llm_generate_batch("sys", [f"note {i}" for i in range(4)], use_cache=False, concurrency=1)
+
+    records = store.records()
+    assert list(records["prompt"]) == ["summary"] * 2 + ["unnamed"] * 4
+    assert (records["total"] >= 0.02).all() and (records["prompt_tokens"] > 0).all()
+    assert records["ttft"].notna().iloc[1]
+    # With one slot, the later requests of the batch wait for the earlier ones
+    assert records["queue_wait"].iloc[-1] >= 0.02
+
+    summary, unnamed = store.aggregate()
+    assert (summary["prompt"], summary["model"], summary["calls"], summary["errors"]) == ("summary", "stub", 2, 0)
+    assert unnamed["completion_tokens"] == records["completion_tokens"].iloc[2:].sum()
+    with open(store.trace_path) as f:
+        assert [json.loads(line)["prompt"] for line in f] == list(records["prompt"])
+
+def test_stream_labels(monkeypatch, tmp_path):
+    """Test that a stream is labelled with its prompt name without leaking it to the calls made between its chunks."""
+    import contextvars
+    from hackernotes.core.ai import PREDEFINED_PROMPTS, generate_stream
+
+    store = metrics.MetricsStore(os.path.join(tmp_path, "metrics.db"))
+    monkeypatch.setattr(metrics, "_metrics", store)
+    use_settings(monkeypatch, "stub", {"latency_ms": 1})
+    name = next(iter(PREDEFINED_PROMPTS))
+
+    chunks = generate_stream(name, "a note long enough to stream in several chunks", use_cache=False)
+    next(chunks)
+    assert metrics.current_prompt() is None
+    llm_generate("sys", "between the chunks", use_cache=False)
+    list(chunks)
+    assert list(store.records()["prompt"]) == ["unnamed", name.upper()]
+
+    # Closed from another context (e.g. collected there), the stream has no context to restore
+    chunks = generate_stream(name, "another note to stream", use_cache=False)
+    next(chunks)
+    contextvars.Context().run(chunks.close)
+
+def test_warm_up():
+    """Test that a warmed-up model does not pay the cold start, until it is unloaded."""
+    backend = StubBackend({"cold_start_ms": 50})
+    assert backend.warm_up() >= 0.05
+    started = time.perf_counter()
+    backend.chat(MESSAGES)
+    assert time.perf_counter() - started < 0.05
+
+    backend.unload()
+    started = time.perf_counter()
+    backend.chat(MESSAGES)
+    assert time.perf_counter() - started >= 0.05
+
+def test_cassette_backend(tmp_path):
+    """Test that a recorded cassette replays the same responses, with the recorded or scaled latencies, offline."""
+    path = os.path.join(tmp_path, "cassette.jsonl")
+    recorder = CassetteBackend({"mode": "record", "path": path, "backend": "stub", "backend_config": {"latency_ms": 50}})
+    recorded = recorder.chat(MESSAGES)
+    streamed = [chunk.content for chunk in recorder.stream(MESSAGES)]
+    embeddings = recorder.embed(["kubernetes cluster"])
+
+    replayer = CassetteBackend({"mode": "replay", "path": path, "latency_scale": 0})
+    assert replayer.model == "stub" and replayer.supports_context
+    started = time.perf_counter()
+    assert replayer.chat(MESSAGES) == recorded
+    assert [chunk.content for chunk in replayer.stream(MESSAGES)] == streamed
+    assert replayer.embed(["kubernetes cluster"]) == embeddings
+    assert time.perf_counter() - started < 0.05
+
+    # Recorded latencies, scaled
+    replayer = CassetteBackend({"mode": "replay", "path": path, "latency_scale": 2})
+    started = time.perf_counter()
+    replayer.chat(MESSAGES)
+    assert time.perf_counter() - started >= 0.1
+
+    with pytest.raises(CassetteMiss):
+        replayer.chat(MESSAGES[:1] + [{"role": "user", "content": "not recorded"}])
@@ -0,0 +1,39 @@
+import hackernotes.core.mapreduce as mapreduce
+from hackernotes.core.mapreduce import MapReduceReport, chunk_texts, map_reduce_stream
+from hackernotes.utils.llm import estimate_tokens
+
+NOTES = [f"Note {i}: " + "some words about the topic " * (5 + i % 7) for i in range(60)]
+
+def test_chunk_budget():
+    """Test that the chunks stay within the budget and keep all the text."""
+    chunks = chunk_texts(NOTES + ["x" * 2000], budget=200)
+    assert all(estimate_tokens(chunk) <= 200 for chunk in chunks)
+    assert all(note in "".join(chunks) for note in NOTES)
+    assert chunk_texts(NOTES[:2], budget=10_000) == [NOTES[0] + mapreduce.CHUNK_SEPARATOR + NOTES[1]]
+
+def test_chunk_stability():
+    """Test that adding a note only changes the chunks around it."""
+    before = chunk_texts(NOTES, budget=200)
+    after = chunk_texts(NOTES[:30] + ["A brand new note."] + NOTES[30:], budget=200)
+    assert len(set(after) - set(before)) <= 2
+
+def test_map_reduce(monkeypatch):
+    """Test that the prompt is mapped over the chunks and the partial results are reduced."""
+    calls = []
+    async def fake_agenerate(sys_prompt, user_prompt, use_cache=True, **kwargs):
+        calls.append(sys_prompt)
+        return "partial"
+    monkeypatch.setattr(mapreduce, "llm_agenerate", fake_agenerate)
+    monkeypatch.setattr(mapreduce, "warm_up", lambda: None)
+    monkeypatch.setattr(mapreduce, "generate_stream", lambda sys_prompt, text, **kwargs: iter([sys_prompt, text]))
+
+    report = MapReduceReport()
+    final_prompt, final_text = map_reduce_stream("REWRITE", NOTES, chunk_tokens=200, report=report)
+    assert report.chunks > 1 and len(calls) == report.chunks
+    assert final_prompt == mapreduce.REDUCE_SYS_PROMPT.format(task=mapreduce.get_predefined_prompt("REWRITE").strip())
+    assert final_text.count("partial") == report.chunks
+
+    # Fits in a single chunk: no map step
+    calls.clear()
+    final_prompt, final_text = map_reduce_stream("REWRITE", NOTES[:2], chunk_tokens=10_000)
+    assert not calls and final_prompt == mapreduce.get_predefined_prompt("REWRITE")
@@ -1,7 +1,16 @@
+import os
+import stat
+
+import hackernotes.core.workspace as workspace
 from hackernotes.core.note import Note
 from hackernotes.core.note.meta import NoteMeta
 from hackernotes.core.snippets import Snippets
 from hackernotes.core.annotations import Annotations
+from hackernotes.core.annotations.entity import Entity
+from hackernotes.core.annotations.tag import Tag
+from hackernotes.core.types import EntityType
+from hackernotes.core.workspace import Workspace
+from hackernotes.utils import write_atomic
 
 def create_test_note(id: str = None) -> Note:
     snippets = Snippets()
@@ -74,10 +83,15 @@ def test_note_dump_and_load():
     assert loaded_note.meta.title == note.meta.title
     assert loaded_note.meta.archived == note.meta.archived
 
-def test_note_io():
-    """Test the IO operations of a note."""
+def test_note_io(monkeypatch, tmp_path):
+    """Test the IO operations of a note (its annotations are collected from the snippets when saved)."""
+    monkeypatch.setattr(workspace, "WORKSPACES_DIR", str(tmp_path))
+    ws = Workspace(name="test")
+    os.makedirs(ws.base_dir)
+    monkeypatch.setattr(Workspace, "get", classmethod(lambda cls, name=None: ws))
 
     note = create_test_note(id="test_id")
+    note.snippets.update(1, "This is another #test snippet, an #example.")
 
     # Persist the note
     note.persist()
@@ -105,3 +119,78 @@ def test_note_io():
     assert loaded_note.meta.title == note.meta.title
     assert loaded_note.meta.archived == note.meta.archived
 
+def test_snippets_not_shared():
+    """Test that the notes (and their snippets) created in one process do not share their snippets."""
+    first, second = Note(meta=NoteMeta(title="First")), Note(meta=NoteMeta(title="Second"))
+    first.add("Only in the first note.")
+    assert first.snippets.length == 1 and second.snippets.length == 0
+    assert Snippets().length == 0
+
+def test_apply_annotations():
+    """Test that new annotations go to the snippets they occur in, the others to a new snippet."""
+    note = Note(meta=NoteMeta(title="Apply"))
+    note.add("Deployed the kubernetes cluster.")
+    note.add("Lunch with Alice.")
+    remaining = note.apply_annotations(Annotations(
+        tags={Tag(content="kubernetes"), Tag(content="infra")},
+        entities={Entity(content="Alice", type=EntityType.PERSON)},
+    ))
+    assert remaining.tags == {Tag(content="infra")} and not remaining.entities
+    assert note.snippets[0].annotations.has_tag("kubernetes")
+    assert Entity(content="Alice", type=EntityType.PERSON) in note.snippets[1].annotations.entities
+    assert note.snippets.length == 3 and note.snippets[2].annotations.has_tag("infra")
+    assert note.annotations.has_tag("kubernetes") and note.annotations.has_tag("infra")
+
+def test_index_many_and_tag_filter(monkeypatch, tmp_path):
+    """Test that many notes are indexed at once, and listed by the tags they all have."""
+    monkeypatch.setattr(workspace, "WORKSPACES_DIR", str(tmp_path))
+    ws = Workspace(name="test")
+    os.makedirs(ws.base_dir)
+    notes = []
+    for i, line in enumerate(["#python #work script", "#python notebook", "#cooking bread"]):
+        note = Note(meta=NoteMeta(id=f"n{i}", title=f"Note {i}"))
+        note.add(line)
+        notes.append(note)
+    Note.index_many(notes, ws=ws)
+
+    assert sorted(ws.list_notes().index) == ["n0", "n1", "n2"]
+    assert sorted(ws.list_notes(tags=["python"]).index) == ["n0", "n1"]
+    assert list(ws.list_notes(tags=["#python", "work"]).index) == ["n0"]
+    Note.remove_from_index("n2", ws=ws)
+    Note.remove_from_index("n2", ws=ws) # no longer indexed
+    assert sorted(ws.list_notes().index) == ["n0", "n1"]
+
+def test_index_concurrent(monkeypatch, tmp_path):
+    """Test that notes indexed by concurrent threads (e.g. the automation workers) are all kept."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(workspace, "WORKSPACES_DIR", str(tmp_path))
+    ws = Workspace(name="test")
+    os.makedirs(ws.base_dir)
+    notes = []
+    for i in range(16):
+        note = Note(meta=NoteMeta(id=f"n{i}", title=f"Note {i}"))
+        note.add(f"#tag{i} snippet")
+        notes.append(note)
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda note: Note.index_many([note], ws=ws), notes))
+    assert sorted(ws.list_notes().index) == sorted(note.meta.id for note in notes)
+    assert sorted(os.listdir(ws.base_dir)) == ["__index__.tsv"]
+
+def test_write_atomic_mode(tmp_path, monkeypatch):
+    """Test that a rewritten file keeps its permissions, and that a new one gets the default ones without touching the umask."""
+    import hackernotes.utils as utils
+
+    def umask(mask):
+        raise AssertionError("The umask is process-wide, other threads would create files with this one")
+    monkeypatch.setattr(utils, "_UMASK", 0o022)
+    monkeypatch.setattr(os, "umask", umask)
+    path = os.path.join(tmp_path, "note.hnote")
+    write_atomic(path, lambda f: f.write("first"))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+    os.chmod(path, 0o640)
+    write_atomic(path, lambda f: f.write("second"))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    with open(path) as f:
+        assert f.read() == "second"
+    assert os.listdir(tmp_path) == ["note.hnote"]
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import os
+
+import pytest
+
+from hackernotes.utils.config import config
+from hackernotes.utils.llm.scheduler import SCHEDULER_DEFAULTS, RequestCancelled, Scheduler, SchedulerFull, priority, scheduler_config
+
+def _scheduler(tmp_path, **settings) -> Scheduler:
+    return Scheduler({**SCHEDULER_DEFAULTS, "path": os.path.join(tmp_path, "scheduler.db"), **settings})
+
+def test_scheduler_config(monkeypatch):
+    """Test that the configured settings override the defaults, the per class ones class by class."""
+    monkeypatch.setitem(config, "llm_scheduler", {"max_concurrency": 8, "limits": {"bulk": 1}})
+    settings = scheduler_config()
+    assert settings["max_concurrency"] == 8 and settings["reserved_interactive"] == SCHEDULER_DEFAULTS["reserved_interactive"]
+    assert settings["limits"] == {**SCHEDULER_DEFAULTS["limits"], "bulk": 1}
+
+def test_scheduler_priorities(tmp_path):
+    """Test that the lower classes leave the reserved slot free and yield to the waiting higher ones."""
+    scheduler = _scheduler(tmp_path, max_concurrency=2, reserved_interactive=1)
+
+    bulk, admitted = scheduler._enqueue("bulk")
+    assert admitted
+    # The last slot is reserved: a second bulk request waits, an interactive one starts at once
+    bulk2, admitted = scheduler._enqueue("bulk")
+    assert not admitted and not scheduler._try_admit(bulk2, "bulk")
+    interactive, admitted = scheduler._enqueue("interactive")
+    assert admitted
+
+    # A waiting interactive request goes before the waiting bulk one when the bulk slot frees
+    interactive2, admitted = scheduler._enqueue("interactive")
+    assert not admitted
+    scheduler._release(bulk)
+    assert not scheduler._try_admit(bulk2, "bulk")
+    assert scheduler._try_admit(interactive2, "interactive")
+    assert scheduler.status()["bulk"] == {"waiting": 1, "running": 0}
+    assert scheduler.status()["interactive"] == {"waiting": 0, "running": 2}
+
+def test_scheduler_uncontended(tmp_path, monkeypatch):
+    """Test that a request starts at once, without polling, when no other request holds or waits for a slot."""
+    scheduler = _scheduler(tmp_path)
+    def no_poll(*args):
+        raise AssertionError("An uncontended request polled")
+    monkeypatch.setattr(scheduler, "_try_admit", no_poll)
+    monkeypatch.setattr("time.sleep", no_poll)
+    with scheduler.slot("bulk"), scheduler.slot("interactive"):
+        pass
+    async def main():
+        async with scheduler.aslot("background"):
+            pass
+    asyncio.run(main())
+    assert scheduler.status() == {name: {"waiting": 0, "running": 0} for name in ("interactive", "background", "bulk")}
+
+def test_scheduler_admission_and_cancel(tmp_path):
+    """Test that requests beyond the queue bound are refused and that waiting requests can be cancelled."""
+    scheduler = _scheduler(tmp_path, max_concurrency=1, reserved_interactive=0, max_queue={**SCHEDULER_DEFAULTS["max_queue"], "bulk": 1})
+
+    with scheduler.slot("interactive"):
+        waiting, _ = scheduler._enqueue("bulk")
+        with pytest.raises(SchedulerFull):
+            scheduler._enqueue("bulk")
+        assert scheduler.cancel("bulk") == 1
+        with pytest.raises(RequestCancelled):
+            scheduler._try_admit(waiting, "bulk")
+
+        # An asynchronous request is cancelled while it waits
+        async def wait_for_slot():
+            with priority("bulk"):
+                async with scheduler.aslot():
+                    pass
+        async def cancel_soon():
+            task = asyncio.create_task(wait_for_slot())
+            await asyncio.sleep(0.15)
+            assert scheduler.status()["bulk"]["waiting"] == 1
+            scheduler.cancel()
+            await task
+        with pytest.raises(RequestCancelled):
+            asyncio.run(cancel_soon())
+
+    assert scheduler.status() == {name: {"waiting": 0, "running": 0} for name in ("interactive", "background", "bulk")}
+
+def test_scheduler_async_admission(tmp_path):
+    """Test that the asynchronous requests wait in process, one registered per class, polled off the event loop."""
+    scheduler = _scheduler(tmp_path, max_concurrency=2, reserved_interactive=0, max_queue={**SCHEDULER_DEFAULTS["max_queue"], "bulk": 6})
+    threads = set()
+    try_admit = scheduler._try_admit
+    def tracking_try_admit(request_id, name):
+        threads.add(threading.current_thread() is threading.main_thread())
+        return try_admit(request_id, name)
+    scheduler._try_admit = tracking_try_admit
+
+    running, peak, order = 0, 0, []
+    async def request(i: int):
+        nonlocal running, peak
+        async with scheduler.aslot("bulk"):
+            running += 1
+            peak = max(peak, running)
+            order.append(i)
+            await asyncio.sleep(0.1)
+            running -= 1
+
+    async def main():
+        tasks = [asyncio.create_task(request(i)) for i in range(2)]
+        await asyncio.sleep(0.05)
+        tasks += [asyncio.create_task(request(i)) for i in range(2, 8)]
+        await asyncio.sleep(0.01)
+        status = await asyncio.to_thread(scheduler.status)
+        # Too many requests waiting in the process
+        with pytest.raises(SchedulerFull):
+            async with scheduler.aslot("bulk"):
+                pass
+        await asyncio.gather(*tasks)
+        return status
+
+    status = asyncio.run(main())
+    assert status["bulk"]["running"] == 2 and status["bulk"]["waiting"] == 1
+    assert peak == 2 and sorted(order) == list(range(8)) and order[:2] == [0, 1]
+    assert threads == {False}
+    assert scheduler.status()["bulk"] == {"waiting": 0, "running": 0}
+
+    # The event loop shut down while requests wait: their rows are released, later requests are not blocked
+    async def interrupted():
+        for i in range(4):
+            asyncio.create_task(request(i))
+        await asyncio.sleep(0.05)
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        asyncio.run(interrupted())
+    assert scheduler.status()["bulk"] == {"waiting": 0, "running": 0}
+    with scheduler.slot("bulk") as waited:
+        assert waited < 0.1
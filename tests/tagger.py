@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+import hackernotes.core.ai as ai
+import hackernotes.core.tagger as tagger_module
+from hackernotes.core.ai import extract_annotations
+from hackernotes.core.annotations.tag import Tag
+from hackernotes.core.tagger import LocalTagger, evaluate, tokenize, without_tags
+
+TOPICS = {
+    "python": "wrote a #python script with pandas dataframe and pytest fixtures",
+    "kubernetes": "deployed the #kubernetes cluster pods with helm charts and kubectl",
+    "cooking": "baked sourdough bread with flour yeast and a hot oven",
+}
+NOTES = [(f"{text} (note {i})", {topic, "work"} if topic != "cooking" else {topic}) for i in range(6) for topic, text in TOPICS.items()]
+
+def test_tokenize():
+    """Test that annotation markers and stopwords are stripped."""
+    assert tokenize("Wrote the #python script with @Alice") == ["wrote", "python", "script", "alice"]
+
+def test_propose():
+    """Test that known tags are proposed with confidence, and unknown vocabulary is left to the model."""
+    tagger = LocalTagger({"threshold": 0.6, "min_support": 2, "max_tags": 5}).fit(NOTES)
+    proposals = tagger.propose("debugging a pytest fixture that loads a pandas dataframe")
+    assert proposals[0].tag == "python" and proposals[0].confidence >= 0.6
+    assert tagger.confident_tags("debugging a pytest fixture that loads a pandas dataframe") >= {Tag(content="python")}
+    assert tagger.confident_tags("a poem about the sea") is None
+    # Tags already on the note are not proposed again, but support the ones they co-occur with
+    assert "python" not in {p.tag for p in tagger.propose("pytest pandas", existing_tags={"python"})}
+    assert "work" in {p.tag for p in tagger.propose("", existing_tags={"kubernetes"})}
+
+def test_evaluate():
+    """Test the cross-validated call reduction and precision."""
+    report = evaluate(NOTES, folds=4, settings={"threshold": 0.6, "min_support": 2, "max_tags": 5})
+    assert report.notes == len(NOTES)
+    assert report.call_reduction == 1.0 and report.precision == 1.0
+    assert report.propose_us > 0
+
+    # The tag words of a held-out note are not in its text: a note only tagged by its own words is left to the model
+    assert without_tags("a #Python script in python-3, not pythonic", {"python"}).split() == ["a", "script", "in", "python-3,", "not", "pythonic"]
+    notes = NOTES + [(f"#rust (note {i})", {"rust"}) for i in range(6)]
+    report = evaluate(notes, folds=4, settings={"threshold": 0.6, "min_support": 2, "max_tags": 5})
+    assert report.local == len(NOTES) and report.notes == len(notes)
+
+def test_local_tags_skip_model(monkeypatch):
+    """Test that the model is not asked for tags the local tagger is confident about."""
+    calls = []
+    def fake_generate(sys_prompt, user_prompt, format=None, use_cache=True, **kwargs):
+        calls.append(format["title"])
+        return '{"entities": [{"content": "Alice", "type": "PERSON"}]}'
+    monkeypatch.setattr(ai, "llm_generate", fake_generate)
+    monkeypatch.setattr(ai, "local_tags", lambda text, existing_tags=None: {Tag(content="python")})
+
+    annotations = extract_annotations("pytest with Alice", extract_entitites=False, verbose=False)
+    assert not calls and annotations.tags == {Tag(content="python")}
+    annotations = extract_annotations("pytest with Alice", verbose=False, mode="split", local_entities=False)
+    assert calls == ["ExtractedEntities"] and annotations.tags == {Tag(content="python")}
+    assert {e.content for e in annotations.entities} == {"Alice"}
+
+def test_tagger_update(monkeypatch):
+    """Test that only the notes whose index entry changed are read and learnt again, removed ones unlearnt."""
+    notes = {f"n{i}": (text, tags) for i, (text, tags) in enumerate(NOTES)}
+    def make_index():
+        return pd.DataFrame(
+            {"Updated At": [f"2026-01-{len(notes[i][0]) % 28 + 1:02d}" for i in notes], "Tags": [",".join(sorted(notes[i][1])) for i in notes]},
+            index=list(notes),
+        )
+    reads = []
+    def read(note_id):
+        reads.append(note_id)
+        text, tags = notes[note_id]
+        return SimpleNamespace(
+            meta=SimpleNamespace(id=note_id),
+            snippets=SimpleNamespace(dumps=lambda: text),
+            annotations=SimpleNamespace(tags={Tag(content=tag) for tag in tags}),
+        )
+    monkeypatch.setattr(tagger_module.Note, "read", staticmethod(read))
+    ws = SimpleNamespace(get_index=make_index)
+    settings = {"threshold": 0.6, "min_support": 2, "max_tags": 5}
+
+    tagger = LocalTagger(settings)
+    assert tagger.update(ws) == len(NOTES) and len(reads) == len(NOTES)
+    reads.clear()
+    assert tagger.update(ws) == 0 and not reads
+
+    # A note retagged, another one deleted
+    notes["n0"] = ("baked a #cooking cake with flour (note 0)", {"cooking"})
+    del notes["n1"]
+    assert tagger.update(ws) == 2 and reads == ["n0"]
+    assert tagger.dump() == LocalTagger(settings).fit(notes.values()).dump()
+    assert tagger.confident_tags("flour and yeast") == {Tag(content="cooking")}
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import hackernotes.core.ai as ai
+from hackernotes.core.ai import extract_annotations
+from hackernotes.core.annotations import Annotations
+from hackernotes.core.annotations.time import Time
+from hackernotes.core.annotations.timeparse import find_times, parse_time
+from hackernotes.core.types import TimeScope
+
+NOW = datetime(2025, 4, 30, 10, 15) # a Wednesday
+
+def resolved(text: str) -> dict:
+    return {t.content: (t.value, t.scope) for t in find_times(text, NOW)}
+
+def test_relative_times():
+    """Test the expressions relative to the reference date."""
+    assert resolved("Call Bob tomorrow at 3pm, then again in 2 weeks.") == {
+        "tomorrow at 3pm": ("2025-05-01 15:00:00", TimeScope.HOUR),
+        "in 2 weeks": ("2025-05-14 00:00:00", TimeScope.WEEK),
+    }
+    assert resolved("next Friday, last Monday, this Monday") == {
+        "next Friday": ("2025-05-02 00:00:00", TimeScope.DAY),
+        "last Monday": ("2025-04-28 00:00:00", TimeScope.DAY),
+        "this Monday": ("2025-04-28 00:00:00", TimeScope.DAY),
+    }
+    assert resolved("3 days ago, next month") == {
+        "3 days ago": ("2025-04-27 00:00:00", TimeScope.DAY),
+        "next month": ("2025-05-01 00:00:00", TimeScope.MONTH),
+    }
+
+def test_absolute_times():
+    """Test the dates, and the expressions that are not times."""
+    assert resolved("Released on 2025-05-01 14:30, planned for May 3rd and 4 June 2026.") == {
+        "2025-05-01 14:30": ("2025-05-01 14:30:00", TimeScope.MINUTE),
+        "May 3rd": ("2025-05-03 00:00:00", TimeScope.DAY),
+        "4 June 2026": ("2026-06-04 00:00:00", TimeScope.DAY),
+    }
+    assert resolved("25/12 and in 2024") == {
+        "25/12": ("2025-12-25 00:00:00", TimeScope.DAY),
+        "in 2024": ("2024-01-01 00:00:00", TimeScope.YEAR),
+    }
+    assert resolved("you may 5 times check v1.2/3 and ^today #friday") == {}
+
+def test_invalid_times():
+    """Test that the impossible dates and times of day, and the fractions, are not times."""
+    assert resolved("ratio 3/4 done, at 25:00, on 31/02/2026, Feb 30 and 30th of February") == {}
+    assert resolved("13pm, 0/5 and 2025-02-30 or 2025-05-01 24:10") == {}
+    # A valid expression right after an invalid one is still found
+    assert resolved("Feb 30, then tomorrow") == {"tomorrow": ("2025-05-01 00:00:00", TimeScope.DAY)}
+
+def test_ambiguous_times():
+    """Test that the expressions needing context are found but left unresolved."""
+    assert resolved("Meeting on Friday, report due 03/04/2025") == {
+        "on Friday": (None, None),
+        "03/04/2025": (None, None),
+    }
+    assert resolved("Friday, or due 3/4") == {"Friday": (None, None), "3/4": (None, None)}
+
+def test_parse_time():
+    """Test the resolution of whole literals, and of the time markers of a note."""
+    assert parse_time(" tomorrow ", NOW) == Time(content="tomorrow", value="2025-05-01 00:00:00", scope=TimeScope.DAY)
+    assert parse_time("tomorrow or later", NOW) is None
+    assert parse_time("on Friday", NOW) is None
+
+    times = Annotations.extract("Ship it ^tomorrow, then review next week.", NOW).times
+    assert times == {
+        Time(content="tomorrow", value="2025-05-01 00:00:00", scope=TimeScope.DAY),
+        Time(content="next week", value="2025-05-05 00:00:00", scope=TimeScope.WEEK),
+    }
+
+def test_local_times_extraction(monkeypatch):
+    """Test that the model is only asked for the times when some are ambiguous."""
+    calls = []
+    def fake_generate(sys_prompt, user_prompt, format=None, use_cache=True, **kwargs):
+        calls.append(format["title"])
+        return '{"times": [{"literal": "on Friday", "value": "2025-05-02", "scope": "DAY"}, {"literal": "tomorrow", "value": "2030-01-01", "scope": "DAY"}]}'
+    monkeypatch.setattr(ai, "llm_generate", fake_generate)
+
+    annotations = extract_annotations("Deploy tomorrow.", extract_tags=False, extract_entitites=False, extract_times=True, verbose=False)
+    assert not calls and {t.content for t in annotations.times} == {"tomorrow"}
+
+    annotations = extract_annotations("Deploy tomorrow, demo on Friday.", extract_tags=False, extract_entitites=False, extract_times=True, verbose=False)
+    assert len(calls) == 1
+    times = {t.content: t for t in annotations.times}
+    assert set(times) == {"tomorrow", "on Friday"}
+    assert times["tomorrow"].value != "2030-01-01 00:00:00" # the local resolution wins